@@ -1,3 +1,40 @@
-from . import search
-find = search.position
-near = search.reverse
+"""Address search engine for France.
+
+The modules of the package, and numpy with them, are imported on the first
+use of their functions, so importing the package is fast.
+"""
+import importlib
+
+functions = {
+    'find': ('search', 'position'),
+    'find_many': ('search', 'position_many'),
+    'find_insee': ('search', 'position_insee'),
+    'near': ('search', 'reverse'),
+    'near_many': ('search', 'reverse_many'),
+    'preload': ('query', 'preload'),
+}
+
+modules = ['activate_reverse', 'ban_processing', 'batch', 'bench', 'cache',
+           'datapaths', 'datatypes', 'distance', 'download', 'index',
+           'lookup', 'metrics', 'nearest', 'ngram', 'normalize', 'query',
+           'result', 'search', 'server', 'similarity', 'synthetic', 'trace',
+           'utils']
+
+
+def __getattr__(name):
+    if name in functions:
+        module_name, function_name = functions[name]
+        module = importlib.import_module('.' + module_name, __name__)
+        value = getattr(module, function_name)
+    elif name in modules:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(functions) + modules)
@@ -1,30 +1,145 @@
 #!/usr/bin/env python
+import importlib
 import sys
 
-from .download import get_ban_file, decompress
-from .index import process_files, create_database
-from .activate_reverse import create_kdtree
-
 
+# The functions run by each command, as (module, function) pairs: the
+# modules are imported only when their command runs
 commands = {
-    'download': [get_ban_file],
-    'decompress': [decompress],
-    'index': [process_files, create_database],
-    'reverse': [create_kdtree],
-    'update': [get_ban_file, decompress, process_files, create_database]
+    'download': [('download', 'get_ban_file')],
+    'decompress': [('download', 'decompress')],
+    'index': [('index', 'process_files'), ('index', 'create_database')],
+    'index --incremental': [('index', 'process_changed_files'),
+                            ('index', 'create_database'),
+                            ('activate_reverse', 'update_kdtree')],
+    'reverse': [('activate_reverse', 'create_kdtree')],
+    'update': [('download', 'get_ban_file'), ('index', 'process_files'),
+               ('index', 'create_database')],
+    'update --incremental': [('download', 'get_ban_file'),
+                             ('index', 'process_changed_files'),
+                             ('index', 'create_database'),
+                             ('activate_reverse', 'update_kdtree')],
+    'serve': [('server', 'serve')],
+    'serve --metrics': [('server', 'serve_with_metrics')],
+    'load': [('server', 'load_test')],
+    'batch': [('batch', 'geocode')],
+    'batch --reverse': [('batch', 'reverse_geocode')],
+    'bench': [('bench', 'run')],
+    'generate': [('synthetic', 'generate_files')],
+    'generate --force': [('synthetic', 'regenerate_files')],
+}
+
+
+def get_module(name):
+    return importlib.import_module('.' + name, __package__)
+
+
+def parse_size(text):
+    # A size in bytes, with an optional suffix K, M or G
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_list(text):
+    # Values separated by commas
+    return [value.strip() for value in text.split(',') if value.strip()]
+
+
+# The options --name=value (or --name value) of each command, with their type
+# and the module attribute they set
+options = {
+    'index': {
+        '--memory-limit': (parse_size, 'index', 'memory_limit'),
+    },
+    'update': {
+        '--memory-limit': (parse_size, 'index', 'memory_limit'),
+    },
+    'serve': {
+        '--host': (str, 'server', 'host'),
+        '--port': (int, 'server', 'port'),
+        '--workers': (int, 'server', 'workers'),
+    },
+    'load': {
+        '--host': (str, 'server', 'host'),
+        '--port': (int, 'server', 'port'),
+        '--requests': (int, 'server', 'load_requests'),
+        '--concurrency': (int, 'server', 'load_concurrency'),
+        '--endpoint': (str, 'server', 'load_endpoint'),
+    },
+    'batch': {
+        '--workers': (int, 'batch', 'workers'),
+        '--cols': (str, 'batch', 'cols'),
+        '--chunk-size': (int, 'batch', 'chunk_size'),
+        '--delimiter': (str, 'batch', 'delimiter'),
+    },
+    'bench': {
+        '--requests': (int, 'bench', 'count'),
+        '--scenarios': (str, 'bench', 'selected'),
+        '--output': (str, 'bench', 'output_path'),
+        '--baseline': (str, 'bench', 'baseline_path'),
+        '--seed': (int, 'bench', 'seed'),
+    },
+    'generate': {
+        '--scale': (float, 'synthetic', 'scale'),
+        '--seed': (int, 'synthetic', 'seed'),
+        '--departements': (parse_list, 'synthetic', 'departements'),
+    },
 }
 
 
 def main(args=None):
-    command = sys.argv[1:]
+    args = sys.argv[1:]
+
+    try:
+        # The options of another command are left in args, so the command
+        # is not valid
+        command_options = options.get(args[0], {}) if args else {}
+        i = 0
+        while i < len(args):
+            name, equal, value = args[i].partition('=')
+            if name not in command_options:
+                i += 1
+                continue
+            if not equal:
+                value = args.pop(i + 1)
+            parse, module, attribute = command_options[name]
+            setattr(get_module(module), attribute, parse(value))
+            del args[i]
+
+        # The input and output files of the batch command
+        if args[:1] == ['batch']:
+            files = [arg for arg in args[1:] if not arg.startswith('--')]
+            batch = get_module('batch')
+            batch.input_path, batch.output_path = files
+            args = [arg for arg in args if arg not in files]
+    except (ValueError, IndexError):
+        args = None
+    command = ' '.join(args) if args is not None else None
 
-    if not command or command[0] not in commands:
+    if command not in commands:
         print('usage: geocoding '
-              '{update, download, decompress, index, reverse}')
+              '{update, download, decompress, index, reverse, serve, load, '
+              'batch, bench, generate} '
+              '[--incremental (update, index)] [--metrics (serve)] '
+              '[--memory-limit=SIZE (update, index)] '
+              '[--host=HOST] [--port=PORT (serve, load)] '
+              '[--workers=N (serve)] '
+              '[--requests=N] [--concurrency=N] '
+              '[--endpoint={find, near, find_many, near_many} (load)]\n'
+              '       geocoding batch [--reverse] INPUT OUTPUT '
+              '[--cols=COLUMNS] [--chunk-size=N] [--workers=N] '
+              '[--delimiter=CHAR]\n'
+              '       geocoding bench [--scenarios=NAMES] [--requests=N] '
+              '[--output=FILE] [--baseline=FILE] [--seed=N]\n'
+              '       geocoding generate [--force] [--scale=SCALE] '
+              '[--seed=N] [--departements=CODES]')
         return
 
-    for function in commands[command[0]]:
-        success = function()
+    for module, function in commands[command]:
+        success = getattr(get_module(module), function)()
         if not success:
             return
 
@@ -1,50 +1,323 @@
-import gc
-import numpy as np
+"""Construction of the kd-tree used by the reverse search.
+
+The kd-tree is built in bulk from the localisation table: each node is the
+median of the addresses of its region along one axis (the longitude and the
+latitude alternately), which splits this region in the regions of its two
+children. The nodes are stored in pre-order in the kdtree table, so the
+subtree of a segment of addresses occupies a contiguous range of the table
+whose position is known before it is built. The upper levels are built first
+and the subtrees below them can then be built independently, in parallel.
+
+The tree only depends on the positions of the addresses: their fingerprint is
+saved with the tree, so it is built again only when they change.
 
-from kdquery import Tree
+Attributes:
+    partition_limit (int): Segments of addresses larger than this are split
+        with one call to numpy.argpartition each, the others are split all at
+        once by sorting them.
+    chunk_size (int): The maximum number of addresses sorted at once when
+        splitting the small segments.
+    segment_limit (int): The maximum number of segments processed at once in
+        one level of the tree.
+    parallel_limit (int): The minimum number of addresses to use a pool of
+        processes.
 
-from .index import create_dat_file
-from .datatypes import dtypes
-from .datapaths import paths
-from .utils import pre_order, degree_to_int
+"""
+import hashlib
+import os
+import numpy as np
+from multiprocessing import Pool
+
+from .datatypes import dtypes, get_dtypes
+from .datapaths import paths, kdtree_fingerprint
+from .utils import degree_to_int
 from .download import completion_bar
 
+partition_limit = 4096
+chunk_size = 2 ** 20
+segment_limit = 2 ** 16
+parallel_limit = 2 ** 20
+
+
+def partition(order, coordinates, starts, ends):
+    """Put the median of each segment of order in the middle of the segment.
+
+    After the partition, the addresses at the left of the median of a segment
+    are lower or equal to the median along coordinates and those at its right
+    are greater or equal.
+
+    Args:
+        order (:obj:`numpy.ndarray`): The order of the addresses, modified in
+            place.
+        coordinates (:obj:`numpy.ndarray`): The coordinate of each address
+            along the axis of the split.
+        starts (:obj:`numpy.ndarray`): The start of each segment in order.
+        ends (:obj:`numpy.ndarray`): The end of each segment in order.
+
+    """
+    lengths = ends - starts
+
+    # Large segments: one partition each
+    for start, end in zip(starts[lengths > partition_limit],
+                          ends[lengths > partition_limit]):
+        segment = order[start: end]
+        median = (end - start) // 2
+        order[start: end] = \
+            segment[np.argpartition(coordinates[segment], median)]
+
+    # Small segments: sort them by segment and coordinate, by chunks
+    small = (lengths > 1) & (lengths <= partition_limit)
+    starts, ends, lengths = starts[small], ends[small], lengths[small]
+    cumulative = np.cumsum(lengths)
+    cuts = np.searchsorted(cumulative, np.arange(
+        chunk_size, cumulative[-1] if len(cumulative) else 0, chunk_size))
+    for chunk in np.split(np.arange(len(starts)), np.unique(cuts)):
+        if not len(chunk):
+            continue
+        chunk_lengths = lengths[chunk]
+        offsets = starts[chunk] - np.cumsum(chunk_lengths) + chunk_lengths
+        positions = np.arange(chunk_lengths.sum()) + \
+            np.repeat(offsets, chunk_lengths)
+        segment_ids = np.repeat(np.arange(len(chunk), dtype='uint64'),
+                                chunk_lengths)
+
+        addresses = order[positions]
+        keys = (coordinates[addresses].astype('int64') + 2 ** 31)
+        keys = (segment_ids << np.uint64(32)) | keys.astype('uint64')
+        order[positions] = addresses[np.argsort(keys, kind='stable')]
+
+
+def build(tree, ids, lons, lats, order, level, depth, levels=None,
+          progress=None):
+    """Build the subtrees of a list of segments of addresses.
+
+    Args:
+        tree (:obj:`numpy.ndarray`): The kdtree table.
+        ids (:obj:`numpy.ndarray`): The index in the localisation table of
+            each address.
+        lons (:obj:`numpy.ndarray`): The longitude of each address.
+        lats (:obj:`numpy.ndarray`): The latitude of each address.
+        order (:obj:`numpy.ndarray`): The order of the addresses, modified in
+            place, such that the segments refer to positions in this order.
+        level (:obj:`dict` of :obj:`numpy.ndarray`): The segments of
+            addresses at the root of the subtrees, with the fields start, end,
+            position (the index in the kdtree table of the root of each
+            subtree) and the limits left, right, bottom and top of the region
+            of each subtree.
+        depth (int): The depth of the segments in the tree.
+        levels (int, optional): If given, only this number of levels of the
+            subtrees is built.
+        progress (:obj:`function`, optional): Called with the number of nodes
+            written after each level of the tree.
+
+    Returns:
+        (:obj:`tuple`)
+        (level (:obj:`dict` of :obj:`numpy.ndarray`): The segments at the
+             root of the subtrees that remain to build,
+         depth (int): The depth of these segments)
+
+    """
+    last_depth = depth + levels if levels is not None else None
+    while len(level['start']) and depth != last_depth:
+        # Bound the memory used by the deepest levels: build the subtrees of
+        # each half of the segments one after the other.
+        if levels is None and len(level['start']) > segment_limit:
+            half = len(level['start']) // 2
+            for part in (slice(None, half), slice(half, None)):
+                build(tree, ids, lons, lats, order,
+                      {field: values[part] for field, values in level.items()},
+                      depth, progress=progress)
+            return {field: values[:0] for field, values in level.items()}, \
+                depth
+
+        axis = depth % 2
+        coordinates = lons if axis == 0 else lats
+        starts, ends, positions = level['start'], level['end'], \
+            level['position']
+        partition(order, coordinates, starts, ends)
+
+        # Write the nodes of this level
+        halves = (ends - starts) // 2
+        medians = order[starts + halves]
+        has_left = (halves > 0)
+        has_right = (ends - starts - halves - 1 > 0)
+        columns = {
+            'longitude': lons[medians],
+            'latitude': lats[medians],
+            'limit_left': level['left'],
+            'limit_right': level['right'],
+            'limit_bottom': level['bottom'],
+            'limit_top': level['top'],
+            'dimension': axis,
+            'left': np.where(has_left, positions + 1, -1),
+            'right': np.where(has_right, positions + 1 + halves, -1),
+            'ref_id': ids[medians],
+        }
+        for field, column in columns.items():
+            tree[field][positions] = column
+
+        # The segments of the next level
+        split = coordinates[medians]
+        left_child = {field: values[has_left]
+                      for field, values in level.items()}
+        left_child['end'] = (starts + halves)[has_left]
+        left_child['position'] = (positions + 1)[has_left]
+        left_child['right' if axis == 0 else 'top'] = split[has_left]
+
+        right_child = {field: values[has_right]
+                       for field, values in level.items()}
+        right_child['start'] = (starts + halves + 1)[has_right]
+        right_child['position'] = (positions + 1 + halves)[has_right]
+        right_child['left' if axis == 0 else 'bottom'] = split[has_right]
 
-def node_to_tuple(node):
-    left = node.left if node.left is not None else -1
-    right = node.right if node.right is not None else -1
+        level = {field: np.concatenate((left_child[field],
+                                        right_child[field])).astype('int32')
+                 for field in level}
+        depth += 1
 
-    return node.point + tuple(node.region[0]) + tuple(node.region[1]) + \
-        (node.axis, left, right, node.data)
+        if progress is not None:
+            progress(len(starts))
 
+    return level, depth
 
-def create_kdtree():
-    table = np.memmap(paths['localisation'], dtype=dtypes['localisation'])
-    indices = np.argsort(table, order='longitude').astype('int32')
+
+def build_subtree(task):
+    """Build the subtree of one segment of addresses in a worker process.
+
+    Args:
+        task (:obj:`tuple`): The index in the localisation table of the
+            addresses of the segment, the segment (as in the method build,
+            with only one element) and its depth.
+
+    Returns:
+        (int): The number of nodes written.
+
+    """
+    ids, segment, depth = task
+    localisation = np.memmap(paths['localisation'],
+                             dtype=get_dtypes()['localisation'], mode='r')
+    lons = localisation['longitude'][ids]
+    lats = localisation['latitude'][ids]
+
+    tree = np.memmap(paths['kdtree'], dtype=dtypes['kdtree'], mode='r+')
+    order = np.arange(len(ids), dtype='int32')
+    segment = dict(segment, start=np.array([0], dtype='int32'),
+                   end=np.array([len(ids)], dtype='int32'))
+    build(tree, ids, lons, lats, order, segment, depth)
+    tree.flush()
+
+    return len(ids)
+
+
+def get_fingerprint(localisation):
+    """Fingerprint of the positions of the addresses of the localisation table.
+    """
+    md5_hash = hashlib.md5()
+    for start in range(0, len(localisation), chunk_size):
+        chunk = localisation[start: start + chunk_size]
+        md5_hash.update(np.ascontiguousarray(chunk['longitude']).tobytes())
+        md5_hash.update(np.ascontiguousarray(chunk['latitude']).tobytes())
+    return md5_hash.hexdigest()
+
+
+def create_kdtree(processes=None):
+    """Create the kdtree table from the localisation table.
+
+    Args:
+        processes (int, optional): The number of processes used to build the
+            tree (the number of CPUs by default). With 1, the tree is entirely
+            built in the current process.
+
+    """
+    if not os.path.isfile(paths['localisation']):
+        print('Execute : geocoding index')
+        return False
+
+    localisation = np.memmap(paths['localisation'],
+                             dtype=get_dtypes()['localisation'], mode='r')
+    size = len(localisation)
+    lons = np.array(localisation['longitude'])
+    lats = np.array(localisation['latitude'])
+    ids = np.arange(size, dtype='int32')
+
+    tree = np.memmap(paths['kdtree'], dtype=dtypes['kdtree'], mode='w+',
+                     shape=(size,))
 
     # Limits of all the French region
     limits = [[degree_to_int(-62), degree_to_int(55)],
               [degree_to_int(-22), degree_to_int(52)]]
+    # Extended to the addresses outside of it, if there are any
+    limits = [[min(limits[0][0], lons.min()), max(limits[0][1], lons.max())],
+              [min(limits[1][0], lats.min()), max(limits[1][1], lats.max())]]
 
-    tree = Tree(2, len(table), limits)
+    root = {
+        'start': 0,
+        'end': size,
+        'position': 0,
+        'left': limits[0][0],
+        'right': limits[0][1],
+        'bottom': limits[1][0],
+        'top': limits[1][1],
+    }
+    root = {field: np.array([value], dtype='int32')
+            for field, value in root.items()}
+    order = np.arange(size, dtype='int32')
 
-    # Load tree with all the addresses on France
-    for count, i in enumerate(pre_order(len(table))):
-        index = indices[i]
-        tree.insert((table[index]['longitude'], table[index]['latitude']),
-                    data=index)
+    done = [0]
 
-        if count % 300000 == 0 or count == len(table) - 1:
-            completion_bar('Loading kd-tree', ((count + 1) / len(table)))
+    def progress(count):
+        done[0] += count
+        completion_bar('Building kd-tree', done[0] / size)
 
-    tuple_list = [node_to_tuple(node) for node in tree]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1 or size < parallel_limit:
+        build(tree, ids, lons, lats, order, root, 0, progress=progress)
+    else:
+        # Build the upper levels until there are enough subtrees to share
+        # between the processes, then the subtrees in parallel.
+        levels = int(np.ceil(np.log2(4 * processes)))
+        level, depth = build(tree, ids, lons, lats, order, root, 0, levels,
+                             progress)
+        tree.flush()
 
+        ids = ids[order]
+        del order, lons, lats
+        tasks = [(ids[start: end], {field: values[i: i + 1]
+                                    for field, values in level.items()},
+                  depth)
+                 for i, (start, end) in enumerate(zip(level['start'],
+                                                      level['end']))]
+        with Pool(processes) as pool:
+            for count in pool.imap_unordered(build_subtree, tasks):
+                progress(count)
+
+    tree.flush()
     del tree
-    gc.collect()
 
-    print('Storing ...')
-    create_dat_file(tuple_list, paths['kdtree'], dtypes['kdtree'])
+    with open(kdtree_fingerprint, 'w') as fingerprint_file:
+        fingerprint_file.write(get_fingerprint(localisation))
 
     print('Done')
 
     return True
+
+
+def update_kdtree():
+    """Build the kdtree table again if the positions of the addresses changed.
+
+    Nothing is done if the reverse search was never activated.
+
+    """
+    if not os.path.isfile(paths['kdtree']):
+        return True
+
+    if os.path.isfile(kdtree_fingerprint):
+        localisation = np.memmap(paths['localisation'],
+                                 dtype=get_dtypes()['localisation'], mode='r')
+        with open(kdtree_fingerprint) as fingerprint_file:
+            if fingerprint_file.read() == get_fingerprint(localisation):
+                print('The kd-tree is already up to date.')
+                return True
+
+    return create_kdtree()
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""Geocoding of CSV files.
+
+The rows of the input file are read chunk_size at a time and each chunk is
+searched by a worker process with the batch search methods, while the next
+chunks are read. The results are written in the order of the input as soon
+as their chunk is searched, so the memory used does not depend on the size of
+the file: at most two chunks per worker are read ahead.
+
+Each row of the output is the row of the input followed by the result
+columns. After each chunk written, the number of rows done and the size of
+the output are saved in a checkpoint file next to the output (the output path
+followed by .checkpoint). If the processing is interrupted, running it again
+with the same arguments resumes it after the last chunk written, as long as
+the input file did not change. The checkpoint is removed once the file is
+done.
+
+Example:
+    $ geocoding batch in.csv out.csv --cols=code_postal,commune,adresse
+    $ geocoding batch --reverse in.csv out.csv --cols=lon,lat
+
+Attributes:
+    input_path (str): The input file of the command line.
+    output_path (str): The output file of the command line.
+    cols (str): The names of the input columns of the command line,
+        separated by commas (see geocode_file).
+    default_cols (:obj:`dict` of :obj:`list`): The names of the input
+        columns by default, for the search (False) and the reverse search
+        (True).
+    result_columns (:obj:`list` of str): The result columns added to each
+        row, plus distance for the reverse search.
+    chunk_size (int): The number of rows searched at a time.
+    workers (int): The number of worker processes, the number of CPUs if
+        None. With 1, the chunks are searched in the current process.
+    delimiter (str): The delimiter of the input and output files.
+
+"""
+import csv
+import io
+import json
+import math
+import os
+import time
+from collections import deque
+from multiprocessing import Pool
+
+from . import result, search
+from .download import completion_bar
+from .server import prepare
+
+input_path = None
+output_path = None
+cols = None
+default_cols = {
+    False: ['code_postal', 'commune', 'adresse'],
+    True: ['lon', 'lat'],
+}
+result_columns = ['longitude', 'latitude', 'quality', 'departement_code',
+                  'postal_code', 'commune_nom', 'commune_code_insee',
+                  'voie_nom', 'localisation_numero']
+chunk_size = 10000
+workers = None
+delimiter = ','
+
+
+def get_checkpoint_path(output_file):
+    return output_file + '.checkpoint'
+
+
+def get_fingerprint(input_file, names, reverse):
+    """The state of the input identifying a checkpoint which can be resumed.
+    """
+    stat = os.stat(input_file)
+    return {'input': os.path.abspath(input_file), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'cols': names, 'reverse': reverse}
+
+
+def load_checkpoint(output_file, fingerprint):
+    """The number of rows and the size of the output of a checkpoint of the
+    same input, or None if there is none.
+    """
+    try:
+        with open(get_checkpoint_path(output_file)) as file:
+            checkpoint = json.load(file)
+        if checkpoint['fingerprint'] == fingerprint and \
+                os.path.getsize(output_file) >= checkpoint['offset']:
+            return checkpoint['rows'], checkpoint['offset']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_checkpoint(output_file, fingerprint, rows, offset):
+    # Replace the checkpoint at once, so it is never partially written
+    path = get_checkpoint_path(output_file)
+    with open(path + '.tmp', 'w') as file:
+        json.dump({'fingerprint': fingerprint, 'rows': rows,
+                   'offset': offset}, file)
+    os.replace(path + '.tmp', path)
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def get_values(output):
+    """The values of the result columns of an output of the search methods.
+    """
+    code = output['postal']['code']
+    values = [output['longitude'], output['latitude'], output['quality'],
+              output['departement']['code'],
+              '%05d' % code if code is not None else None,
+              output['commune']['nom'], output['commune']['code_insee'],
+              output['voie']['nom'], output['localisation']['numero']]
+    if 'distance' in output:
+        values.append(output['distance'])
+    return ['' if value is None else value for value in values]
+
+
+def search_chunk(task):
+    """The values of the result columns of each row of a chunk.
+
+    Args:
+        task (:obj:`tuple`): True for the reverse search, and the values of
+            the input columns (None for a column not given).
+
+    """
+    reverse, values = task
+    if reverse:
+        rows = search.reverse_many([to_float(value) for value in values[0]],
+                                   [to_float(value) for value in values[1]])
+    else:
+        rows = search.position_many(*values)
+    return [get_values(result.get_output_from_row(row)) for row in rows]
+
+
+def write_rows(output, rows):
+    text = io.StringIO()
+    csv.writer(text, delimiter=delimiter).writerows(rows)
+    output.write(text.getvalue().encode('utf-8'))
+
+
+def read_chunks(reader, size):
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def geocode_file(input_file, output_file, names=None, reverse=False):
+    """Search the addresses or the positions of each row of a CSV file.
+
+    Args:
+        input_file (str): The path of the input file, with a header.
+        output_file (str): The path of the output file.
+        names (:obj:`list` of str, optional): The names of the input columns
+            of the postal code, the city and the address, or of the longitude
+            and the latitude for the reverse search. An empty name stands for
+            a column not given, which the reverse search does not allow.
+        reverse (bool, optional): True for the reverse search.
+
+    Returns:
+        (int): The number of rows written, resumed rows excluded.
+
+    Raises:
+        ValueError: If a column is not in the header of the input, or if the
+            longitude or the latitude is not given for the reverse search.
+
+    """
+    names = list(names or default_cols[reverse])
+    if len(names) > len(default_cols[reverse]):
+        raise ValueError('At most %d columns are expected'
+                         % len(default_cols[reverse]))
+    names += [''] * (len(default_cols[reverse]) - len(names))
+    if reverse and '' in names:
+        raise ValueError('Both the longitude and the latitude columns are '
+                         'expected')
+    fingerprint = get_fingerprint(input_file, names, reverse)
+    checkpoint = load_checkpoint(output_file, fingerprint)
+    input_size = max(fingerprint['size'], 1)
+
+    with open(input_file, newline='', encoding='utf-8-sig') as file:
+        reader = csv.reader(file, delimiter=delimiter)
+        header = next(reader, [])
+        missing = [name for name in names if name and name not in header]
+        if missing:
+            raise ValueError('Columns not in the input: %s'
+                             % ', '.join(missing))
+        positions = [header.index(name) if name else None for name in names]
+
+        if checkpoint is None:
+            skipped, output = 0, open(output_file, 'wb')
+            write_rows(output, [header + result_columns +
+                                (['distance'] if reverse else [])])
+        else:
+            skipped, offset = checkpoint
+            output = open(output_file, 'r+b')
+            output.truncate(offset)
+            output.seek(offset)
+            for _ in zip(range(skipped), reader):
+                pass
+            print('Resuming after %d rows' % skipped)
+
+        count = workers or os.cpu_count() or 1
+        pool = None
+        if count > 1:
+            prepare()
+            pool = Pool(count)
+        pending = deque()
+        done = 0
+
+        def write_chunk():
+            nonlocal done
+            chunk, outputs = pending.popleft()
+            if pool is not None:
+                outputs = outputs.get()
+            write_rows(output, [row + [''] * (len(header) - len(row)) + values
+                                for row, values in zip(chunk, outputs)])
+            done += len(chunk)
+            output.flush()
+            os.fsync(output.fileno())
+            save_checkpoint(output_file, fingerprint, skipped + done,
+                            output.tell())
+            completion_bar('Geocoding', min(file.buffer.tell() / input_size,
+                                            0.99))
+
+        try:
+            for chunk in read_chunks(reader, chunk_size):
+                values = [[row[i] if i < len(row) else None for row in chunk]
+                          if i is not None else None for i in positions]
+                task = (reverse, values)
+                if pool is not None:
+                    pending.append((chunk, pool.apply_async(search_chunk,
+                                                            (task,))))
+                else:
+                    pending.append((chunk, search_chunk(task)))
+                while len(pending) > 2 * count - 1:
+                    write_chunk()
+            while pending:
+                write_chunk()
+        finally:
+            output.close()
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    completion_bar('Geocoding', 1.)
+    # There is no checkpoint if the input has no rows
+    try:
+        os.remove(get_checkpoint_path(output_file))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def geocode(reverse=False):
+    """Geocode the input file of the command line into its output file.
+
+    Returns:
+        (bool): True if the file was geocoded.
+
+    """
+    begin = time.perf_counter()
+    names = cols.split(',') if cols is not None else None
+    try:
+        rows = geocode_file(input_path, output_path, names, reverse)
+    except (OSError, ValueError) as error:
+        print('')
+        print(error)
+        return False
+    except KeyboardInterrupt:
+        print('')
+        print('Interrupted, execute the same command to resume')
+        return False
+
+    duration = time.perf_counter() - begin
+    print('%d rows geocoded in %.1f s (%.0f rows/s)'
+          % (rows, duration, rows / max(duration, 1e-9)))
+    return True
+
+
+def reverse_geocode():
+    """Reverse geocode the input file of the command line into its output
+    file.
+    """
+    return geocode(reverse=True)
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the search methods on the database installed.
+
+Each scenario runs count searches of one kind, with inputs drawn from the
+database with a fixed seed, so two runs on the same database search the same
+inputs:
+
+* cold_start: a new process imports the package and searches one address,
+  after the files of the database are evicted from the page cache (when the
+  system allows it). It runs cold_runs times and first, before the tables are
+  mapped by the benchmark itself.
+* exact: the addresses as they are in the database.
+* typo: the same, with one character of the city and of the street name
+  deleted, replaced or swapped with the next one.
+* missing_commune, missing_postal: the addresses without city name or
+  without postal code.
+* reverse_dense: positions a few meters away from addresses.
+* reverse_sparse: positions drawn uniformly in the bounding box of the
+  addresses, most of them far from any address.
+
+The other scenarios run with the tables read in the page cache (warm) and
+the cache of the results disabled. For each scenario, the report gives the
+percentiles of the latency, the number of searches per second, the number of
+results of each quality, the peak RSS of the process so far and the page
+faults during the scenario (None on the systems without the module
+resource). The report can be written in JSON, and compared
+with the report of another build.
+
+Example:
+    $ geocoding bench --output=bench.json
+    $ geocoding bench --scenarios=exact,typo --baseline=bench.json
+
+Attributes:
+    scenarios (:obj:`list` of str): The scenarios, in the order they run.
+    selected (str): The scenarios run, separated by commas, all of them if
+        None.
+    count (int): The number of searches of each scenario.
+    cold_runs (int): The number of processes started by cold_start.
+    seed (int): The seed of the random inputs.
+    output_path (str): The path of the JSON report, or None.
+    baseline_path (str): The path of a JSON report to compare with, or None.
+    tolerance (float): The relative increase of the p99 latency, or decrease
+        of the throughput, beyond which a scenario is reported as a
+        regression.
+
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from . import query, result, search
+from .datapaths import paths
+from .datatypes import get_version
+from .utils import int_to_degree
+
+scenarios = ['cold_start', 'exact', 'typo', 'missing_commune',
+             'missing_postal', 'reverse_dense', 'reverse_sparse']
+selected = None
+count = 2000
+cold_runs = 5
+seed = 0
+output_path = None
+baseline_path = None
+tolerance = 0.2
+
+# The first search of the cold_start processes
+cold_start_code = '''
+import json, time
+begin = time.perf_counter()
+import geocoding
+imported = time.perf_counter()
+geocoding.find('91120', 'Palaiseau', '12, Bd des Marechaux')
+found = time.perf_counter()
+run = {'import': imported - begin, 'search': found - imported,
+       'maxrss': None, 'minflt': None, 'majflt': None}
+try:
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    run.update({'maxrss': usage.ru_maxrss, 'minflt': usage.ru_minflt,
+                'majflt': usage.ru_majflt})
+except ImportError:
+    pass
+print(json.dumps(run))
+'''
+
+
+def sample_addresses(size, rng):
+    """Random addresses of the database.
+
+    Args:
+        size (int): The number of addresses.
+        rng (:obj:`numpy.random.Generator`): The random generator.
+
+    Returns:
+        (:obj:`list` of :obj:`dict`): The code_postal, commune, adresse,
+            longitude and latitude of each address.
+
+    """
+    ids = rng.integers(0, len(query.data['localisation']), size)
+    addresses = []
+    for localisation_id in ids:
+        table_ids = result.get_table_ids(('localisation', localisation_id))
+
+        def get(table, field):
+            return query.get_field(table, table_ids[table], field)
+
+        element = query.data['localisation'][localisation_id]
+        addresses.append({
+            'code_postal': '%05d' % get('postal', 'code'),
+            'commune': get('commune', 'nom'),
+            'adresse': '%s %s' % (get('localisation', 'numero'),
+                                  get('voie', 'nom')),
+            'longitude': int_to_degree(element['longitude']),
+            'latitude': int_to_degree(element['latitude']),
+        })
+    return addresses
+
+
+def add_typo(text, rng):
+    """A string with one character deleted, replaced or swapped.
+    """
+    if len(text) < 4:
+        return text
+    i = int(rng.integers(1, len(text) - 1))
+    edit = rng.integers(3)
+    if edit == 0:
+        return text[:i] + text[i + 1:]
+    if edit == 1:
+        return text[:i] + chr(int(rng.integers(65, 91))) + text[i + 1:]
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def get_inputs(scenario, rng):
+    """The arguments of each search of a scenario.
+    """
+    if scenario == 'reverse_sparse':
+        table = query.data['localisation']
+        bounds = [(int_to_degree(table[field].min()),
+                   int_to_degree(table[field].max()))
+                  for field in ('longitude', 'latitude')]
+        return [((rng.uniform(*bounds[0]), rng.uniform(*bounds[1])),)
+                for _ in range(count)]
+
+    addresses = sample_addresses(count, rng)
+    if scenario == 'reverse_dense':
+        # About 50 meters around the addresses
+        return [((address['longitude'] + rng.normal(0, 5e-4),
+                  address['latitude'] + rng.normal(0, 5e-4)),)
+                for address in addresses]
+
+    inputs = []
+    for address in addresses:
+        code_postal = address['code_postal']
+        commune, adresse = address['commune'], address['adresse']
+        if scenario == 'typo':
+            numero, _, voie = adresse.partition(' ')
+            commune = add_typo(commune, rng)
+            adresse = numero + ' ' + add_typo(voie, rng)
+        elif scenario == 'missing_commune':
+            commune = None
+        elif scenario == 'missing_postal':
+            code_postal = None
+        inputs.append((code_postal, commune, adresse))
+    return inputs
+
+
+def get_usage():
+    """The peak RSS in bytes, the minor and the major page faults of the
+    process, or None for each one if the system has no module resource.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None, None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+    scale = 1 if sys.platform == 'darwin' else 2 ** 10
+    return usage.ru_maxrss * scale, usage.ru_minflt, usage.ru_majflt
+
+
+def get_median(values):
+    # The median of values, None if they are not known
+    if None in values:
+        return None
+    return int(np.median(values))
+
+
+def get_stats(latencies, qualities, seconds):
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    values, counts = np.unique(qualities, return_counts=True)
+    return {
+        'count': len(latencies),
+        'seconds': seconds,
+        'ops_per_second': len(latencies) / seconds if seconds else None,
+        'latency_ms': {'p50': p50, 'p95': p95, 'p99': p99,
+                       'max': latencies.max()},
+        'quality': {str(value): int(number)
+                    for value, number in zip(values, counts)},
+    }
+
+
+def evict_page_cache():
+    """Evict the files of the database from the page cache.
+
+    Returns:
+        (bool): True if the system allows it. The pages mapped by a running
+            process stay in the page cache.
+
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for path in paths.values():
+        if os.path.isfile(path):
+            file_descriptor = os.open(path, os.O_RDONLY)
+            os.posix_fadvise(file_descriptor, 0, 0,
+                             os.POSIX_FADV_DONTNEED)
+            os.close(file_descriptor)
+    return True
+
+
+def run_cold_start():
+    """Import the package and search an address in new processes.
+    """
+    package_folder = os.path.dirname(os.path.dirname(__file__))
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [package_folder] + [environment.get('PYTHONPATH', '')]).rstrip(
+            os.pathsep)
+
+    runs, evicted = [], False
+    for _ in range(cold_runs):
+        evicted = evict_page_cache()
+        begin = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', cold_start_code],
+                                env=environment, stdout=subprocess.PIPE,
+                                check=True).stdout
+        run = json.loads(output.decode())
+        run['total'] = time.perf_counter() - begin
+        runs.append(run)
+
+    scale = 1 if sys.platform == 'darwin' else 2 ** 10
+    maxrss = [run['maxrss'] for run in runs]
+    stats = get_stats([run['total'] for run in runs], [],
+                      sum(run['total'] for run in runs))
+    del stats['quality']
+    stats.update({
+        'evicted': evicted,
+        'import_ms': 1000 * float(np.median([run['import'] for run in runs])),
+        'first_search_ms': 1000 * float(np.median([run['search']
+                                                   for run in runs])),
+        'peak_rss_mb': (max(maxrss) * scale / 2 ** 20
+                        if None not in maxrss else None),
+        'minor_faults': get_median([run['minflt'] for run in runs]),
+        'major_faults': get_median([run['majflt'] for run in runs]),
+    })
+    return stats
+
+
+def run_scenario(scenario):
+    """The statistics of the searches of a scenario.
+    """
+    if scenario == 'cold_start':
+        return run_cold_start()
+
+    rng = np.random.default_rng([seed, scenarios.index(scenario)])
+    inputs = get_inputs(scenario, rng)
+    method = search.reverse if scenario.startswith('reverse') \
+        else search.position
+
+    _, minor_faults, major_faults = get_usage()
+    latencies, qualities = [], []
+    begin = time.perf_counter()
+    for arguments in inputs:
+        start = time.perf_counter()
+        output = method(*arguments)
+        latencies.append(time.perf_counter() - start)
+        qualities.append(output['quality'])
+    seconds = time.perf_counter() - begin
+    peak_rss, minor_end, major_end = get_usage()
+
+    stats = get_stats(latencies, qualities, seconds)
+    stats.update({'peak_rss_mb': None, 'minor_faults': None,
+                  'major_faults': None})
+    if peak_rss is not None:
+        stats.update({
+            'peak_rss_mb': peak_rss / 2 ** 20,
+            'minor_faults': minor_end - minor_faults,
+            'major_faults': major_end - major_faults,
+        })
+    return stats
+
+
+def get_report(names):
+    """Run scenarios and gather their statistics with the environment.
+    """
+    from . import cache
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'database_version': get_version(),
+        'database_size': sum(os.path.getsize(path) for path in paths.values()
+                             if os.path.isfile(path)),
+        'count': count,
+        'seed': seed,
+        'scenarios': {},
+    }
+
+    enabled = cache.enabled
+    cache.enabled = False
+    warm = False
+    try:
+        for name in names:
+            if name.startswith('reverse') and 'kdtree' not in query.data:
+                print('%-16s skipped, execute : geocoding reverse' % name)
+                continue
+            if name == 'cold_start' and not cold_runs:
+                print('%-16s skipped, cold_runs is 0' % name)
+                continue
+            if name != 'cold_start' and not warm:
+                query.preload(mode='populate')
+                warm = True
+            stats = run_scenario(name)
+            report['scenarios'][name] = stats
+            print_stats(name, stats)
+    finally:
+        cache.enabled = enabled
+    return report
+
+
+def print_stats(name, stats):
+    latency = stats['latency_ms']
+    line = ('%-16s %6d ops %9.0f ops/s  p50 %7.3f  p95 %7.3f  p99 %7.3f ms'
+            % (name, stats['count'], stats['ops_per_second'],
+               latency['p50'], latency['p95'], latency['p99']))
+    if stats['peak_rss_mb'] is not None:
+        line += '  rss %6.1f MB  faults %d/%d' % (
+            stats['peak_rss_mb'], stats['minor_faults'],
+            stats['major_faults'])
+    print(line)
+
+
+def compare(report, baseline):
+    """Print the changes of the scenarios of a report from a baseline.
+
+    Returns:
+        (:obj:`list` of str): The scenarios slower than the baseline by more
+            than tolerance.
+
+    """
+    if (report['count'], report['seed']) != \
+            (baseline.get('count'), baseline.get('seed')):
+        print('The baseline has other inputs (count %s, seed %s)'
+              % (baseline.get('count'), baseline.get('seed')))
+
+    regressions = []
+    for name, stats in report['scenarios'].items():
+        if name not in baseline.get('scenarios', {}):
+            continue
+        old = baseline['scenarios'][name]
+        p99 = stats['latency_ms']['p99'] / old['latency_ms']['p99']
+        throughput = stats['ops_per_second'] / old['ops_per_second']
+        slower = p99 > 1 + tolerance or throughput < 1 / (1 + tolerance)
+        if slower:
+            regressions.append(name)
+        print('%-16s p99 x%.2f  ops/s x%.2f%s'
+              % (name, p99, throughput, '  REGRESSION' if slower else ''))
+    return regressions
+
+
+def run():
+    """Run the benchmark from the command line.
+
+    Returns:
+        (bool): False if a scenario is unknown or slower than the baseline.
+
+    """
+    names = scenarios if selected is None else selected.split(',')
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        print('Unknown scenarios: %s (scenarios: %s)'
+              % (', '.join(unknown), ', '.join(scenarios)))
+        return False
+    if 'localisation' not in query.data:
+        print('Execute : geocoding update')
+        return False
+
+    baseline = None
+    if baseline_path is not None:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # The cold start first, before the tables are mapped by this process
+    report = get_report(sorted(names, key=scenarios.index))
+
+    if output_path is not None:
+        with open(output_path, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if baseline is not None:
+        return not compare(report, baseline)
+    return True
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Cache of the results of the search methods.
+
+The results of the position and reverse methods are kept in bounded LRU
+caches, once the caching is enabled with the method enable. The position
+method is cached by the output of search.preprocessing, so different
+spellings of the same address share their result, and the reverse method by
+the position rounded to a multiple of precision degrees. The keys include the
+argument lazy of the search, so the dicts and the Result objects of the same
+input are cached apart.
+
+The caches return copies of the results, so the callers can not modify the
+results cached, and they are cleared when the files of the database change.
+The tables of the database are then mapped again (see query.reset), so the
+next results are searched in the new files.
+
+Example:
+    >>> import geocoding
+    >>> from geocoding import cache
+    >>> cache.enable(maxsize=10000, ttl=3600)
+    >>> geocoding.find('91120', 'Palaiseau', '12, Bd des Maréchaux')
+    >>> cache.stats()
+
+Attributes:
+    enabled (bool): True if the results are cached.
+    precision (float): The size in degrees of the grid of the positions of
+        the reverse cache.
+    check_interval (float): The minimum time in seconds between two checks of
+        the files of the database.
+    positions (:obj:`Cache`): The cache of the position method.
+    reverses (:obj:`Cache`): The cache of the reverse method.
+
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import query
+from .datapaths import paths
+
+enabled = False
+precision = 1e-6
+check_interval = 1.
+database_state = {'files': None, 'checked': None}
+
+
+class Cache():
+    """LRU cache with a maximum number of entries and an optional time to live.
+
+    Attributes:
+        maxsize (int): The maximum number of entries.
+        ttl (float): The time in seconds after which an entry expires, or None
+            if the entries do not expire.
+        hits (int): The number of keys found.
+        misses (int): The number of keys not found (or expired).
+        evictions (int): The number of entries removed to respect maxsize or
+            because they expired.
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        Args:
+            maxsize (int, optional): The maximum number of entries.
+            ttl (float, optional): The time to live of the entries in seconds.
+
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def get(self, key):
+        """The value of a key, or None if the key is not in the cache.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and \
+                    time.monotonic() - entry[1] > self.ttl:
+                del self.entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Add a key to the cache, removing the least recently used if full.
+        """
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """The counters of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+            }
+
+
+positions = Cache()
+reverses = Cache()
+
+
+def enable(maxsize=1024, ttl=None):
+    """Enable the caching of the results of the search methods.
+
+    Args:
+        maxsize (int, optional): The maximum number of results of each method.
+        ttl (float, optional): The time to live of the results in seconds.
+
+    """
+    global enabled
+    for results in (positions, reverses):
+        results.maxsize, results.ttl = maxsize, ttl
+        results.clear()
+        results.hits, results.misses, results.evictions = 0, 0, 0
+    enabled = True
+
+
+def disable():
+    """Disable the caching of the results and clear the caches.
+    """
+    global enabled
+    enabled = False
+    clear()
+
+
+def clear():
+    for results in (positions, reverses):
+        results.clear()
+
+
+def stats():
+    """The counters of the caches of the position and reverse methods.
+    """
+    return {'position': positions.stats(), 'reverse': reverses.stats()}
+
+
+def check_database():
+    """Clear the caches and map the tables again if the files of the
+    database changed.
+
+    The files are checked at most once every check_interval seconds.
+
+    """
+    now = time.monotonic()
+    checked = database_state['checked']
+    if checked is not None and now - checked < check_interval:
+        return
+    database_state['checked'] = now
+
+    files = []
+    for table, path in sorted(paths.items()):
+        try:
+            stat = os.stat(path)
+            files.append((table, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            files.append((table, None, None))
+
+    if files != database_state['files']:
+        if database_state['files'] is not None:
+            clear()
+            query.reset()
+        database_state['files'] = files
+
+
+def copy(output):
+    """Copy of an output of the search methods (a dict of dicts). The Result
+    objects can not be modified, so they are not copied.
+    """
+    if not isinstance(output, dict):
+        return output
+    return {key: dict(value) if isinstance(value, dict) else value
+            for key, value in output.items()}
+
+
+def get_position(key):
+    """The cached output of the position method for a preprocessed input.
+    """
+    check_database()
+    output = positions.get(key)
+    return copy(output) if output is not None else None
+
+
+def put_position(key, output):
+    positions.put(key, copy(output))
+
+
+def reverse_key(position, lazy=False):
+    """The key of a position in the reverse cache, None if it is not finite.
+    """
+    if not (math.isfinite(position[0]) and math.isfinite(position[1])):
+        return None
+    return (round(position[0] / precision), round(position[1] / precision),
+            lazy)
+
+
+def get_reverse(position, lazy=False):
+    """The cached output of the reverse method for a position.
+    """
+    key = reverse_key(position, lazy)
+    if key is None:
+        return None
+    check_database()
+    output = reverses.get(key)
+    return copy(output) if output is not None else None
+
+
+def put_reverse(position, output, lazy=False):
+    key = reverse_key(position, lazy)
+    if key is not None:
+        reverses.put(key, copy(output))
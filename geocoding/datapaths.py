@@ -3,8 +3,17 @@
 Attributes:
     here (str): Path to the package.
     database (str): Path to the database folder.
+    columns (:obj:`dict` of :obj:`list` of :obj:`str`): The fields of the
+        tables that are also stored in a table of their own (named after the
+        table and the field), contiguous, for the binary searches.
     tables (:obj:`list` of :obj:`str`): The name of each table in the database.
     paths (:obj:`list` of :obj:`str`): The path to each table of the database.
+    blocks_folder (str): Path to the folder with the processed blocks of each
+        departement, kept to rebuild the database incrementally.
+    kdtree_fingerprint (str): Path to the fingerprint of the positions from
+        which the kdtree table was built.
+    version_path (str): Path to the file with the version of the format of
+        the database.
 """
 
 import os
@@ -13,6 +22,25 @@ here = os.path.abspath(os.path.dirname(__file__))
 
 database = os.path.join(here, 'database')
 
+columns = {
+    'departement': ['code'],
+    'postal': ['code'],
+    'commune': ['normalise'],
+    'voie': ['normalise'],
+    'localisation': ['numero'],
+}
+
 tables = ['departement', 'postal', 'commune', 'voie', 'localisation',
-          'commune_index', 'postal_index', 'voie_index', 'kdtree']
+          'nom_heap', 'repetitions', 'commune_index', 'postal_index',
+          'voie_index', 'code_insee_index',
+          'voie_trigram_offsets', 'voie_trigram_postings',
+          'commune_signature', 'commune_signature_keys', 'voie_signature',
+          'voie_signature_keys', 'postal_lookup', 'departement_lookup',
+          'code_insee_lookup', 'kdtree']
+tables += [table + '_' + field
+           for table, fields in columns.items() for field in fields]
 paths = {table: os.path.join(database, table + '.dat') for table in tables}
+
+blocks_folder = os.path.join(database, 'blocks')
+kdtree_fingerprint = os.path.join(database, 'kdtree.md5')
+version_path = os.path.join(database, 'version')
@@ -4,7 +4,21 @@
 The database is formed by numpy arrays and the type of the elements of each one
 is specified in this module as a module level variable.
 
+The version 2 of the format stores the normalized names as ASCII byte strings
+and the displayed names (the field nom) in the nom_heap table: the UTF-8 bytes
+of each distinct name, stored once, referred to by their offset and length in
+the heap. The field repetition of the localisation table is the code of the
+repetition in the repetitions table. The types of the version 1, with unicode
+strings, are kept to read the databases of this version and as the type of
+the records of the processed blocks of each departement.
+
+The version 3 of the format stores the indexes with the type of the indices
+of numpy (intp), so they can be used as sorter by numpy.searchsorted without
+being converted, and adds the tables of the columns of datapaths.columns,
+whose type is the type of their field.
+
 Attributes:
+    version (int): The version of the format of the database written.
     departement_dtype (str): The definition of the numpy dtype for the
         elements of the departement table.
     postal_dtype (str): The definition of the numpy dtype for the elements of
@@ -17,15 +31,30 @@ Attributes:
         elements of the localisation table.
     kdtree_dtype (str): The definition of the numpy dtype for the elements of
         the kdtree table.
+    signature_dtype (str): The definition of the numpy dtype for the
+        elements of the signature tables (the signatures of the field
+        normalise of the commune and voie tables, see the module similarity).
+    range_dtype (str): The definition of the numpy dtype for the elements of
+        the lookup tables of ranges (see the module lookup).
     dtypes (:obj:`dict` of :obj:`str`): A python dictionary to easily access
         the dtypes definitions.
+    v1_dtypes (:obj:`dict` of :obj:`str`): The dtypes definitions of the
+        version 1 of the format, for the tables that changed in the version 2.
+    v2_dtypes (:obj:`dict` of :obj:`str`): The dtypes definitions of the
+        versions 1 and 2 of the format, for the tables that changed in the
+        version 3.
 
 """
 
+import os
 import numpy as np
 
+from .datapaths import columns, version_path
+
+version = 3
+
 departement_dtype = np.dtype([
-    ('code', 'U3'),
+    ('code', 'S3'),
     ('start', 'int32'),
     ('end', 'int32'),
 ])
@@ -38,9 +67,10 @@ postal_dtype = np.dtype([
 ])
 
 commune_dtype = np.dtype([
-    ('normalise', 'U32'),
-    ('nom', 'U32'),
-    ('code_insee', 'U5'),
+    ('normalise', 'S32'),
+    ('nom_offset', 'uint32'),
+    ('nom_length', 'uint16'),
+    ('code_insee', 'S5'),
     ('longitude', 'int32'),
     ('latitude', 'int32'),
     ('start', 'int32'),
@@ -49,8 +79,9 @@ commune_dtype = np.dtype([
 ])
 
 voie_dtype = np.dtype([
-    ('normalise', 'U47'),
-    ('nom', 'U65'),
+    ('normalise', 'S47'),
+    ('nom_offset', 'uint32'),
+    ('nom_length', 'uint16'),
     ('longitude', 'int32'),
     ('latitude', 'int32'),
     ('start', 'int32'),
@@ -60,7 +91,7 @@ voie_dtype = np.dtype([
 
 localisation_dtype = np.dtype([
     ('numero', 'int16'),
-    ('repetition', 'U3'),
+    ('repetition', 'uint8'),
     ('longitude', 'int32'),
     ('latitude', 'int32'),
     ('ref_id', 'int32'),
@@ -79,14 +110,113 @@ kdtree_dtype = np.dtype([
     ('ref_id', 'int32'),
 ])
 
+signature_dtype = np.dtype([
+    ('start', 'int64'),
+    ('end', 'int64'),
+    ('score', 'int32'),
+])
+
+range_dtype = np.dtype([
+    ('start', 'int32'),
+    ('end', 'int32'),
+])
+
 dtypes = {
     'departement': departement_dtype,
     'postal': postal_dtype,
     'commune': commune_dtype,
     'voie': voie_dtype,
     'localisation': localisation_dtype,
+    'nom_heap': 'uint8',
+    'repetitions': 'U3',
+    'commune_index': 'int64',
+    'postal_index': 'int64',
+    'voie_index': 'int64',
+    'code_insee_index': 'int64',
+    'voie_trigram_offsets': 'int64',
+    'voie_trigram_postings': 'int32',
+    'commune_signature': signature_dtype,
+    'commune_signature_keys': 'uint16',
+    'voie_signature': signature_dtype,
+    'voie_signature_keys': 'uint16',
+    'postal_lookup': 'int32',
+    'departement_lookup': 'int32',
+    'code_insee_lookup': range_dtype,
+    'kdtree': kdtree_dtype
+}
+for table, fields in columns.items():
+    for field in fields:
+        dtypes[table + '_' + field] = dtypes[table][field]
+
+v1_dtypes = {
+    'departement': np.dtype([
+        ('code', 'U3'),
+        ('start', 'int32'),
+        ('end', 'int32'),
+    ]),
+    'postal': postal_dtype,
+    'commune': np.dtype([
+        ('normalise', 'U32'),
+        ('nom', 'U32'),
+        ('code_insee', 'U5'),
+        ('longitude', 'int32'),
+        ('latitude', 'int32'),
+        ('start', 'int32'),
+        ('end', 'int32'),
+        ('ref_id', 'int32'),
+    ]),
+    'voie': np.dtype([
+        ('normalise', 'U47'),
+        ('nom', 'U65'),
+        ('longitude', 'int32'),
+        ('latitude', 'int32'),
+        ('start', 'int32'),
+        ('end', 'int32'),
+        ('ref_id', 'int32'),
+    ]),
+    'localisation': np.dtype([
+        ('numero', 'int16'),
+        ('repetition', 'U3'),
+        ('longitude', 'int32'),
+        ('latitude', 'int32'),
+        ('ref_id', 'int32'),
+    ]),
+}
+
+v2_dtypes = {
     'commune_index': 'int32',
     'postal_index': 'int32',
     'voie_index': 'int32',
-    'kdtree': kdtree_dtype
+    'code_insee_index': 'int32',
 }
+
+
+def get_version():
+    """The version of the format of the database on disk.
+
+    The databases without version file are of the version 1.
+
+    """
+    if not os.path.isfile(version_path):
+        return 1
+    with open(version_path) as version_file:
+        return int(version_file.read())
+
+
+def get_dtypes(database_version=None):
+    """The dtypes definitions of a version of the format.
+
+    Args:
+        database_version (int, optional): The version, by default the version
+            of the database on disk.
+
+    """
+    if database_version is None:
+        database_version = get_version()
+
+    version_dtypes = dict(dtypes)
+    if database_version <= 2:
+        version_dtypes.update(v2_dtypes)
+    if database_version <= 1:
+        version_dtypes.update(v1_dtypes)
+    return version_dtypes
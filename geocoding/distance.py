@@ -19,7 +19,9 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from math import sin, cos, pi, sqrt, atan2
+from math import sin, cos, pi, sqrt, atan2, asin
+
+import numpy as np
 
 
 def radian(deg):
@@ -48,3 +50,82 @@ def spherical(a, b):
               sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lng)
 
     return degree(d)
+
+
+def box_lower_bound(point, region):
+    """Lower bound of the distance in degrees from a point to a region.
+
+    The region is a box delimited by two meridians and two parallels. The
+    distance from the point to the box is at least the difference of latitude
+    to the nearest parallel and, if the point is outside the meridians, at
+    least the distance to the great circle of the nearest meridian.
+
+    Args:
+        point (:obj:`tuple` of float): Longitude and latitude of the point.
+        region (:obj:`tuple` of float): The limits left, right, bottom and
+            top of the box in degrees.
+
+    """
+    lon, lat = point
+    left, right, bottom, top = region
+
+    bound = bottom - lat if lat < bottom else max(lat - top, 0)
+
+    if lon < left or lon > right:
+        sin_bound = cos(radian(lat)) * min(abs(sin(radian(lon - left))),
+                                           abs(sin(radian(lon - right))))
+        bound = max(bound, degree(asin(min(sin_bound, 1))))
+
+    return bound
+
+
+def spherical_many(lons, lats, lon, lat):
+    """Vectorized version of spherical.
+
+    The distance in degrees from each point (lons[i], lats[i]) to the point
+    (lon, lat). The arguments can be numpy arrays of any shape compatible for
+    broadcasting.
+    """
+    lat1, lng1 = np.radians(lats), np.radians(lons)
+    lat2, lng2 = np.radians(lat), np.radians(lon)
+
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_lat2, cos_lat2 = np.sin(lat2), np.cos(lat2)
+
+    delta_lng = lng2 - lng1
+    cos_delta_lng, sin_delta_lng = np.cos(delta_lng), np.sin(delta_lng)
+
+    d = np.arctan2(np.sqrt((cos_lat2 * sin_delta_lng) ** 2 +
+                           (cos_lat1 * sin_lat2 -
+                            sin_lat1 * cos_lat2 * cos_delta_lng) ** 2),
+                   sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lng)
+
+    return np.degrees(d)
+
+
+def box_lower_bound_many(lons, lats, region):
+    """Vectorized version of box_lower_bound.
+
+    Args:
+        lons (:obj:`numpy.ndarray`): The longitude of the points.
+        lats (:obj:`numpy.ndarray`): The latitude of the points.
+        region (:obj:`tuple` of float): The limits left, right, bottom and
+            top of the box in degrees.
+
+    Returns:
+        (:obj:`numpy.ndarray`): The lower bound for each point.
+
+    """
+    left, right, bottom, top = region
+
+    lat_bound = np.maximum(bottom - lats, 0) + np.maximum(lats - top, 0)
+
+    cos_lats = np.cos(np.radians(lats))
+    sin_left = np.abs(np.sin(np.radians(lons - left)))
+    sin_right = np.abs(np.sin(np.radians(lons - right)))
+    outside = (lons < left) | (lons > right)
+    sin_bound = np.where(outside,
+                         cos_lats * np.minimum(sin_left, sin_right), 0)
+    lon_bound = np.degrees(np.arcsin(np.minimum(sin_bound, 1)))
+
+    return np.maximum(lat_bound, lon_bound)
@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 """Update the raw data used as the main source of information.
 
+The departement files are downloaded concurrently and each completed file is
+recorded in a manifest with its size, its md5 checksum and the headers that
+identify its version on the server. A file already recorded is not downloaded
+again while its version on the server does not change, and an interrupted
+download is resumed from the partial file left in the raw folder, if the
+version of the file on the server is still the version of the partial file.
+
 """
 import gzip
+import json
 import os
 import shutil
 import sys
+import threading
 import requests
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 from .datapaths import here
 
@@ -18,6 +28,12 @@ ban_dpt_file_name = 'ban-{}.csv'
 content_folder_path = os.path.join(here, 'content')
 server_content_file_name = os.path.join(content_folder_path, 'server_content_v2.txt')
 local_content_file_name = os.path.join(content_folder_path, 'local_content_v2.txt')
+manifest_file_name = os.path.join(content_folder_path, 'manifest.json')
+partial_suffix = '.part'
+version_suffix = '.version'
+max_workers = 8
+download_chunk_size = 2 ** 20
+download_attempts = 3
 dpt_list = ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10",
             "11", "12", "13", "14", "15", "16", "17", "18", "19",
             "21", "22", "23", "24", "25", "26", "27", "28", "29", "2A", "2B",
@@ -46,11 +62,20 @@ def completion_bar(msg, fraction):
 def md5(fname):
     md5_hash = hashlib.md5()
     with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        for chunk in iter(lambda: f.read(download_chunk_size), b""):
             md5_hash.update(chunk)
     return md5_hash.hexdigest()
 
 
+def get_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                            pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 def update_ban_file(url, file_name):
     r = requests.get(url)
 
@@ -70,6 +95,35 @@ def update_server_content_file():
     update_ban_file(ban_url.format(""), server_content_file_name)
 
 
+def load_manifest():
+    if not os.path.exists(manifest_file_name):
+        return {}
+    with open(manifest_file_name) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(manifest):
+    # Write a new file and replace the old one, so an interruption can not
+    # leave a corrupted manifest
+    with open(manifest_file_name + partial_suffix, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(manifest_file_name + partial_suffix, manifest_file_name)
+
+
+def is_complete(file_name, entry):
+    # Check if the local file is the one recorded in the manifest
+    file_path = os.path.join(raw_data_folder_path, file_name)
+    return (entry is not None and os.path.isfile(file_path) and
+            os.path.getsize(file_path) == entry['size'] and
+            md5(file_path) == entry['md5'])
+
+
+def get_version(response):
+    # Headers identifying the version of a file on the server
+    return {'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')}
+
+
 def need_to_download():
     if not os.path.exists(local_content_file_name):
         return True
@@ -77,33 +131,89 @@ def need_to_download():
         update_server_content_file()
 
         if md5(server_content_file_name) == md5(local_content_file_name):
-            print('BAN database is already up to date. No need to download it again.')
-            os.remove(server_content_file_name)
-            return False
+            manifest = load_manifest()
+            if all(is_complete(ban_dpt_gz_file_name.format(dpt), manifest.get(ban_dpt_gz_file_name.format(dpt)))
+                   for dpt in dpt_list):
+                print('BAN database is already up to date. No need to download it again.')
+                os.remove(server_content_file_name)
+                return False
 
         return True
 
 
-def download_ban_dpt_file(ban_dpt_file_name):
-    with open(os.path.join(raw_data_folder_path, ban_dpt_file_name), 'wb') as ban_dpt_file:
-        response = requests.get(ban_url.format(ban_dpt_file_name), stream=True)
-
-        if not response.ok:
-            print('Download {} unsuccessful: bad response'.format(ban_dpt_file_name))
-            return False
+def download_ban_dpt_file(session, ban_dpt_file_name, entry):
+    """Download one departement file, resuming a partial download if any.
+
+    Args:
+        session (:obj:`requests.Session`): The HTTP session.
+        ban_dpt_file_name (str): The name of the file.
+        entry (:obj:`dict`): The entry of the file in the manifest or None.
+
+    Returns:
+        (:obj:`dict`): The new entry of the file in the manifest, or None if
+            the download was unsuccessful.
+
+    """
+    url = ban_url.format(ban_dpt_file_name)
+    file_path = os.path.join(raw_data_folder_path, ban_dpt_file_name)
+    partial_path = file_path + partial_suffix
+    version_path = partial_path + version_suffix
+
+    # Skip the file if the version on the server is the one downloaded
+    response = session.head(url, allow_redirects=True)
+    if not response.ok:
+        print('Download {} unsuccessful: bad response'.format(ban_dpt_file_name))
+        return None
+    version = get_version(response)
+    size = response.headers.get('content-length')
+    if (is_complete(ban_dpt_file_name, entry) and
+            all(entry.get(key) == value for key, value in version.items()) and
+            (size is None or int(size) == entry['size'])):
+        return entry
+
+    # Resume the partial download, only if the file did not change on the
+    # server since the partial download started (If-Range with the version
+    # of the partial file)
+    done = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+    headers = {}
+    if done and os.path.isfile(version_path):
+        with open(version_path) as version_file:
+            partial_version = json.load(version_file)
+        validator = partial_version['etag'] or partial_version['last_modified']
+        if validator is not None:
+            headers = {'Range': 'bytes={}-'.format(done),
+                       'If-Range': validator}
+
+    response = session.get(url, headers=headers, stream=True)
+    if response.status_code == 206:
+        total_size = int(response.headers['content-range'].split('/')[-1])
+        mode = 'ab'
+    elif response.status_code == 200:
+        total_size = response.headers.get('content-length')
+        total_size = int(total_size) if total_size is not None else None
+        done, mode = 0, 'wb'
+        with open(version_path, 'w') as version_file:
+            json.dump(get_version(response), version_file)
+    elif response.status_code == 416 and done:
+        # The partial file is not a prefix of the file on the server
+        os.remove(partial_path)
+        return download_ban_dpt_file(session, ban_dpt_file_name, entry)
+    else:
+        print('Download {} unsuccessful: bad response'.format(ban_dpt_file_name))
+        return None
 
-        done, total_size = 0, int(response.headers.get('content-length'))
-        for block in response.iter_content(4096):
+    with open(partial_path, mode) as ban_dpt_file:
+        for block in response.iter_content(download_chunk_size):
             ban_dpt_file.write(block)
-
             done += len(block)
-            completion_bar('Downloading {}'.format(ban_dpt_file_name), done / total_size)
 
-    if done != total_size:
+    if total_size is not None and done != total_size:
         print('Download {} unsuccessful: incomplete'.format(ban_dpt_file_name))
-        return False
+        return None
 
-    return True
+    os.replace(partial_path, file_path)
+    os.remove(version_path)
+    return dict(version, size=done, md5=md5(file_path))
 
 
 def get_ban_file():
@@ -115,16 +225,49 @@ def get_ban_file():
 
     print('A new version of BAN base is available.')
 
-    update_local_content_file()
-
-    if os.path.exists(raw_data_folder_path):
-        shutil.rmtree(raw_data_folder_path)
-    
-    os.mkdir(raw_data_folder_path)
+    if not os.path.exists(raw_data_folder_path):
+        os.mkdir(raw_data_folder_path)
+
+    manifest = load_manifest()
+    lock = threading.Lock()
+    file_names = [ban_dpt_gz_file_name.format(dpt) for dpt in dpt_list]
+    done = []
+
+    def download(file_name):
+        entry = manifest.get(file_name)
+        for attempt in range(download_attempts):
+            try:
+                entry = download_ban_dpt_file(session, file_name, entry)
+            except requests.RequestException as error:
+                print('Download {} unsuccessful: {}'.format(file_name, error))
+                entry = None
+            if entry is not None:
+                break
+
+        with lock:
+            if entry is not None:
+                manifest[file_name] = entry
+                save_manifest(manifest)
+            done.append(entry is not None)
+            completion_bar('Downloading BAN', len(done) / len(file_names))
+
+        return entry is not None
+
+    with get_session() as session:
+        with ThreadPoolExecutor(max_workers) as executor:
+            success = list(executor.map(download, file_names))
+
+    failures = [name for name, ok in zip(file_names, success) if not ok]
+    if failures:
+        print('Impossible to download {}. Execute the command again to '
+              'resume the download.'.format(', '.join(failures)))
+        return False
 
-    for dpt in dpt_list:
-        if not download_ban_dpt_file(ban_dpt_gz_file_name.format(dpt)):
-            raise Exception('Impossible to download {}'.format(ban_dpt_gz_file_name.format(dpt)))
+    # The local content is updated only once all the files are downloaded
+    if os.path.exists(server_content_file_name):
+        os.replace(server_content_file_name, local_content_file_name)
+    else:
+        update_local_content_file()
 
     return True
 
@@ -5,25 +5,199 @@ This module creates an intermediary database in csv format. The goal of this
 intermediate step is to easy the next step: the construction of the binary
 files using tools from the package numpy.
 
+Each departement is processed independently into its own blocks of the
+tables (numpy arrays where the fields start, end and ref_id refer to the
+blocks of the same departement), which are saved in the blocks folder of the
+database. The tables are then written by merging the blocks in the order of
+the departements, chunk by chunk, so the memory used does not depend on the
+size of the database but on memory_limit (and on the largest departement,
+processed in memory).
+
+The BAN files are read directly from the compressed files downloaded
+(ban-XX.csv.gz), or from the decompressed ones (ban-XX.csv) if there are no
+compressed files.
+
+The blocks of each departement are saved with the fingerprint of the file
+they come from, so an incremental processing only processes again the
+departements whose file changed.
+
+The records of the blocks have the types of the version 1 of the format and
+they are converted to the current version when the tables are written: the
+names are added to the heap of names, each distinct name once, and the
+repetitions are replaced by their code (see the module datatypes).
+
+Attributes:
+    references (:obj:`dict` of :obj:`tuple`): For each table, the table
+        referenced by its field ref_id and the table delimited by its fields
+        start and end (None if there is no such table).
+    buffer_size (int): The size in bytes of the buffer used to read the BAN
+        files.
+    blocks_version (int): The version of the processing of the BAN files,
+        part of the fingerprint of the blocks saved. It must be increased
+        when the blocks of a same file change.
+    memory_limit (int): The approximate maximum memory in bytes used to write
+        each table of the database and to sort its indexes.
+    indexes (:obj:`dict` of :obj:`tuple`): For each index table, the table
+        indexed and the fields by which its records are sorted (None to sort
+        them by all their fields, in order). The field nom stands for the
+        name read from the heap of names.
+    timings (:obj:`dict` of float): The time in seconds spent on each stage
+        of the last build.
+
 """
 
+import gzip
+import heapq
+import io
 import os
+import time
 import numpy as np
 from collections import deque
+from multiprocessing import Pool
 
-from .datatypes import dtypes
-from .datapaths import paths, database
-from .download import completion_bar, raw_data_folder_path
-from . import ban_processing
+from .datatypes import dtypes, v1_dtypes, version
+from .datapaths import paths, database, blocks_folder, columns, version_path
+from .download import completion_bar, raw_data_folder_path, md5
+from . import ban_processing, lookup, ngram, similarity
 
 file_names = ['departement', 'postal', 'commune', 'voie', 'localisation']
-processed_files = {}
+processed_departements = {}
+references = {
+    'departement': (None, 'postal'),
+    'postal': ('departement', 'commune'),
+    'commune': ('postal', 'voie'),
+    'voie': ('commune', 'localisation'),
+    'localisation': ('voie', None),
+}
+buffer_size = 2 ** 20
+blocks_version = 1
+memory_limit = 2 ** 30
+indexes = {
+    'postal_index': ('postal', None),
+    'commune_index': ('commune', ['normalise', 'nom', 'code_insee',
+                                  'longitude', 'latitude', 'start', 'end',
+                                  'ref_id']),
+    'voie_index': ('voie', ['normalise', 'nom', 'longitude', 'latitude',
+                            'start', 'end', 'ref_id']),
+    'code_insee_index': ('commune', ['code_insee']),
+}
+timings = {}
+
+
+def open_ban_file(file_path):
+    """Open a BAN file, compressed with gzip or not, as a text stream.
+    """
+    if file_path.endswith('.gz'):
+        raw_file = io.BufferedReader(gzip.open(file_path, 'rb'),
+                                     buffer_size=buffer_size)
+        return io.TextIOWrapper(raw_file, encoding='UTF-8')
+    return open(file_path, 'r', encoding='UTF-8', buffering=buffer_size)
+
+
+def get_fingerprint(file_path):
+    """Fingerprint of a BAN file, identifying the blocks processed from it.
+    """
+    return '{}-{}'.format(blocks_version, md5(file_path))
+
+
+def get_blocks_path(departement, file=None):
+    folder = os.path.join(blocks_folder, departement)
+    if file is None:
+        return folder
+    return os.path.join(folder, file + '.npy')
+
+
+def save_blocks(departement, departement_blocks, fingerprint):
+    """Save the blocks of one departement with the fingerprint of its file.
+
+    The fingerprint is written last, so the blocks of an interrupted save are
+    never taken for the blocks of a file.
+
+    """
+    folder = get_blocks_path(departement)
+    fingerprint_path = os.path.join(folder, 'fingerprint')
+    os.makedirs(folder, exist_ok=True)
+    if os.path.exists(fingerprint_path):
+        os.remove(fingerprint_path)
+
+    for file, block in departement_blocks.items():
+        np.save(get_blocks_path(departement, file), block)
+
+    with open(fingerprint_path + '.part', 'w') as fingerprint_file:
+        fingerprint_file.write(fingerprint)
+    os.replace(fingerprint_path + '.part', fingerprint_path)
 
 
-def process_files():
+def load_blocks(departement, fingerprint=None):
+    """Load the saved blocks of one departement, mapped from the disk.
+
+    Args:
+        departement (str): The departement.
+        fingerprint (str, optional): If given, the blocks are loaded only if
+            they were processed from a file with this fingerprint.
+
+    Returns:
+        (:obj:`dict` of :obj:`numpy.ndarray`): The blocks of each table for
+            this departement or None if there are no such blocks.
+
+    """
+    fingerprint_path = os.path.join(get_blocks_path(departement),
+                                    'fingerprint')
+    if not os.path.isfile(fingerprint_path):
+        return None
+
+    with open(fingerprint_path) as fingerprint_file:
+        if fingerprint is not None and fingerprint_file.read() != fingerprint:
+            return None
+
+    return {file: np.load(get_blocks_path(departement, file), mmap_mode='r')
+            for file in file_names}
+
+
+def process_departement(task):
+    """Process the BAN file of one departement and save its blocks.
+
+    Args:
+        task (:obj:`tuple` of str): The departement, the path to its file,
+            compressed with gzip or not, and the fingerprint of this file.
+
+    Returns:
+        (:obj:`dict` of int): The number of records of each table for this
+            departement.
+
+    """
+    departement, file_path, fingerprint = task
+    departement_files = {file: deque() for file in file_names}
+
+    with open_ban_file(file_path) as ban_file:
+        ban_processing.update(departement, ban_file, departement_files)
+
+    # The records are removed from the deques while they are converted
+    departement_blocks = {}
     for file in file_names:
-        processed_files[file] = deque()
+        records = departement_files[file]
+        departement_blocks[file] = np.fromiter(
+            (records.popleft() for _ in range(len(records))),
+            dtype=v1_dtypes[file], count=len(records))
+
+    save_blocks(departement, departement_blocks, fingerprint)
+
+    return {file: len(block) for file, block in departement_blocks.items()}
+
+
+def process_files(processes=None, incremental=False):
+    """Process the BAN file of each departement.
 
+    Args:
+        processes (int, optional): The number of processes (the number of CPUs
+            by default). With 1, the files are processed in the current
+            process.
+        incremental (bool, optional): If True, the departements whose file did
+            not change since it was last processed are not processed again:
+            their saved blocks are used instead.
+
+    """
+    begin = time.perf_counter()
     ban_files = {}
 
     # Check if the folder with the data to process exists
@@ -31,67 +205,531 @@ def process_files():
         print('Execute : geocoding download')
         return False
 
-    # Open each csv file
+    # Find each csv file, preferring the compressed ones
     for (dirname, dirs, files) in os.walk(raw_data_folder_path):
-        for filename in files:
-            if filename.endswith('.csv'):
+        for filename in sorted(files, key=lambda name: name.endswith('.gz')):
+            if filename.endswith('.csv') or filename.endswith('.csv.gz'):
                 file_path = os.path.join(dirname, filename)
                 dpt_name = filename.split('-')[-1].split('.')[0]
-                ban_files[dpt_name] = open(file_path, 'r', encoding='UTF-8')
+                ban_files[dpt_name] = file_path
 
     # Check if the folder was not empty
     if not ban_files:
-        print('Execute : geocoding decompress')
+        print('Execute : geocoding download')
         return False
 
     departements = list(ban_files.keys())
     departements.sort()
+    fingerprints = {departement: get_fingerprint(ban_files[departement])
+                    for departement in departements}
+
+    # Sizes of the blocks of the departements that did not change
+    sizes = {}
+    if incremental:
+        for departement in departements:
+            departement_blocks = load_blocks(departement,
+                                             fingerprints[departement])
+            if departement_blocks is not None:
+                sizes[departement] = {file: len(block) for file, block
+                                      in departement_blocks.items()}
+
+    tasks = [(departement, ban_files[departement], fingerprints[departement])
+             for departement in departements
+             if departement not in sizes]
+    if incremental:
+        print('{} departement(s) changed: {}'.format(
+            len(tasks), ', '.join(task[0] for task in tasks) or '-'))
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(min(processes, len(tasks)), 1)
+
+    if processes > 1:
+        pool = Pool(processes)
+        mapping = pool.imap(process_departement, tasks)
+    else:
+        pool, mapping = None, map(process_departement, tasks)
+
+    for i, (task, departement_sizes) in enumerate(zip(tasks, mapping)):
+        sizes[task[0]] = departement_sizes
+        completion_bar('Processing BAN', (i + 1) / len(tasks))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    for i, departement in enumerate(departements):
-        ban_processing.update(departement, ban_files[departement], processed_files)
-        completion_bar('Processing BAN', (i + 1) / len(departements))
+    processed_departements.clear()
+    for departement in departements:
+        processed_departements[departement] = sizes[departement]
+
+    timings.clear()
+    timings['processing'] = time.perf_counter() - begin
 
     return True
 
 
+def process_changed_files():
+    """Process only the BAN files of the departements that changed.
+    """
+    return process_files(incremental=True)
+
+
+def get_chunk_size(dtype, factor=2):
+    """The number of records of a given type to process at once.
+
+    Args:
+        dtype: The type of the records.
+        factor (int, optional): The number of copies of the records, of their
+            size in memory, held at once.
+
+    """
+    return max(memory_limit // (factor * np.dtype(dtype).itemsize), 1)
+
+
+def to_bytes(strings):
+    """Convert an array of unicode strings to ASCII byte strings.
+
+    The characters out of ASCII, if any, are replaced by a question mark.
+
+    """
+    try:
+        return strings.astype('S{}'.format(strings.dtype.itemsize // 4))
+    except UnicodeEncodeError:
+        return np.char.encode(strings, 'ascii', 'replace')
+
+
+def store_names(strings, names, heap_file):
+    """Add names to the heap of names, each distinct name once.
+
+    Args:
+        strings (:obj:`numpy.ndarray`): The names, of a numpy unicode type.
+        names (:obj:`dict` of :obj:`tuple`): The offset and the length in the
+            heap of each name already stored, updated with the new names.
+        heap_file: The file of the heap, open for writing at its end.
+
+    Returns:
+        (:obj:`tuple` of :obj:`numpy.ndarray`): The offset and the length in
+            the heap of each name.
+
+    """
+    uniques, firsts, inverse = np.unique(strings, return_index=True,
+                                         return_inverse=True)
+    uniques = uniques.tolist()
+
+    # The new names are stored in the order of their first record
+    size, new_names = heap_file.tell(), []
+    for i in np.argsort(firsts).tolist():
+        name = uniques[i]
+        if name not in names:
+            encoded = name.encode('UTF-8')
+            names[name] = (size, len(encoded))
+            new_names.append(encoded)
+            size += len(encoded)
+    heap_file.write(b''.join(new_names))
+
+    if size > 2 ** 32:
+        raise ValueError('The heap of names exceeds 4 GiB')
+    positions = np.array([names[name] for name in uniques],
+                         dtype='int64').reshape(len(uniques), 2)
+    return positions[inverse.ravel(), 0], positions[inverse.ravel(), 1]
+
+
+def encode_repetitions(strings, repetitions):
+    """The codes of some repetitions.
+
+    Args:
+        strings (:obj:`numpy.ndarray`): The repetitions.
+        repetitions (:obj:`dict` of int): The code of each repetition already
+            encoded, updated with the new repetitions.
+
+    """
+    uniques, firsts, inverse = np.unique(strings, return_index=True,
+                                         return_inverse=True)
+    for i in np.argsort(firsts).tolist():
+        repetitions.setdefault(uniques[i].item(), len(repetitions))
+    code_type = dtypes['localisation']['repetition']
+    if len(repetitions) > np.iinfo(code_type).max + 1:
+        raise ValueError('Too many distinct repetitions to encode')
+    codes = np.array([repetitions[repetition]
+                      for repetition in uniques.tolist()], dtype='int64')
+    return codes[inverse.ravel()]
+
+
+def convert(table, chunk, names, heap_file, repetitions):
+    """Convert records of the blocks to the type of the records of a table.
+
+    Args:
+        table (str): The name of the table.
+        chunk (:obj:`numpy.ndarray`): The records of the blocks.
+        names (:obj:`dict` of :obj:`tuple`): As in the method store_names.
+        heap_file: As in the method store_names.
+        repetitions (:obj:`dict` of int): As in the method encode_repetitions.
+
+    """
+    records = np.zeros(len(chunk), dtype=dtypes[table])
+    for field in records.dtype.names:
+        if field in ('nom_offset', 'nom_length'):
+            continue
+        elif field == 'repetition':
+            records[field] = encode_repetitions(chunk[field], repetitions)
+        elif records.dtype[field].kind == 'S':
+            records[field] = to_bytes(chunk[field])
+        else:
+            records[field] = chunk[field]
+
+    if 'nom_offset' in records.dtype.names:
+        records['nom_offset'], records['nom_length'] = \
+            store_names(chunk['nom'], names, heap_file)
+    return records
+
+
+def write_table(table, names, heap_file, repetitions):
+    """Write one table of the database from the blocks of each departement.
+
+    The blocks are concatenated in the order of the departements and their
+    fields start, end and ref_id are shifted by the number of records of the
+    blocks of the previous departements, so the result is the same as
+    processing all the departements in this order one after the other. The
+    tables of the columns of the table are written at the same time.
+
+    Args:
+        table (str): The name of the table.
+        names (:obj:`dict` of :obj:`tuple`): As in the method store_names.
+        heap_file: As in the method store_names.
+        repetitions (:obj:`dict` of int): As in the method encode_repetitions.
+
+    """
+    parent, child = references[table]
+    offsets = {file: 0 for file in file_names}
+    chunk_size = get_chunk_size(v1_dtypes[table])
+
+    column_files = {field: open(paths[table + '_' + field], 'wb')
+                    for field in columns.get(table, [])}
+    with open(paths[table], 'wb') as out_file:
+        for departement, sizes in processed_departements.items():
+            block = np.load(get_blocks_path(departement, table),
+                            mmap_mode='r')
+
+            for start in range(0, len(block), chunk_size):
+                chunk = convert(table, block[start: start + chunk_size],
+                                names, heap_file, repetitions)
+                if parent is not None:
+                    chunk['ref_id'] += offsets[parent]
+                if child is not None:
+                    chunk['start'] += offsets[child]
+                    chunk['end'] += offsets[child]
+                chunk.tofile(out_file)
+                for field, column_file in column_files.items():
+                    np.ascontiguousarray(chunk[field]).tofile(column_file)
+            del block
+
+            for file in file_names:
+                offsets[file] += sizes[file]
+
+    for column_file in column_files.values():
+        column_file.close()
+
+
+def get_names(records):
+    """The names of some records, read from the heap as byte strings.
+    """
+    heap = np.memmap(paths['nom_heap'], dtype=dtypes['nom_heap'], mode='r') \
+        if os.path.getsize(paths['nom_heap']) else np.zeros(1, 'uint8')
+    offsets = records['nom_offset'].astype('int64')
+    lengths = records['nom_length'].astype('int64')
+    width = max(int(lengths.max(initial=0)), 1)
+
+    # One character of each name at once
+    chars = np.zeros((len(records), width), dtype='uint8')
+    for i in range(width):
+        positions = np.minimum(offsets + i, len(heap) - 1)
+        chars[:, i] = np.where(i < lengths, heap[positions], 0)
+    return chars.view('S{}'.format(width)).ravel()
+
+
+def get_keys(records, fields):
+    """The fields of some records by which an index sorts them.
+
+    Args:
+        records (:obj:`numpy.ndarray`): The records.
+        fields (:obj:`list` of str): The fields, as in indexes.
+
+    """
+    if fields is None:
+        return records
+    if 'nom' in records.dtype.names or 'nom' not in fields:
+        return records[fields]
+
+    columns = {field: get_names(records) if field == 'nom' else
+               records[field] for field in fields}
+    keys = np.zeros(len(records), dtype=[(field, columns[field].dtype)
+                                         for field in fields])
+    for field in fields:
+        keys[field] = columns[field]
+    return keys
+
+
+def sort_keys(keys):
+    """Indices that sort records by their fields, in the order of the fields.
+
+    Equal records are sorted by index, as a stable sort.
+
+    """
+    return np.lexsort([keys[field] for field in reversed(keys.dtype.names)])
+
+
+def iterate_run(records, fields, run, chunk_size):
+    """Iterate over the keys of a sorted run, reading them by chunks.
+    """
+    for start in range(0, len(run), chunk_size):
+        ids = run[start: start + chunk_size]
+        yield from zip(get_keys(records[ids], fields).tolist(), ids.tolist())
+
+
+def write_indexes(table):
+    """Write the indexes of a table.
+
+    Ranges of the table that fit in memory_limit are read once and sorted for
+    each index of the table, and the sorted runs of each index are then
+    merged, reading them by chunks.
+
+    Args:
+        table (str): The name of the table.
+
+    Returns:
+        (:obj:`dict` of float): The time in seconds spent on each index.
+
+    """
+    names = [name for name, (indexed, fields) in indexes.items()
+             if indexed == table]
+    records = np.memmap(paths[table], dtype=dtypes[table], mode='r') \
+        if os.path.getsize(paths[table]) else np.zeros(0, dtypes[table])
+    chunk_size = get_chunk_size(dtypes[table], factor=3)
+
+    durations = {name: 0. for name in names}
+    runs = {name: [] for name in names}
+    for start in range(0, len(records), chunk_size):
+        chunk = np.array(records[start: start + chunk_size])
+        for name in names:
+            begin = time.perf_counter()
+            keys = get_keys(chunk, indexes[name][1])
+            runs[name].append(sort_keys(keys) + start)
+            durations[name] += time.perf_counter() - begin
+        del chunk
+
+    for name in names:
+        begin = time.perf_counter()
+        fields = indexes[name][1]
+        with open(paths[name], 'wb') as out_file:
+            if len(runs[name]) <= 1:
+                for run in runs[name]:
+                    run.astype(dtypes[name]).tofile(out_file)
+            else:
+                # Records held as python objects by the merge
+                merge_size = max(get_chunk_size(dtypes[table], factor=8) //
+                                 len(runs[name]), 1)
+                merged = heapq.merge(*[iterate_run(records, fields, run,
+                                                   merge_size)
+                                       for run in runs[name]])
+                ids = []
+                for key, record_id in merged:
+                    ids.append(record_id)
+                    if len(ids) == chunk_size:
+                        np.array(ids, dtype=dtypes[name]).tofile(out_file)
+                        ids = []
+                np.array(ids, dtype=dtypes[name]).tofile(out_file)
+        durations[name] += time.perf_counter() - begin
+
+    return durations
+
+
+def write_ngram_index():
+    """Write the trigram index of the normalized names of the streets.
+
+    The voie table is read twice by chunks: to count the postings of each
+    trigram and then to write them at their place.
+
+    """
+    records = np.memmap(paths['voie'], dtype=dtypes['voie'], mode='r') \
+        if os.path.getsize(paths['voie']) else np.zeros(0, dtypes['voie'])
+    # The trigrams of a name take several times its size
+    chunk_size = get_chunk_size(dtypes['voie'], factor=8)
+    chunks = range(0, len(records), chunk_size)
+
+    counts = np.zeros(ngram.size, dtype='int64')
+    for start in chunks:
+        rows, trigrams = ngram.ngrams_many(
+            records['normalise'][start: start + chunk_size])
+        counts += np.bincount(trigrams, minlength=ngram.size)
+
+    offsets = np.zeros(ngram.size + 1, dtype=dtypes['voie_trigram_offsets'])
+    offsets[1:] = np.cumsum(counts)
+    offsets.tofile(paths['voie_trigram_offsets'])
+
+    with open(paths['voie_trigram_postings'], 'wb+') as out_file:
+        if not offsets[-1]:
+            return
+        postings = np.memmap(out_file, dtype=dtypes['voie_trigram_postings'],
+                             shape=(int(offsets[-1]),))
+        filled = offsets[:-1].copy()
+        for start in chunks:
+            rows, trigrams = ngram.ngrams_many(
+                records['normalise'][start: start + chunk_size])
+            # Rank of each posting among those of its trigram in this chunk
+            firsts = np.searchsorted(trigrams, trigrams)
+            ranks = np.arange(len(trigrams)) - firsts
+            postings[filled[trigrams] + ranks] = rows + start
+            filled += np.bincount(trigrams, minlength=ngram.size)
+        postings.flush()
+
+
+def write_signatures(table):
+    """Write the signatures of the field normalise of a table, by chunks.
+
+    Args:
+        table (str): The name of the table.
+
+    """
+    records = np.memmap(paths[table], dtype=dtypes[table], mode='r') \
+        if os.path.getsize(paths[table]) else np.zeros(0, dtypes[table])
+    # The keys of a name take several times its size
+    chunk_size = get_chunk_size(dtypes[table], factor=8)
+    signature = table + '_signature'
+
+    end = 0
+    with open(paths[signature], 'wb') as signatures_file, \
+            open(paths[signature + '_keys'], 'wb') as keys_file:
+        for start in range(0, len(records), chunk_size):
+            scores, counts, keys = similarity.signatures_many(
+                records['normalise'][start: start + chunk_size])
+
+            signatures = np.zeros(len(scores), dtype=dtypes[signature])
+            signatures['end'] = end + np.cumsum(counts)
+            signatures['start'] = signatures['end'] - counts
+            signatures['score'] = scores
+            end += len(keys)
+
+            signatures.tofile(signatures_file)
+            keys.astype(dtypes[signature + '_keys']).tofile(keys_file)
+
+
+def map_table(table):
+    """The table written in the database, mapped in memory read only.
+    """
+    if not os.path.getsize(paths[table]):
+        return np.zeros(0, dtypes[table])
+    return np.memmap(paths[table], dtype=dtypes[table], mode='r')
+
+
+def write_lookups():
+    """Write the lookup tables of the postal, departement and INSEE codes.
+
+    They are written from the postal and departement tables and from the
+    code_insee_index table (see the module lookup), read by chunks as in
+    write_table.
+
+    """
+    # The position in postal_index of the first code not lower than each
+    # code is the number of codes lower than it
+    codes = map_table('postal_code')
+    chunk_size = get_chunk_size(dtypes['postal_code'])
+    counts = np.zeros(lookup.postal_size + 1, dtype='int64')
+    for start in range(0, len(codes), chunk_size):
+        chunk = np.minimum(codes[start: start + chunk_size],
+                           lookup.postal_size)
+        counts += np.bincount(chunk, minlength=lookup.postal_size + 1)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    offsets.astype(dtypes['postal_lookup']).tofile(paths['postal_lookup'])
+
+    departements = np.full(lookup.departement_size, -1,
+                           dtype=dtypes['departement_lookup'])
+    codes = map_table('departement_code')
+    chunk_size = get_chunk_size(dtypes['departement_code'])
+    for start in range(0, len(codes), chunk_size):
+        chunk = codes[start: start + chunk_size].tolist()
+        for departement_id, code in enumerate(chunk, start):
+            key = lookup.departement_key(code.decode('ascii'))
+            if key is not None:
+                departements[key] = departement_id
+    departements.tofile(paths['departement_lookup'])
+
+    communes = np.zeros(lookup.code_insee_size,
+                        dtype=dtypes['code_insee_lookup'])
+
+    def set_range(code, start, end):
+        key = lookup.code_insee_key(code.decode('ascii'))
+        if key is not None:
+            communes[key] = (start, end)
+
+    # The positions of the communes of each code, contiguous in the index
+    records = map_table('commune')
+    index = map_table('code_insee_index')
+    chunk_size = get_chunk_size(dtypes['commune'])
+    previous, first = None, 0
+    for start in range(0, len(index), chunk_size):
+        ids = np.asarray(index[start: start + chunk_size])
+        for i, code in enumerate(records['code_insee'][ids].tolist(), start):
+            if code != previous:
+                if previous is not None:
+                    set_range(previous, first, i)
+                previous, first = code, i
+    if previous is not None:
+        set_range(previous, first, len(index))
+    communes.tofile(paths['code_insee_lookup'])
+
+
 def create_database():
     if not os.path.exists(database):
         os.mkdir(database)
 
-    if not processed_files:
+    if not processed_departements:
         return False
 
-    add_index_tables()
+    begin = time.perf_counter()
+    names, repetitions = {}, {}
+    with open(paths['nom_heap'], 'wb') as heap_file:
+        for i, table in enumerate(file_names):
+            write_table(table, names, heap_file, repetitions)
+            completion_bar('Storing data', (i + 1) / len(file_names))
+    del names
+    np.array(list(repetitions), dtype=dtypes['repetitions']).tofile(
+        paths['repetitions'])
+    timings['storing'] = time.perf_counter() - begin
 
-    count = 0
-    for table, processed_file in processed_files.items():
-        create_dat_file(list(processed_file), paths[table], dtypes[table])
+    indexed_tables = sorted(set(table for table, fields in indexes.values()),
+                            key=file_names.index)
+    for i, table in enumerate(indexed_tables):
+        timings.update(write_indexes(table))
+        completion_bar('Indexing tables', (i + 1) / len(indexed_tables))
 
-        count += 1
-        completion_bar('Storing data', count / len(processed_files))
+    begin = time.perf_counter()
+    write_ngram_index()
+    timings['voie_trigram'] = time.perf_counter() - begin
 
-    return True
+    for table in ['commune', 'voie']:
+        begin = time.perf_counter()
+        write_signatures(table)
+        timings[table + '_signature'] = time.perf_counter() - begin
 
+    begin = time.perf_counter()
+    write_lookups()
+    timings['lookup'] = time.perf_counter() - begin
 
-def add_index_tables():
-    index_tables = ['postal', 'commune', 'voie']
+    with open(version_path, 'w') as version_file:
+        version_file.write(str(version))
 
-    # Index tables creation
-    for i, table in enumerate(index_tables):
-        sort_method = (lambda i: processed_files[table][i])
+    print('Build times: ' + ', '.join(
+        '{} {:.2f} s'.format(stage, duration)
+        for stage, duration in timings.items()))
 
-        # Sort table and add it to the module level dict processed_files
-        processed_files[table + '_index'] = \
-            sorted(range(len(processed_files[table])), key=sort_method)
-
-        completion_bar('Indexing tables', (i + 1) / len(index_tables))
+    return True
 
 
 def create_dat_file(lst, out_filename, dtype):
     """Write a list in a binary file as a numpy array.
 
     Args:
-        lst: The list that will be written in the file.
+        lst: The list (or numpy array) that will be written in the file.
         out_filename: The name of the binary file. It must be in the same
             directory.
         dtype: The type of the numpy array.
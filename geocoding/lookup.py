@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Direct-addressed lookup tables of the codes of the database.
+
+The postal codes, the codes of the departements and the INSEE codes are
+turned into small integer keys, so each code is looked up by reading one
+element of a dense table written at index time instead of a binary search:
+
+* postal_lookup: for each postal code c, the number of records of the postal
+  table with a code lower than c, that is, the position of the first of
+  them in the postal_index table. The records with the code c are those of
+  postal_index[postal_lookup[c]: postal_lookup[c + 1]].
+* departement_lookup: for each key of a departement code, the index of its
+  record in the departement table or -1.
+* code_insee_lookup: for each key of an INSEE code, the range (start, end)
+  of the positions in the code_insee_index table of the communes with this
+  code, which are the same commune for several postal codes.
+
+The INSEE codes of Corsica (2A and 2B) have keys greater than those of the
+numeric codes, so the keys of all the codes are distinct.
+
+Attributes:
+    postal_size (int): The number of postal codes of the postal lookup table.
+    departement_size (int): The number of keys of the departement codes.
+    code_insee_size (int): The number of keys of the INSEE codes.
+    letters (str): The letters that may follow the first digit of a code
+        (the departements 2A and 2B).
+
+"""
+postal_size = 10 ** 5
+departement_size = 10 ** 3 + 20
+code_insee_size = 10 ** 5 + 2 * 10 ** 4
+letters = 'AB'
+
+
+def departement_key(code):
+    """The key of a departement code, or None if it is not a valid code.
+
+    The codes of two or three digits have their value as key, and the codes
+    formed by a digit and a letter (2A and 2B) the keys from 1000.
+
+    """
+    if not isinstance(code, str) or not code.isascii():
+        return None
+    if code.isdigit() and 2 <= len(code) <= 3:
+        return int(code)
+    if len(code) == 2 and code[0].isdigit() and code[1] in letters:
+        return 10 ** 3 + letters.index(code[1]) * 10 + int(code[0])
+    return None
+
+
+def code_insee_key(code):
+    """The key of an INSEE code, or None if it is not a valid code.
+
+    The codes of five digits have their value as key, and the codes with a
+    letter after the first digit (2A004, 2B033) the keys from 100000.
+
+    """
+    if not isinstance(code, str) or not code.isascii() or len(code) != 5 or \
+            not (code[0] + code[2:]).isdigit():
+        return None
+    if code[1].isdigit():
+        return int(code)
+    if code[1] in letters:
+        return 10 ** 5 + letters.index(code[1]) * 10 ** 4 + \
+            int(code[0]) * 10 ** 3 + int(code[2:])
+    return None
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Metrics of the search methods.
+
+Once the metrics are enabled with the method enable, the position, the
+position_insee and the reverse methods record the time spent in each stage
+of the search (see stages) and in the whole search in histograms, and count
+their results by quality and the results returned from the cache. The query
+methods count how often the searches take each fallback path (see
+fallbacks), for all the search methods.
+
+When the metrics are disabled (the default), the search methods only test
+the flag enabled once per stage, so they cost nearly nothing.
+
+The metrics are read with the method snapshot, or in the text format of
+Prometheus with the method prometheus, and set back to zero with the method
+reset. They are kept per process.
+
+Example:
+    >>> import geocoding
+    >>> from geocoding import metrics
+    >>> metrics.enable()
+    >>> geocoding.find('91120', 'Palaiseau', '12, Bd des Maréchaux')
+    >>> metrics.snapshot()['position']['stages']['select_voie']
+    >>> print(metrics.prometheus())
+
+Attributes:
+    enabled (bool): True if the metrics are recorded.
+    bounds (:obj:`list` of float): The upper bounds in seconds of the buckets
+        of the histograms (the last bucket has no upper bound).
+    stages (:obj:`dict` of :obj:`list`): The stages of each search method,
+        in order. The stages complete_commune_selection and
+        complete_voie_selection are only recorded when they run, and the
+        stage cache when the cache is enabled.
+    fallbacks (:obj:`dict` of str): The description of each fallback path
+        counted.
+
+"""
+import bisect
+import threading
+import time
+
+enabled = False
+bounds = [1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2,
+          2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.]
+stages = {
+    'position': ['preprocessing', 'cache', 'select_code_postal',
+                 'select_commune', 'complete_commune_selection',
+                 'select_voie', 'complete_voie_selection',
+                 'select_localisation', 'get_output'],
+    'position_insee': ['preprocessing', 'cache', 'select_code_insee',
+                       'select_voie_in_communes', 'select_localisation',
+                       'get_output'],
+    'reverse': ['cache', 'nearest', 'get_output'],
+}
+fallbacks = {
+    'commune_heuristics': 'The city is not in its postal code, it is '
+                          'searched by similarity',
+    'commune_wide': 'Idem, in all the cities of the postal code',
+    'complete_commune_selection': 'The city is searched in all the cities',
+    'voie_heuristics': 'The street is not in its city, it is searched by '
+                       'similarity',
+    'voie_wide': 'Idem, in all the streets of the city',
+    'complete_voie_selection': 'The street is searched in all the streets',
+    'ngram_voie_selection': 'Idem, with the trigram index',
+}
+
+lock = threading.Lock()
+
+
+class Histogram():
+    """Histogram of durations, with the buckets of bounds.
+
+    Attributes:
+        counts (:obj:`list` of int): The number of durations in each bucket.
+        total (float): The sum of the durations.
+
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(bounds, seconds)] += 1
+        self.total += seconds
+
+    def quantile(self, fraction):
+        """The upper bound of the bucket of a quantile, or None if the
+        histogram is empty or the bucket has no upper bound.
+        """
+        count = sum(self.counts)
+        if not count:
+            return None
+        rank, cumulated = fraction * count, 0
+        for i, bucket_count in enumerate(self.counts):
+            cumulated += bucket_count
+            if cumulated >= rank and bucket_count:
+                return bounds[i] if i < len(bounds) else None
+        return None
+
+    def stats(self):
+        return {
+            'count': sum(self.counts),
+            'seconds': self.total,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in bounds] + ['+Inf'],
+                                self.counts)),
+        }
+
+
+# The histograms of the searches and of their stages, and the counters
+requests = {}
+stage_histograms = {}
+qualities = {}
+cache_hits = {}
+fallback_counts = {}
+
+
+class Timer():
+    """Clock of the stages of one search.
+    """
+
+    def __init__(self, method):
+        self.method = method
+        self.begin = self.last = time.perf_counter()
+        self.durations = []
+
+    def stage(self, name):
+        """Record the end of a stage, started at the end of the previous one.
+        """
+        now = time.perf_counter()
+        self.durations.append((name, now - self.last))
+        self.last = now
+
+    def finish(self, quality, cached=False):
+        """Record the search, with the quality of its result.
+        """
+        total = time.perf_counter() - self.begin
+        with lock:
+            if self.method not in requests:
+                requests[self.method] = Histogram()
+            requests[self.method].add(total)
+            for name, seconds in self.durations:
+                key = (self.method, name)
+                if key not in stage_histograms:
+                    stage_histograms[key] = Histogram()
+                stage_histograms[key].add(seconds)
+            key = (self.method, quality)
+            qualities[key] = qualities.get(key, 0) + 1
+            if cached:
+                cache_hits[self.method] = cache_hits.get(self.method, 0) + 1
+
+
+def timer(method):
+    """A timer of a search, or None if the metrics are disabled.
+    """
+    return Timer(method) if enabled else None
+
+
+def count(fallback):
+    """Count a fallback path, if the metrics are enabled.
+    """
+    if enabled:
+        with lock:
+            fallback_counts[fallback] = fallback_counts.get(fallback, 0) + 1
+
+
+def enable():
+    """Enable the metrics, keeping the values already recorded.
+    """
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Disable the metrics, keeping the values already recorded.
+    """
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Set all the metrics back to zero.
+    """
+    with lock:
+        for values in (requests, stage_histograms, qualities, cache_hits,
+                       fallback_counts):
+            values.clear()
+
+
+def snapshot():
+    """The metrics recorded.
+
+    Returns:
+        :obj:`dict`
+        {
+            method (str): {
+                'count' (int), 'seconds' (float), 'p50' (float),
+                'p99' (float), 'buckets' (:obj:`dict`): The statistics of
+                    the histogram of the searches (see Histogram.stats),
+                'quality' (:obj:`dict` of int): The number of results of
+                    each quality,
+                'cache_hits' (int): The number of results from the cache,
+                'stages' (:obj:`dict` of :obj:`dict`): The statistics of the
+                    histogram of each stage,
+            },
+            'fallbacks' (:obj:`dict` of int): The number of times each
+                fallback path was taken,
+        }
+
+    """
+    with lock:
+        output = {}
+        for method in requests:
+            output[method] = requests[method].stats()
+            output[method]['quality'] = {
+                str(quality): number
+                for (name, quality), number in sorted(qualities.items())
+                if name == method}
+            output[method]['cache_hits'] = cache_hits.get(method, 0)
+            output[method]['stages'] = {
+                stage: stage_histograms[method, stage].stats()
+                for stage in stages[method]
+                if (method, stage) in stage_histograms}
+        output['fallbacks'] = {fallback: fallback_counts.get(fallback, 0)
+                               for fallback in fallbacks}
+    return output
+
+
+def format_labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, value)
+                             for name, value in labels)
+
+
+def format_histogram(lines, name, labels, histogram):
+    cumulated = 0
+    for bound, bucket_count in zip(bounds + ['+Inf'], histogram.counts):
+        cumulated += bucket_count
+        lines.append('%s_bucket%s %d' % (
+            name, format_labels(labels + [('le', bound)]), cumulated))
+    lines.append('%s_sum%s %r' % (name, format_labels(labels),
+                                  histogram.total))
+    lines.append('%s_count%s %d' % (name, format_labels(labels), cumulated))
+
+
+def prometheus(labels=None):
+    """The metrics in the text format of Prometheus.
+
+    Args:
+        labels (:obj:`dict` of str, optional): Labels added to every sample,
+            for instance the process id of a worker.
+
+    Returns:
+        (str): The metrics, one sample by line.
+
+    """
+    common = sorted((labels or {}).items())
+    lines = []
+    with lock:
+        lines.append('# HELP geocoding_search_seconds '
+                     'Duration of the searches.')
+        lines.append('# TYPE geocoding_search_seconds histogram')
+        for method, histogram in sorted(requests.items()):
+            format_histogram(lines, 'geocoding_search_seconds',
+                             common + [('method', method)], histogram)
+
+        lines.append('# HELP geocoding_stage_seconds '
+                     'Duration of the stages of the searches.')
+        lines.append('# TYPE geocoding_stage_seconds histogram')
+        for (method, stage), histogram in sorted(stage_histograms.items()):
+            format_histogram(lines, 'geocoding_stage_seconds',
+                             common + [('method', method), ('stage', stage)],
+                             histogram)
+
+        lines.append('# HELP geocoding_results_total '
+                     'Results of the searches by quality.')
+        lines.append('# TYPE geocoding_results_total counter')
+        for (method, quality), number in sorted(qualities.items()):
+            lines.append('geocoding_results_total%s %d' % (format_labels(
+                common + [('method', method), ('quality', quality)]), number))
+
+        lines.append('# HELP geocoding_cache_hits_total '
+                     'Results of the searches returned from the cache.')
+        lines.append('# TYPE geocoding_cache_hits_total counter')
+        for method, number in sorted(cache_hits.items()):
+            lines.append('geocoding_cache_hits_total%s %d' % (
+                format_labels(common + [('method', method)]), number))
+
+        lines.append('# HELP geocoding_fallbacks_total '
+                     'Fallback paths taken by the searches.')
+        lines.append('# TYPE geocoding_fallbacks_total counter')
+        for fallback in fallbacks:
+            lines.append('geocoding_fallbacks_total%s %d' % (
+                format_labels(common + [('path', fallback)]),
+                fallback_counts.get(fallback, 0)))
+    return '\n'.join(lines) + '\n'
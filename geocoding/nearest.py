@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Nearest neighbour search on the kd-tree of the database.
+
+This module walks the kdtree table directly, using its columns as defined by
+datatypes.kdtree_dtype. The root of the tree is the first record of the table
+and the children of each node are given by the fields left and right (-1 if
+the child does not exist).
+
+Attributes:
+    block_size (int): The number of queries searched together by the method
+        nearest_many.
+
+"""
+import numpy as np
+
+from math import inf, isfinite
+
+from . import query
+from .distance import spherical, spherical_many
+from .distance import box_lower_bound, box_lower_bound_many
+from .utils import SCALE
+
+block_size = 4096
+
+
+def nearest(position, stats=None):
+    """Find the nearest node in the kd-tree to a given position.
+
+    Depth-first search of the tree, visiting first the child on the side of
+    the position and skipping the nodes whose region is farther from the
+    position than the nearest node found so far.
+
+    Args:
+        position (:obj:`tuple` of float): Longitude and latitude of the
+            position in this order.
+        stats (:obj:`dict`, optional): If given, the number of nodes visited
+            and pruned during the search are added to the keys 'visited' and
+            'pruned'.
+
+    Returns:
+        (:obj:`tuple`)
+        (node_id (int): Index of the nearest node in the kd-tree or None if
+             the tree is empty or a coordinate of the position is not
+             finite,
+         dist (float): The distance in degrees between the position and the
+             nearest node, or inf if there is none)
+
+    """
+    # Nothing could be pruned with a nan distance
+    if not (isfinite(position[0]) and isfinite(position[1])):
+        return None, inf
+
+    # Plain arrays are much faster than memmaps to read element by element
+    table = query.data['kdtree'].view(np.ndarray)
+    longitude, latitude = table['longitude'], table['latitude']
+    limit_left, limit_right = table['limit_left'], table['limit_right']
+    limit_bottom, limit_top = table['limit_bottom'], table['limit_top']
+    dimension, left, right = table['dimension'], table['left'], table['right']
+    scale = 10 ** SCALE
+
+    nearest_id, dist = None, inf
+    visited, pruned = 0, 0
+
+    stack = [0] if len(table) else []
+    while stack:
+        node_id = stack.pop()
+
+        # Skip the node if its region is too far from the position
+        if nearest_id is not None:
+            region = (limit_left[node_id] / scale,
+                      limit_right[node_id] / scale,
+                      limit_bottom[node_id] / scale,
+                      limit_top[node_id] / scale)
+            if box_lower_bound(position, region) >= dist:
+                pruned += 1
+                continue
+        visited += 1
+
+        point = (longitude[node_id] / scale, latitude[node_id] / scale)
+        node_dist = spherical(position, point)
+        if node_dist < dist:
+            nearest_id, dist = node_id, node_dist
+
+        axis = dimension[node_id]
+        if position[axis] < point[axis]:
+            side_node, side_look = left[node_id], right[node_id]
+        else:
+            side_node, side_look = right[node_id], left[node_id]
+
+        # The child on the side of the position is visited first
+        if side_look != -1:
+            stack.append(side_look)
+        if side_node != -1:
+            stack.append(side_node)
+
+    if stats is not None:
+        stats['visited'] = stats.get('visited', 0) + visited
+        stats['pruned'] = stats.get('pruned', 0) + pruned
+
+    return (int(nearest_id) if nearest_id is not None else None), dist
+
+
+def morton_order(lons, lats):
+    """Order of the points along a Z-order (Morton) curve.
+
+    Points close to each other over the surface of the Earth tend to be close
+    to each other in this order.
+
+    Args:
+        lons (:obj:`numpy.ndarray`): The longitude of the points.
+        lats (:obj:`numpy.ndarray`): The latitude of the points.
+
+    Returns:
+        (:obj:`numpy.ndarray`): The indices that sort the points.
+
+    """
+    def quantize(values):
+        low, high = values.min(), values.max()
+        scale = (2 ** 16 - 1) / (high - low) if high > low else 0
+        return ((values - low) * scale).astype('uint64')
+
+    def spread(x):
+        x = (x | (x << 8)) & 0x00FF00FF
+        x = (x | (x << 4)) & 0x0F0F0F0F
+        x = (x | (x << 2)) & 0x33333333
+        x = (x | (x << 1)) & 0x55555555
+        return x
+
+    if not len(lons):
+        return np.zeros(0, dtype='int64')
+
+    codes = spread(quantize(lons)) | (spread(quantize(lats)) << 1)
+    return np.argsort(codes, kind='stable')
+
+
+def descend(lons, lats, best_ids, best_dists):
+    """Walk down the kd-tree from the root to a leaf for each query.
+
+    The nodes on the path of a query are the natural candidates to be its
+    nearest node, so this first descent gives a good bound for the distance
+    of each query to its nearest node, which allows to prune most of the
+    tree in the method search_block.
+
+    Args:
+        lons (:obj:`numpy.ndarray`): The longitude of the queries.
+        lats (:obj:`numpy.ndarray`): The latitude of the queries.
+        best_ids (:obj:`numpy.ndarray`): Output array with the index of the
+            nearest node found for each query.
+        best_dists (:obj:`numpy.ndarray`): Output array with the distance to
+            the nearest node found for each query.
+
+    """
+    table = query.data['kdtree']
+    scale = 10 ** SCALE
+
+    active = np.arange(len(lons))
+    node_ids = np.zeros(len(lons), dtype='int64')
+    while len(active):
+        nodes = table[node_ids]
+        lon, lat = nodes['longitude'] / scale, nodes['latitude'] / scale
+
+        dists = spherical_many(lons[active], lats[active], lon, lat)
+        closer = dists < best_dists[active]
+        best_ids[active[closer]] = node_ids[closer]
+        best_dists[active[closer]] = dists[closer]
+
+        on_left = np.where(nodes['dimension'] == 0,
+                           lons[active] < lon, lats[active] < lat)
+        node_ids = np.where(on_left, nodes['left'], nodes['right'])
+        remaining = (node_ids != -1)
+        active, node_ids = active[remaining], node_ids[remaining]
+
+
+def search_block(lons, lats, best_ids, best_dists):
+    """Find the nearest node of the kd-tree for a block of queries.
+
+    The tree is walked level by level for the whole block at once: the
+    frontier is the list of pairs (query, node) such that the query may still
+    find a closer node in the region of the node, and each level is processed
+    with vectorized operations over the frontier.
+
+    Args:
+        lons (:obj:`numpy.ndarray`): The longitude of the queries.
+        lats (:obj:`numpy.ndarray`): The latitude of the queries.
+        best_ids (:obj:`numpy.ndarray`): Output array with the index of the
+            nearest node of each query.
+        best_dists (:obj:`numpy.ndarray`): Output array with the distance to
+            the nearest node of each query.
+
+    """
+    table = query.data['kdtree']
+    scale = 10 ** SCALE
+
+    # A first bound for the distance of each query to its nearest node
+    descend(lons, lats, best_ids, best_dists)
+
+    queries = np.arange(len(lons))
+    node_ids = np.zeros(len(lons), dtype='int64')
+    while len(queries):
+        nodes = table[node_ids]
+
+        # Keep only the pairs where the query may find a closer node
+        region = (nodes['limit_left'] / scale, nodes['limit_right'] / scale,
+                  nodes['limit_bottom'] / scale, nodes['limit_top'] / scale)
+        bounds = box_lower_bound_many(lons[queries], lats[queries], region)
+        remaining = (bounds < best_dists[queries])
+        queries, node_ids = queries[remaining], node_ids[remaining]
+        nodes = nodes[remaining]
+
+        # Update the nearest node of each query
+        lon, lat = nodes['longitude'] / scale, nodes['latitude'] / scale
+        dists = spherical_many(lons[queries], lats[queries], lon, lat)
+        closer = (dists < best_dists[queries])
+        np.minimum.at(best_dists, queries[closer], dists[closer])
+        nearest = closer & (dists == best_dists[queries])
+        best_ids[queries[nearest]] = node_ids[nearest]
+
+        # Go down to both children of each node
+        left, right = nodes['left'], nodes['right']
+        has_left, has_right = (left != -1), (right != -1)
+        queries = np.concatenate((queries[has_left], queries[has_right]))
+        node_ids = np.concatenate((left[has_left], right[has_right]))
+
+
+def nearest_many(lons, lats):
+    """Find the nearest node in the kd-tree to each query.
+
+    The queries are sorted in Morton order and searched in blocks of
+    block_size queries, so that the queries of a block are close to each other
+    and share most of the pages of the kd-tree table that are read.
+
+    Args:
+        lons (:obj:`numpy.ndarray`): The longitude of the queries.
+        lats (:obj:`numpy.ndarray`): The latitude of the queries.
+
+    Returns:
+        (:obj:`tuple`)
+        (node_ids (:obj:`numpy.ndarray`): The index of the nearest node of
+             each query in the kd-tree or -1 if the query is not valid,
+         dists (:obj:`numpy.ndarray`): The distance in degrees between each
+             query and its nearest node or nan if the query is not valid)
+
+    """
+    lons = np.asarray(lons, dtype='float64')
+    lats = np.asarray(lats, dtype='float64')
+
+    node_ids = np.full(len(lons), -1, dtype='int64')
+    dists = np.full(len(lons), np.inf)
+
+    valid = np.flatnonzero(np.isfinite(lons) & np.isfinite(lats))
+    if len(query.data['kdtree']):
+        order = valid[morton_order(lons[valid], lats[valid])]
+        for start in range(0, len(order), block_size):
+            block = order[start: start + block_size]
+            block_ids = node_ids[block]
+            block_dists = dists[block]
+            search_block(lons[block], lats[block], block_ids, block_dists)
+            node_ids[block] = block_ids
+            dists[block] = block_dists
+
+    dists[node_ids == -1] = np.nan
+    return node_ids, dists
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Inverted index of the trigrams of the normalized names of the streets.
+
+The normalized names are formed by upper-case letters and digits, so each
+trigram of a name, padded with one blank character at each side, has a dense
+code lower than base ** 3. The index is formed by two tables: the postings,
+the indices of the records of the voie table having each trigram, grouped by
+trigram and sorted by index, and the offsets, such that the postings of the
+trigram with code c are postings[offsets[c]: offsets[c + 1]].
+
+Attributes:
+    alphabet (str): The characters of the normalized names. The first one
+        stands for the padding and any other character has the code
+        len(alphabet).
+    base (int): The number of codes of a character.
+    size (int): The number of codes of a trigram.
+    max_postings (int): The number of postings read by the method candidates
+        beyond which the trigrams shared by more streets are ignored.
+
+"""
+import numpy as np
+
+alphabet = ' ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+base = len(alphabet) + 1
+size = base ** 3
+max_postings = 2 ** 15
+
+codes = {char: code for code, char in enumerate(alphabet) if code}
+lookup = np.full(129, len(alphabet), dtype='int64')
+lookup[[ord(char) for char in alphabet[1:]]] = np.arange(1, len(alphabet))
+lookup[0] = 0
+
+
+def ngrams(text):
+    """The codes of the trigrams of a string, sorted and without repetition.
+    """
+    padded = [0] + [codes.get(char, len(alphabet)) for char in text] + [0]
+    return sorted(set((padded[i] * base + padded[i + 1]) * base + padded[i + 2]
+                      for i in range(len(text))))
+
+
+def get_chars(strings):
+    """The codes of the characters of an array of strings, one row by string.
+
+    Args:
+        strings (:obj:`numpy.ndarray`): The strings, contiguous, of a numpy
+            unicode or byte string type.
+
+    """
+    char_type = 'uint32' if strings.dtype.kind == 'U' else 'uint8'
+    char_size = np.dtype(char_type).itemsize
+    return strings.view(char_type).reshape(
+        len(strings), strings.dtype.itemsize // char_size)
+
+
+def ngrams_many(strings):
+    """The codes of the trigrams of an array of strings.
+
+    Args:
+        strings (:obj:`numpy.ndarray`): The strings, of a numpy unicode or
+            byte string type.
+
+    Returns:
+        (:obj:`tuple`)
+        (rows (:obj:`numpy.ndarray`): The index in strings of each trigram,
+         trigrams (:obj:`numpy.ndarray`): The code of each trigram.)
+        The pairs are sorted by code and then by index, without repetition.
+
+    """
+    strings = np.ascontiguousarray(strings)
+    chars = get_chars(strings)
+    width = chars.shape[1]
+
+    # Null characters after the end of each string are codes of the padding
+    padded = np.zeros((len(strings), width + 2), dtype='int64')
+    padded[:, 1: width + 1] = lookup[np.minimum(chars, 128)]
+    trigrams = (padded[:, :-2] * base + padded[:, 1:-1]) * base + \
+        padded[:, 2:]
+
+    lengths = np.char.str_len(strings)
+    valid = np.arange(width) < lengths[:, np.newaxis]
+    rows = np.broadcast_to(np.arange(len(strings))[:, np.newaxis],
+                           valid.shape)[valid]
+    keys = np.sort(trigrams[valid] * len(strings) + rows)
+    keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+    return keys % max(len(strings), 1), keys // max(len(strings), 1)
+
+
+def candidates(text, offsets, postings, limit):
+    """Indices of the strings sharing the most trigrams with a string.
+
+    The postings of the rarest trigrams of the string are read first, and the
+    more frequent ones are ignored once max_postings postings are read.
+
+    Args:
+        text (str): The string.
+        offsets (:obj:`numpy.ndarray`): The offsets of the index.
+        postings (:obj:`numpy.ndarray`): The postings of the index.
+        limit (int): The maximum number of indices returned.
+
+    Returns:
+        (:obj:`numpy.ndarray`): The indices, by decreasing number of trigrams
+            shared with text and then by increasing index.
+
+    """
+    trigrams = np.array(ngrams(text), dtype='int64')
+    starts, ends = offsets[trigrams], offsets[trigrams + 1]
+    lengths = ends - starts
+
+    lists, total = [], 0
+    for i in np.argsort(lengths, kind='stable'):
+        if lists and total + lengths[i] > max_postings:
+            break
+        lists.append(postings[starts[i]: ends[i]])
+        total += lengths[i]
+
+    if not total:
+        return np.zeros(0, dtype='int64')
+
+    ids = np.sort(np.concatenate(lists))
+    firsts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+    ids, counts = ids[firsts], np.diff(np.append(firsts, len(ids)))
+    return ids[np.lexsort((ids, -counts))[:limit]].astype('int64')
@@ -10,9 +10,17 @@ Attributes:
         France.
     meanless_words (set of str): Set of words in French that does not contain
         information to distinguish one address from another.
+    memo_size (int): The maximum number of results of the methods
+        uniform_commune and mine kept in memory.
+
+The texts are converted to ascii with a translation table for the characters
+of the Latin-1 range, built once with unidecode, and only the texts with
+other characters are converted by unidecode. The ascii texts, the most common,
+are translated as bytes.
 
 """
 import re
+from functools import lru_cache
 from unidecode import unidecode
 
 
@@ -56,14 +64,52 @@ voie_type_1 = set(["ALLEE", "AVENUE", "BOULEVARD", "CITE", "CHEMIN", "CENTRE",
 voie_type_2 = set([("CHEF", "LIEU"), ("LIEU", "DIT"), ("GRANDE", "RUE"),
                    ("GRAND", "RUE"), ("GRANDE", "PLACE"), ("ROND", "POINT")])
 
+memo_size = 2 ** 16
+
 meanless_words = set(["DE", "DES", "DU", "D", "LE", "LES", "LA", "L",
                       "A", "AU", "AUX", "ET", "EN", "SUR", "SOUS", "CEDEX"])
 
 
+parenthesis_pattern = re.compile(r'[(].*[)]')
+number_pattern = re.compile(r'[0-9]+')
+
+# Characters replaced in the words of a text
+punctuation = {ord(','): ' ', ord("'"): ' ', ord('"'): None, ord('-'): ' '}
+
+# Upper-case ascii form of the Latin-1 characters
+latin_table = {code: unidecode(chr(code)).upper() for code in range(256)}
+
+# The same, with the characters of the words of a text replaced
+words_table = {code: value.translate(punctuation)
+               for code, value in latin_table.items()}
+
+# The same for the ascii characters, as bytes, without the deleted ones
+ascii_words_table = bytes(range(256)).upper().translate(
+    bytes.maketrans(b",'-", b'   '))
+ascii_deleted = b'"'
+
+digits_table = {ord(digit): None for digit in '0123456789'}
+
+
+def is_latin(text):
+    """True if all the characters of text are in the Latin-1 range.
+    """
+    try:
+        text.encode('latin-1')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
 def uniform(text):
     """Return the upper-case text converted to ascii.
     """
-    return unidecode(text.strip()).upper()
+    text = text.strip()
+    if text.isascii():
+        return text.upper()
+    elif is_latin(text):
+        return text.translate(latin_table)
+    return unidecode(text).upper()
 
 
 def remove_separators(text):
@@ -73,12 +119,13 @@ def remove_separators(text):
     for a slash or a vertical slash and return the everything at the its left.
     """
     # Remove parenthesis
-    text = re.sub(r'[(].*[)]', '', text)
+    if '(' in text:
+        text = parenthesis_pattern.sub('', text)
     # The slash
-    if re.findall(r'/', text):
+    if '/' in text:
         return text.split('/')[0]
     # The vertical slash
-    elif re.findall(r'[|]', text):
+    elif '|' in text:
         return text.split('|')[0]
     return text
 
@@ -89,12 +136,14 @@ def uniform_words(text):
     Split the normalized text in words and select those that aren't in the
     module level variable meanless_words set.
     """
-    text = uniform(remove_separators(text))
-
-    text = text.replace(",", ' ')
-    text = text.replace("'", ' ')
-    text = text.replace('"', '')
-    text = text.replace('-', ' ')
+    text = remove_separators(text).strip()
+    if text.isascii():
+        text = text.encode().translate(ascii_words_table,
+                                       ascii_deleted).decode()
+    elif is_latin(text):
+        text = text.translate(words_table)
+    else:
+        text = unidecode(text).upper().translate(punctuation)
 
     return [word for word in translate(text) if word not in meanless_words]
 
@@ -103,11 +152,7 @@ def translate(text):
     """Translate the abbreviations to their long form using the module level
     variable dictionary.
     """
-    words = text.split()
-    for i in range(len(words)):
-        if words[i] in dictionary:
-            words[i] = dictionary[words[i]]
-    return words
+    return [dictionary.get(word, word) for word in text.split()]
 
 
 def uniform_adresse(text):
@@ -116,10 +161,11 @@ def uniform_adresse(text):
     return ''.join(uniform_words(text))
 
 
+@lru_cache(maxsize=memo_size)
 def uniform_commune(text):
     """Normalization of the city name.
     """
-    return re.sub(r'[0-9]', '', ''.join(uniform_words(text))).strip()
+    return ''.join(uniform_words(text)).translate(digits_table).strip()
 
 
 def find_voie_type(words):
@@ -135,6 +181,7 @@ def find_voie_type(words):
     return voie_type_index
 
 
+@lru_cache(maxsize=memo_size)
 def mine(text):
     """Retrieve the useful information from the address.
 
@@ -163,10 +210,10 @@ def mine(text):
 
     # Search for the number
     numero, numero_index = None, None
-    for i, word in reversed(list(enumerate(words[:numero_limit]))):
-        matches = re.findall(r'[0-9]+', word)
-        if matches:
-            numero, numero_index = int(matches[0]), i
+    for i in range(numero_limit - 1, -1, -1):
+        match = number_pattern.search(words[i])
+        if match:
+            numero, numero_index = int(match.group()), i
             break
 
     # In the case that the word describing the type of the street wasn't found
@@ -3,36 +3,200 @@
 
 This module defines the query methods for each table in the database.
 
+The tables are mapped in memory on their first use, so only the tables used
+by the queries are mapped, and the method preload can load some of them in
+advance.
+
+The tables are read with the types of the version of the format of the
+database (see the module datatypes): the strings searched are converted to
+the type of the fields they are compared with, and the method get_field reads
+the fields of a record the same way for every version.
+
+The binary searches are made with numpy.searchsorted on the tables of the
+columns searched, if the database has them (see datapaths.columns), so they
+only read the pages of these columns. The postal, departement and INSEE codes
+are looked up in the lookup tables, if the database has them (see the module
+lookup).
+
 Attributes:
     data (:obj:`dict` of :obj:`numpy.ndarray`): The database is formed by numpy
         arrays. Each of them is identified by a name and accessible by this
-        dictionary with data[name].
+        dictionary with data[name]. A table is in data if its file exists.
     limits (:obj:`dict` of :obj:`tuple` of int): limits[table] stores the
         limits of the numpy array called table.
+    columns (:obj:`dict` of :obj:`numpy.ndarray`): columns[table, field] is
+        the field of a table, contiguous if the database has a table for it,
+        and columns[index] is an index table with the type intp, to use it
+        as sorter.
+    ngram_limit (int): The maximum number of candidates retrieved from the
+        trigram index by the fuzzy search of a street.
+    ngram_threshold (float): The minimum similarity score of the candidates
+        of the fuzzy search of a street.
+    signature_limit (int): The minimum size of the ranges of the heuristics
+        searches whose similarity scores are computed from the signatures.
 
 """
+import mmap
 import os
 import numpy as np
-import kdquery
 
-from . import utils
-from . import distance
+from . import lookup, metrics, ngram, trace, utils
 from .similarity import Similarity
-from .datatypes import dtypes
+from .datatypes import get_dtypes
 from .datapaths import paths
 
-data = {}
-limits = {}
+
+class Tables(dict):
+    """Dictionary of the tables of the database, mapped on their first use.
+    """
+
+    def __missing__(self, table):
+        if table not in self:
+            raise KeyError(table)
+        self[table] = np.memmap(paths[table], get_dtypes()[table])
+        return self[table]
+
+    def __contains__(self, table):
+        return dict.__contains__(self, table) or \
+            (table in paths and os.path.isfile(paths[table]))
+
+
+class Limits(dict):
+    """Dictionary of the limits of the tables, computed on their first use.
+    """
+
+    def __missing__(self, table):
+        self[table] = (0, len(data[table]))
+        return self[table]
+
+
+class Columns(dict):
+    """Dictionary of the columns of the tables, found on their first use.
+    """
+
+    def __missing__(self, key):
+        if isinstance(key, tuple):
+            table, field = key
+            name = table + '_' + field
+            array = data[name] if name in data else data[table][field]
+        else:
+            # The indexes of the databases of version 1 and 2 are converted
+            array = data[key].astype(np.intp, copy=False)
+        self[key] = array.view(np.ndarray)
+        return self[key]
+
+
+data = Tables()
+limits = Limits()
+columns = Columns()
+ngram_limit = 64
+ngram_threshold = 0.5
+signature_limit = 8
 
 
 def setup():
     """Initialize the module level variables.
+
+    The tables are mapped on their first use, so there is nothing left to do.
+    This method is kept for compatibility.
+    """
+
+
+def reset():
+    """Forget the tables mapped, so they are mapped again on their next use.
+
+    To be used when the files of the database are replaced or rewritten: the
+    tables already mapped would keep reading the old files.
+    """
+    data.clear()
+    limits.clear()
+    columns.clear()
+
+
+def preload(tables=None, mode='willneed'):
+    """Load tables of the database in memory before their first use.
+
+    Args:
+        tables (:obj:`list` of str, optional): The tables to load, all the
+            tables of the database by default.
+        mode (str, optional): With 'willneed', the system is advised to read
+            the tables in background. With 'populate', the tables are read
+            before returning, so the first queries do not wait for the disk.
+
+    Returns:
+        (int): The size in bytes of the tables loaded.
+
+    """
+    if mode not in ('willneed', 'populate'):
+        raise ValueError("mode must be 'willneed' or 'populate'")
+    if tables is None:
+        tables = [table for table in paths if table in data]
+
+    size = 0
+    for table in tables:
+        array = data[table]
+        size += array.nbytes
+
+        if mode == 'willneed':
+            mapping = getattr(array, '_mmap', None)
+            if mapping is not None and hasattr(mapping, 'madvise'):
+                mapping.madvise(mmap.MADV_WILLNEED)
+            elif hasattr(os, 'posix_fadvise'):
+                file_descriptor = os.open(paths[table], os.O_RDONLY)
+                os.posix_fadvise(file_descriptor, 0, 0,
+                                 os.POSIX_FADV_WILLNEED)
+                os.close(file_descriptor)
+        else:
+            # Read one byte of each page of the table
+            pages = array.view(np.ndarray).view('uint8')
+            np.bitwise_or.reduce(pages[::mmap.PAGESIZE])
+
+    return size
+
+
+def encode(table, column, element):
+    """Convert a string to the type of the strings of a field of a table.
+
+    Args:
+        table (str): The name of the numpy array.
+        column (str): The field.
+        element (str or int): The string (anything else is left unchanged).
+
+    Returns:
+        (str or bytes): The string, encoded in ASCII if the field is of a
+            byte string type.
+
     """
-    if not data or not limits:
-        for table in paths:
-            if os.path.isfile(paths[table]):
-                data[table] = np.memmap(paths[table], dtypes[table])
-                limits[table] = (0, len(data[table]))
+    if isinstance(element, str) and data[table].dtype[column].kind == 'S':
+        return element.encode('ascii', 'replace')
+    return element
+
+
+def get_field(table, element_id, field):
+    """The value of a field of a record, as a python object.
+
+    The names (the field nom) are read from the heap of names and the
+    repetitions from their code, if the database stores them this way.
+
+    Args:
+        table (str): The name of the numpy array.
+        element_id (int): The index of the record.
+        field (str): The field.
+
+    Returns:
+        The value, with the strings as str.
+
+    """
+    record = data[table][element_id]
+    if field == 'nom' and 'nom' not in record.dtype.names:
+        offset = int(record['nom_offset'])
+        value = data['nom_heap'][offset: offset + int(record['nom_length'])]
+        return value.tobytes().decode('UTF-8')
+    elif field == 'repetition' and record.dtype[field].kind == 'u':
+        return data['repetitions'][record[field]].item()
+
+    value = record[field].item()
+    return value.decode('ascii') if isinstance(value, bytes) else value
 
 
 def select(table, column, start, end, element):
@@ -52,8 +216,15 @@ def select(table, column, start, end, element):
 
     """
     # Binary search
-    i, pos = utils.search(element, (start, end), data[table][column])
-    found = (pos < end and data[table][column][pos] == element)
+    element = encode(table, column, element)
+    values = columns[table, column]
+    pos = start + utils.search_sorted(values[start: end], element)
+    found = (pos < end and values[pos] == element)
+
+    tracer = trace.current()
+    if tracer:
+        tracer.add('binary', table=table, column=column, start=start, end=end,
+                   element=element, id=pos, found=found)
     return pos, found
 
 
@@ -88,24 +259,80 @@ def heuristics(table, column, narrow, wide, element):
 
     """
     # Similarity function
-    similarity = Similarity(element).score
+    similarity = Similarity(element)
+
+    tracer = trace.current()
 
     # Narrow search
-    indices = range(narrow[0], narrow[1])
-    score, rang, element_id = \
-        utils.most_similar(indices, data[table][column], similarity)
+    score, rang, element_id = most_similar_range(
+        table, column, narrow[0], narrow[1], similarity)
     found = (score is not None and score >= narrow[2])
+    if tracer:
+        trace_similar_range(tracer, 'narrow', table, column, narrow, element,
+                            similarity, score, element_id, found)
 
     # Wide search
     if not found and wide is not None:
-        indices = range(wide[0], wide[1])
-        score, rang, element_id = \
-            utils.most_similar(indices, data[table][column], similarity)
+        metrics.count(table + '_wide')
+        score, rang, element_id = most_similar_range(
+            table, column, wide[0], wide[1], similarity)
         found = (score is not None and score >= wide[2])
+        if tracer:
+            trace_similar_range(tracer, 'wide', table, column, wide, element,
+                                similarity, score, element_id, found)
 
     return element_id, found
 
 
+def trace_similar_range(tracer, search, table, column, window, element,
+                        similarity, score, element_id, found):
+    """Add a similarity search of the heuristics method to a trace.
+    """
+    start, end, threshold = window
+    candidates = trace.get_candidates(columns[table, column],
+                                      range(start, end), similarity.score)
+    tracer.add(search, table=table, column=column, start=start, end=end,
+               element=element, threshold=threshold, score=score,
+               id=element_id, found=found, candidates=candidates)
+
+
+def most_similar_range(table, column, start, end, similarity):
+    """Find the record of a range of a table with the most similar field.
+
+    The same as utils.most_similar over the range, but the scores of large
+    ranges are computed at once from the signatures of the table, if any.
+
+    Args:
+        table (str): The name of the numpy array.
+        column (str): The field to consider.
+        start (int): The bottom limit index to look in the table.
+        end (int): The top limit index to look in the table.
+        similarity (:obj:`Similarity`): The similarity to the element searched.
+
+    Returns:
+        (:obj:`tuple`)
+        (score (float): The greatest score of similarity or None if the range
+             is empty,
+         rang (int): The position in the range of the record,
+         element_id (int): The index of the record)
+
+    """
+    signature = table + '_signature'
+    if column != 'normalise' or signature not in data or \
+            end - start < signature_limit:
+        return utils.most_similar(range(start, end), columns[table, column],
+                                  similarity.score)
+
+    scores = similarity.score_many(data[signature][start: end],
+                                   data[signature + '_keys'])
+    # Strings without signature keys
+    for i in np.flatnonzero(np.isnan(scores)):
+        scores[i] = similarity.score(columns[table, column][start + i])
+
+    rang = int(np.argmax(scores))
+    return float(scores[rang]), rang, int(start + rang)
+
+
 def select_departement(dpt_code):
     """Select record on department table with field code equals to dpt_code.
 
@@ -119,6 +346,13 @@ def select_departement(dpt_code):
     """
     if dpt_code is None or len(dpt_code) != 2:
         return None
+
+    # Direct addressing
+    if 'departement_lookup' in data:
+        key = lookup.departement_key(dpt_code)
+        dpt_id = -1 if key is None else int(data['departement_lookup'][key])
+        return dpt_id if dpt_id >= 0 else None
+
     start, end = limits['departement']
     dpt_id, found = select('departement', 'code', start, end, dpt_code)
     return dpt_id if found else None
@@ -140,22 +374,72 @@ def select_code_postal(code_postal):
 
     # Binary search with index list, because the postal table is not
     # entirely sorted.
-    i, postal_id = utils.search(code_postal, data['postal_index'],
-                                data['postal']['code'], sorted=False)
+    codes, index = columns['postal', 'code'], columns['postal_index']
+    if 0 <= code_postal < lookup.postal_size and 'postal_lookup' in data:
+        # Direct addressing, the position of the first record not lower
+        i = int(data['postal_lookup'][code_postal])
+    else:
+        i = utils.search_sorted(codes, code_postal, sorter=index)
+    postal_id = index[min(i, len(index) - 1)]
     start, end = limits['postal_index']
-    found = (i < end and data['postal']['code'][postal_id] == code_postal)
+    found = exact = (i < end and codes[postal_id] == code_postal)
 
     if not found:
         # Compute the difference to the nearest values from code_postal
-        diff = [(abs(data['postal']['code'][j] - code_postal), j)
+        diff = [(abs(codes[j] - code_postal), j)
                 for j in range(max(i - 1, start), min(i + 1, end))]
         min_value = min(diff)
         postal_id = min_value[1]
         found = (min_value[0] <= 5)
 
+    tracer = trace.current()
+    if tracer:
+        tracer.add('postal_code', element=code_postal, exact=exact,
+                   found=found, id=postal_id, code=codes[postal_id])
     return postal_id if found else None
 
 
+def select_code_insee(code_insee):
+    """Select the records on commune table with field code_insee equals to
+    code_insee.
+
+    Args:
+        code_insee (str): The INSEE code of the city.
+
+    Returns:
+        (:obj:`list` of int): The indices of the records, one for each postal
+            code of the city, in the order of the commune table.
+
+    """
+    if code_insee is None or 'code_insee_index' not in data:
+        return []
+
+    # Direct addressing
+    if 'code_insee_lookup' in data:
+        key = lookup.code_insee_key(code_insee)
+        if key is None:
+            commune_ids = []
+        else:
+            start, end = data['code_insee_lookup'][key].tolist()
+            commune_ids = columns['code_insee_index'][start: end].tolist()
+
+    # Binary search with index list
+    elif len(code_insee) != 5:
+        commune_ids = []
+    else:
+        key = encode('commune', 'code_insee', code_insee)
+        codes = columns['commune', 'code_insee']
+        index = columns['code_insee_index']
+        start = utils.search_sorted(codes, key, sorter=index)
+        end = int(np.searchsorted(codes, key, side='right', sorter=index))
+        commune_ids = index[start: end].tolist()
+
+    tracer = trace.current()
+    if tracer:
+        tracer.add('code_insee', element=code_insee, ids=commune_ids)
+    return commune_ids
+
+
 def select_commune(postal_id, commune):
     """Select record on commune table with field normalize equals to commune or
     sufficiently similar.
@@ -179,6 +463,7 @@ def select_commune(postal_id, commune):
 
     # Heuristics search with string similarity
     if not found:
+        metrics.count('commune_heuristics')
         narrow = (max(start, commune_id - 2), min(end, commune_id + 2), 0.7)
         wide = (start, end, 0.5)
         commune_id, found = heuristics('commune', 'normalise', narrow, wide,
@@ -204,23 +489,35 @@ def complete_commune_selection(commune):
     """
     if commune is None:
         return None
+    metrics.count('complete_commune_selection')
 
     # Binary search with index list, because the commune table is not
     # entirely sorted.
-    i, commune_id = utils.search(commune, data['commune_index'],
-                                 data['commune']['normalise'],
-                                 sorted=False)
-    found = (data['commune']['normalise'][commune_id] == commune)
+    key = encode('commune', 'normalise', commune)
+    names, index = columns['commune', 'normalise'], columns['commune_index']
+    i = utils.search_sorted(names, key, sorter=index)
+    commune_id = index[min(i, len(index) - 1)]
+    found = (names[commune_id] == key)
+
+    tracer = trace.current()
+    if tracer:
+        tracer.add('index', table='commune', column='normalise', element=key,
+                   id=commune_id, found=found)
 
     # Heuristics
     if not found:
         start, end = limits['commune_index']
         similarity = Similarity(commune).score
-        indices = data['commune_index'][max(start, i - 2): min(end, i + 2)]
+        indices = index[max(start, i - 2): min(end, i + 2)]
         score, rang, commune_id = \
-            utils.most_similar(indices, data['commune']['normalise'],
-                               similarity)
+            utils.most_similar(indices, names, similarity)
         found = (score is not None and score >= 0.7)
+        if tracer:
+            tracer.add('similarity', table='commune', column='normalise',
+                       element=commune, threshold=0.7, score=score,
+                       id=commune_id, found=found,
+                       candidates=trace.get_candidates(names, indices,
+                                                       similarity))
 
     return commune_id if found else None
 
@@ -248,12 +545,17 @@ def select_voie(commune_id, voie, voie_type):
 
     # Heuristics
     if not found:
+        metrics.count('voie_heuristics')
+        names = columns['voie', 'normalise']
         start_type, end_type = voie_id - 1, voie_id
         if voie_type is not None:
-            while data['voie']['normalise'][start_type].startswith(voie_type):
+            # The streets of the city with the same type around voie_id
+            voie_type = encode('voie', 'normalise', voie_type)
+            while start_type >= start and \
+                    names[start_type].startswith(voie_type):
                 start_type -= 1
             start_type += 1
-            while data['voie']['normalise'][end_type].startswith(voie_type):
+            while end_type < end and names[end_type].startswith(voie_type):
                 end_type += 1
 
         if end_type - start_type > 1:
@@ -270,58 +572,99 @@ def select_voie(commune_id, voie, voie_type):
     return voie_id if found else None
 
 
-def complete_voie_selection(code_postal, commune, voie):
-    """Select record on voie table with field normalise most similar to voie.
+def select_voie_in_communes(commune_ids, voie, voie_type, numero=None):
+    """Select record on voie table with field normalise equals to voie or
+    sufficiently similar, among the streets of some cities.
 
-    Search for voie in the entire voie table. This method is the option to find
-    the voie once the method select_voie has failed. It first tries to find the
-    voie belonging to the commune the most similar to commune and if this step
-    fails it will try to find the voie belonging to a postal code similar to
-    code_postal.
+    The cities are first searched for voie itself, preferring the street
+    with the number numero if several cities have it, and then for the most
+    similar street.
 
     Args:
-        commune (str): The city name.
+        commune_ids (:obj:`list` of int): The indices of the cities.
+        voie (str): The street name.
+        voie_type (str): The type of the street or None.
+        numero (int, optional): The street number.
 
     Returns:
-        commune_id (int): The index of the record if the search was succeeded,
-            None otherwise.
+        (:obj:`tuple`)
+        (commune_id (int): The index of the city of the street found, or of
+             the first city if there is none, or None if there is no city,
+         voie_id (int): The index of the street if the search was succeeded,
+             None otherwise)
 
     """
+    if not commune_ids:
+        return None, None
     if voie is None:
-        return None
+        return commune_ids[0], None
 
     # Binary search
-    i, voie_id = utils.search(voie, data['voie_index'],
-                              data['voie']['normalise'],
-                              sorted=False)
+    matches = []
+    for commune_id in commune_ids:
+        ref_element = data['commune'][commune_id]
+        voie_id, found = select('voie', 'normalise', ref_element['start'],
+                                ref_element['end'], voie)
+        if found:
+            if select_localisation(voie_id, numero) is not None:
+                return commune_id, voie_id
+            matches.append((commune_id, voie_id))
+    if matches:
+        return matches[0]
 
-    # If the search was successful and there is no code_postal or commune
-    # to continue, we finish.
-    if code_postal is None and commune is None:
-        return voie_id if data['voie']['normalise'][voie_id] == voie else None
+    # Heuristics
+    similarity = Similarity(voie).score
+    best = (None, commune_ids[0], None)
+    voie_ids = []
+    for commune_id in commune_ids:
+        voie_id = select_voie(commune_id, voie, voie_type)
+        if voie_id is not None:
+            voie_ids.append(voie_id)
+            score = similarity(columns['voie', 'normalise'][voie_id])
+            if best[0] is None or score > best[0]:
+                best = (score, commune_id, voie_id)
+
+    tracer = trace.current()
+    if tracer:
+        tracer.add('similarity', table='voie', column='normalise',
+                   element=voie, threshold=None, score=best[0], id=best[2],
+                   found=best[2] is not None,
+                   candidates=trace.get_candidates(
+                       columns['voie', 'normalise'], voie_ids, similarity))
+    return best[1], best[2]
+
+
+def select_voie_by_place(voie_indices, code_postal, commune):
+    """Select among some records of the voie table the one at a given place.
 
-    # Indices of voie table to consider in the heuristics step
-    if data['voie']['normalise'][voie_id] == voie:
-        # If the search was successful, find the greatest interval of equality
-        j = i
-        while data['voie']['normalise'][data['voie_index'][j]] == voie:
-            j += 1
-        voie_indices = data['voie_index'][i: j]
-    else:
-        # If the search wasn't successful, pick some near indices from the
-        # search result
-        start, end = limits['voie_index']
-        voie_indices = data['voie_index'][max(start, i - 2): min(end, i + 2)]
+    Args:
+        voie_indices (:obj:`list` of int): The indices of the records.
+        code_postal (int): The postal code.
+        commune (str): The city name.
+
+    Returns:
+        voie_id (int): The index of the record if the search was succeeded,
+            None otherwise.
+
+    """
+    if not len(voie_indices):
+        return None
 
     commune_indices = [data['voie']['ref_id'][index] for index in voie_indices]
+    tracer = trace.current()
 
     # First heuristics: apply similarity to commune
     if commune is not None:
         similarity = Similarity(commune).score
+        names = columns['commune', 'normalise']
         score, rang, commune_id = \
-            utils.most_similar(commune_indices, data['commune']['normalise'],
-                               similarity)
+            utils.most_similar(commune_indices, names, similarity)
         voie_id = voie_indices[rang]
+        if tracer:
+            tracer.add('place', by='commune', element=commune,
+                       voie_ids=voie_indices, commune_ids=commune_indices,
+                       threshold=0.7, score=score, id=voie_id,
+                       found=score is not None and score >= 0.7)
         if score is not None and score >= 0.7:
             return voie_id
 
@@ -329,91 +672,142 @@ def complete_voie_selection(code_postal, commune, voie):
     if code_postal is not None:
         postal_indices = [data['commune']['ref_id'][commune_id]
                           for commune_id in commune_indices]
+        codes = columns['postal', 'code']
         first_algs = code_postal // 1000
         for i in range(len(postal_indices)):
-            if first_algs == data['postal']['code'][postal_indices[i]] // 1000:
+            if first_algs == codes[postal_indices[i]] // 1000:
+                if tracer:
+                    tracer.add('place', by='postal_code', element=code_postal,
+                               voie_ids=voie_indices, id=voie_indices[i],
+                               found=True)
                 return voie_indices[i]
+        if tracer:
+            tracer.add('place', by='postal_code', element=code_postal,
+                       voie_ids=voie_indices, id=None, found=False)
 
     return None
 
 
-def select_localisation(voie_id, numero):
-    """Select record on localisation table with field numero equals to numero.
+def ngram_voie_selection(voie):
+    """Select the records on voie table with field normalise similar to voie.
+
+    The candidates are the records sharing the most trigrams with voie,
+    retrieved from the trigram index, and only those sufficiently similar to
+    voie are kept.
 
     Args:
-        voie_id (int): The index of the street that the numero belongs to.
-        numero (int): The street number.
+        voie (str): The street name.
 
     Returns:
-        localisation_id (int): The index of the record if the search was
-            succeeded, None otherwise.
+        (:obj:`list` of int): The indices of the records, by decreasing
+            similarity to voie.
 
     """
-    if voie_id is None or numero is None:
-        return None
+    if 'voie_trigram_postings' not in data:
+        return []
+
+    voie_indices = ngram.candidates(voie, data['voie_trigram_offsets'],
+                                    data['voie_trigram_postings'],
+                                    ngram_limit)
+    similarity = Similarity(voie).score
+    scores = [similarity(name)
+              for name in columns['voie', 'normalise'][voie_indices].tolist()]
+
+    order = sorted(range(len(scores)), key=lambda i: -scores[i])
+    voie_ids = [int(voie_indices[i]) for i in order
+                if scores[i] >= ngram_threshold]
+
+    tracer = trace.current()
+    if tracer:
+        names = columns['voie', 'normalise']
+        tracer.add('ngram', table='voie', column='normalise', element=voie,
+                   threshold=ngram_threshold, ids=voie_ids,
+                   candidates=[{'id': int(voie_indices[i]),
+                                'name': names[voie_indices[i]],
+                                'score': scores[i]}
+                               for i in order[:trace.candidate_limit]])
+    return voie_ids
 
-    # Binary search
-    ref_element = data['voie'][voie_id]
-    start, end = ref_element['start'], ref_element['end']
-    localisation_id, found = select('localisation', 'numero', start, end,
-                                    numero)
-    return localisation_id if found else None
 
+def complete_voie_selection(code_postal, commune, voie):
+    """Select record on voie table with field normalise most similar to voie.
 
-def get_properties(node_id):
-    """Auxiliary method to the nearest_point method from kdquery package.
+    Search for voie in the entire voie table. This method is the option to find
+    the voie once the method select_voie has failed. It first tries to find the
+    voie belonging to the commune the most similar to commune and if this step
+    fails it will try to find the voie belonging to a postal code similar to
+    code_postal. If none of the voies near to voie in the sorted voie table is
+    found, the same is tried with the voies similar to voie found with the
+    trigram index.
 
     Args:
-        node_id (int): Index of a node in the internal representation of the
-            kd-tree using a numpy array.
+        commune (str): The city name.
 
     Returns:
-        (:obj:`tuple`)
-        (point (:obj:`tuple` of float): Longitude and latitude of the node,
-         region (:ob:`list` of :obj:`list` of float): The region of the Earth`s
-             surface that the node belongs to,
-         dimension (int): The dimension of the surface divided by this node,
-         active (bool): True if the node will be consider in the computation of
-             the nearest point,
-         left (int): Index to left child,
-         right (int): Index to right child)
+        commune_id (int): The index of the record if the search was succeeded,
+            None otherwise.
 
     """
-    table_node = data['kdtree'][node_id]
+    if voie is None:
+        return None
+    metrics.count('complete_voie_selection')
 
-    limit_left = utils.int_to_degree(table_node['limit_left'])
-    limit_right = utils.int_to_degree(table_node['limit_left'])
-    limit_bottom = utils.int_to_degree(table_node['limit_bottom'])
-    limit_top = utils.int_to_degree(table_node['limit_top'])
+    # Binary search
+    key = encode('voie', 'normalise', voie)
+    names, index = columns['voie', 'normalise'], columns['voie_index']
+    i = utils.search_sorted(names, key, sorter=index)
+    voie_id = index[min(i, len(index) - 1)]
 
-    # The region of the space defined by the node
-    region = [[limit_left, limit_right], [limit_bottom, limit_top]]
+    tracer = trace.current()
+    if tracer:
+        tracer.add('index', table='voie', column='normalise', element=key,
+                   id=voie_id, found=names[voie_id] == key)
 
-    # The position of the point in the space
-    point = (utils.int_to_degree(table_node['longitude']),
-             utils.int_to_degree(table_node['latitude']))
+    # If the search was successful and there is no code_postal or commune
+    # to continue, we finish.
+    if code_postal is None and commune is None:
+        return voie_id if names[voie_id] == key else None
 
-    # The dimension divided by this node
-    dimension = table_node['dimension']
+    # Indices of voie table to consider in the heuristics step
+    if names[voie_id] == key:
+        # If the search was successful, the greatest interval of equality
+        j = int(np.searchsorted(names, key, side='right', sorter=index))
+        voie_indices = index[i: j]
+    else:
+        # If the search wasn't successful, pick some near indices from the
+        # search result
+        start, end = limits['voie_index']
+        voie_indices = index[max(start, i - 2): min(end, i + 2)]
 
-    # Indices to left and right children
-    left = table_node['left'] if table_node['left'] != -1 else None
-    right = table_node['right'] if table_node['right'] != -1 else None
+    voie_id = select_voie_by_place(voie_indices, code_postal, commune)
 
-    return point, region, dimension, True, left, right
+    # Fuzzy search: the near indices miss the typos in the first letters
+    if voie_id is None:
+        metrics.count('ngram_voie_selection')
+        voie_id = select_voie_by_place(ngram_voie_selection(voie),
+                                       code_postal, commune)
 
+    return voie_id
 
-def nearest_point_from(query):
-    """Find the nearest node in the internal kd-tree to a given query.
+
+def select_localisation(voie_id, numero):
+    """Select record on localisation table with field numero equals to numero.
 
     Args:
-        query (:obj:`tuple` of float): Longitude and latitude of the position
-            in this order.
+        voie_id (int): The index of the street that the numero belongs to.
+        numero (int): The street number.
 
     Returns:
-        (:obj:`tuple`)
-        (node_id (int): Index of the nearest node in the internal kd-tree,
-         dist (float): The distance between the query and the nearest node)
+        localisation_id (int): The index of the record if the search was
+            succeeded, None otherwise.
 
     """
-    return kdquery.nearest_point(query, 0, get_properties, distance.spherical)
+    if voie_id is None or numero is None:
+        return None
+
+    # Binary search
+    ref_element = data['voie'][voie_id]
+    start, end = ref_element['start'], ref_element['end']
+    localisation_id, found = select('localisation', 'numero', start, end,
+                                    numero)
+    return localisation_id if found else None
@@ -1,15 +1,38 @@
 # -*- coding: utf-8 -*-
 """Creation of the output for the search methods.
 
+The outputs of the position, position_insee and reverse methods are dicts of
+dicts, with every field read from the database. With the argument lazy, these
+methods return Result objects instead, which only keep the record found and
+read the fields from the tables when they are accessed, so a caller only
+needing the coordinates or the quality of the results does not read the
+other tables. Result.to_dict gives the same dict as get_output.
+
+Example:
+    >>> import geocoding
+    >>> output = geocoding.find('91120', 'Palaiseau', '12, Bd des Maréchaux',
+    ...                         lazy=True)
+    >>> output.longitude, output.latitude, output.commune_nom
+    >>> output.to_dict()
+
 Attributes:
     tables (:obj:`list` of :obj:`str`): The name of the tables containing
         useful information to include in the output.
     output_specs (:obj:`dict` of :obj:`list` of :obj:`str`): The fields of each
         table that we want to include in the output.
+    output_dtype (:obj:`numpy.dtype`): The type of the elements of the arrays
+        returned by the batch search methods: the index of the record found in
+        each table (-1 if there is none), the coordinates (nan if there are
+        none) and the quality of the result.
+    reverse_output_dtype (:obj:`numpy.dtype`): The type of the elements of the
+        arrays returned by the batch reverse method: the fields of
+        output_dtype and the distance in degrees to the address found.
 
 """
+import numpy as np
+
 from . import query
-from .utils import int_to_degree
+from .utils import int_to_degree, SCALE
 
 tables = ['departement', 'postal', 'commune', 'voie', 'localisation']
 output_specs = {
@@ -19,6 +42,17 @@ output_specs = {
     'voie': ['nom'],
     'localisation': ['numero']
 }
+output_dtype = np.dtype([
+    ('departement', 'int32'),
+    ('postal', 'int32'),
+    ('commune', 'int32'),
+    ('voie', 'int32'),
+    ('localisation', 'int32'),
+    ('longitude', 'float64'),
+    ('latitude', 'float64'),
+    ('quality', 'int8'),
+])
+reverse_output_dtype = np.dtype(output_dtype.descr + [('distance', 'float64')])
 
 
 def get_table_ids(status):
@@ -50,13 +84,14 @@ def get_table_ids(status):
     return table_ids
 
 
-def get_output(status, quality):
+def get_output(status, quality, lazy=False):
     """Get the information required from each table to build the output.
 
     Args:
         status (:obj:`tuple`): The first element is the name of a table and the
             second is the index of an element in this table.
         quality (int): The quality of the search result.
+        lazy (bool, optional): True to return a Result object.
 
     Returns:
         :obj:`dict`
@@ -80,9 +115,13 @@ def get_output(status, quality):
             'longitude' (float): Longitude coordinate,
             'latitude' (float): Latitude coordinate,
             'quality' (int): The quality of the result
-        }
+        },
+        or a Result object for the same output if lazy is True.
 
     """
+    if lazy:
+        return Result(status, quality)
+
     output = {}
     for table in output_specs:
         output[table] = {field: None for field in output_specs[table]}
@@ -106,10 +145,231 @@ def get_output(status, quality):
     # Get the required information
     for table in output_specs:
         if table in table_ids:
-            record = query.data[table][table_ids[table]]
             fields = output_specs[table]
-            info = {field: record[field].item() for field in fields}
+            info = {field: query.get_field(table, table_ids[table], field)
+                    for field in fields}
             output[table] = info
 
     output['quality'] = quality
     return output
+
+
+class Result():
+    """Output of the search methods, with its fields read on their access.
+
+    The fields of the output of get_output are the attributes longitude,
+    latitude and quality, and the attributes named by their table and their
+    name, as departement_code or commune_nom. The records of the other tables
+    are found from the record of the search on the first access to a field
+    other than the coordinates, and the fields are read from the database at
+    each access. The objects can not be modified once created (their
+    attributes can not be set), so the cache of the results keeps them as
+    they are.
+
+    Attributes:
+        status (:obj:`tuple`): The name of the table and the index of the
+            record found by the search, or None if nothing was found.
+        quality (int): The quality of the result.
+        table_ids (:obj:`dict`): The output of get_table_ids for status, once
+            a field needs it.
+
+    """
+
+    __slots__ = ('status', 'quality', 'table_ids')
+
+    def __init__(self, status, quality):
+        object.__setattr__(self, 'status', status)
+        object.__setattr__(self, 'quality', quality)
+        object.__setattr__(self, 'table_ids', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Result objects can not be modified')
+
+    def __delattr__(self, name):
+        raise AttributeError('Result objects can not be modified')
+
+    def get_id(self, table):
+        """The index of the record of a table, or None if there is none.
+        """
+        if self.status is None:
+            return None
+        if self.table_ids is None:
+            # Filled on the first use, it does not change the fields read
+            object.__setattr__(self, 'table_ids',
+                               get_table_ids(self.status))
+        return self.table_ids.get(table)
+
+    def get_field(self, table, field):
+        """The value of a field of a table, or None if there is none.
+        """
+        element_id = self.get_id(table)
+        if element_id is None:
+            return None
+        return query.get_field(table, element_id, field)
+
+    def get_coordinate(self, field):
+        # Read from the record found, without the records of the other tables
+        if self.status is None or self.quality >= 5:
+            return None
+        table, element_id = self.status
+        return int_to_degree(query.data[table][element_id][field])
+
+    @property
+    def longitude(self):
+        return self.get_coordinate('longitude')
+
+    @property
+    def latitude(self):
+        return self.get_coordinate('latitude')
+
+    @property
+    def departement_code(self):
+        return self.get_field('departement', 'code')
+
+    @property
+    def postal_code(self):
+        return self.get_field('postal', 'code')
+
+    @property
+    def commune_nom(self):
+        return self.get_field('commune', 'nom')
+
+    @property
+    def commune_code_insee(self):
+        return self.get_field('commune', 'code_insee')
+
+    @property
+    def voie_nom(self):
+        return self.get_field('voie', 'nom')
+
+    @property
+    def localisation_numero(self):
+        return self.get_field('localisation', 'numero')
+
+    def __getitem__(self, key):
+        """The item key of the output of get_output, as in a dict.
+        """
+        if key in output_specs:
+            return {field: self.get_field(key, field)
+                    for field in output_specs[key]}
+        if key in ('longitude', 'latitude', 'quality'):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def to_dict(self):
+        """The output of get_output for the same search.
+        """
+        output = {table: self[table] for table in output_specs}
+        output['longitude'] = self.longitude
+        output['latitude'] = self.latitude
+        output['quality'] = self.quality
+        return output
+
+    def __repr__(self):
+        return 'Result(%r, %r)' % (self.status, self.quality)
+
+
+def get_outputs(statuses, qualities, dtype=output_dtype):
+    """Vectorized version of get_output for a sequence of search results.
+
+    Args:
+        statuses (:obj:`list` of :obj:`tuple`): The status of each result, as
+            in get_output.
+        qualities (:obj:`list` of int): The quality of each result.
+        dtype (:obj:`numpy.dtype`, optional): The type of the output, which
+            must contain the fields of output_dtype.
+
+    Returns:
+        (:obj:`numpy.ndarray`): Array with dtype dtype, where the i-th element
+            corresponds to the i-th status.
+
+    """
+    # The position of the table of each status in the list tables (-1 if
+    # nothing was found) and the index of the record in this table.
+    levels = np.full(len(statuses), -1, dtype='int8')
+    element_ids = np.zeros(len(statuses), dtype='int64')
+    for i, status in enumerate(statuses):
+        if status is not None:
+            levels[i] = tables.index(status[0])
+            element_ids[i] = status[1]
+
+    return get_outputs_from_ids(levels, element_ids, qualities, dtype)
+
+
+def get_outputs_from_ids(levels, element_ids, qualities, dtype=output_dtype):
+    """Build the output of the batch search methods from the records found.
+
+    Args:
+        levels (:obj:`numpy.ndarray`): The position in the list tables of the
+            table of each record found, or -1 if nothing was found.
+        element_ids (:obj:`numpy.ndarray`): The index of each record found in
+            its table.
+        qualities (:obj:`numpy.ndarray`): The quality of each result.
+        dtype (:obj:`numpy.dtype`, optional): The type of the output, which
+            must contain the fields of output_dtype.
+
+    Returns:
+        (:obj:`numpy.ndarray`): Array with dtype dtype.
+
+    """
+    output = np.zeros(len(levels), dtype=dtype)
+    output['quality'] = qualities
+    output['longitude'] = np.nan
+    output['latitude'] = np.nan
+
+    # Follow the reference ids from the most precise table to the least one
+    for level in range(len(tables) - 1, -1, -1):
+        table = tables[level]
+        ids = output[table]
+        ids[:] = -1
+
+        selection = (levels == level)
+        ids[selection] = element_ids[selection]
+
+        if level < len(tables) - 1:
+            selection = (levels > level)
+            child_ids = output[tables[level + 1]][selection]
+            ids[selection] = query.data[tables[level + 1]]['ref_id'][child_ids]
+
+        # Get the coordinates of the address in the right format
+        selection = (levels == level) & (output['quality'] < 5)
+        if selection.any():
+            record_ids = ids[selection]
+            for field in ('longitude', 'latitude'):
+                column = query.data[table][field][record_ids]
+                output[field][selection] = column / (10 ** SCALE)
+
+    return output
+
+
+def get_output_from_row(row):
+    """The output of get_output for an element of the arrays of the batch
+    search methods.
+
+    Args:
+        row (:obj:`numpy.void`): An element of an array with dtype
+            output_dtype or reverse_output_dtype.
+
+    Returns:
+        :obj:`dict`: The output of get_output, with the distance to the
+            address found if row has one (None if nothing was found).
+
+    """
+    output = {}
+    for table in output_specs:
+        element_id = int(row[table])
+        output[table] = {
+            field: (query.get_field(table, element_id, field)
+                    if element_id >= 0 else None)
+            for field in output_specs[table]}
+
+    for field in ('longitude', 'latitude'):
+        value = float(row[field])
+        output[field] = value if value == value else None
+    output['quality'] = int(row['quality'])
+
+    for field in row.dtype.names:
+        if field not in output_dtype.names:
+            value = float(row[field])
+            output[field] = value if value == value else None
+    return output
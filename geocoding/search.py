@@ -2,11 +2,18 @@
 """Definition of the search methods.
 
 This module defines the logic of the two most relevant methods of this package:
-the position method and the reverse method.
+the position method and the reverse method, along with their batch versions.
 """
+import math
+
+import numpy as np
+
+from . import cache
+from . import metrics
 from . import normalize
 from . import query
 from . import result
+from . import trace
 
 
 def preprocessing(code_postal, commune, adresse):
@@ -51,13 +58,61 @@ def preprocessing(code_postal, commune, adresse):
     return code_postal, commune, numero, voie, voie_type
 
 
-def position(code_postal=None, commune=None, adresse=None):
+def get_status(postal_id, commune_id, voie_id, localisation_id, numero):
+    """Choose the most precise record found by the search and its quality.
+
+    Args:
+        postal_id (int): The index of the postal code found or None.
+        commune_id (int): The index of the city found or None.
+        voie_id (int): The index of the street found or None.
+        localisation_id (int): The index of the street number found or None.
+        numero (int): The street number given as input or None.
+
+    Returns:
+        (:obj:`tuple`)
+        (status (:obj:`tuple`): The name of the table and the index of the
+             record in this table or None if nothing was found,
+         quality (int): The quality of the result)
+
+    """
+    if localisation_id is not None:
+        # Quality = 1 -> The search was successful.
+        status, quality = ('localisation', localisation_id), 1
+
+    elif voie_id is not None:
+        status = ('voie', voie_id)
+        # Quality = 2 -> The precise number was not found.
+        # Quality = 3 -> The precise number was not found and there was no
+        #                number in the input.
+        quality = 3 if numero is None else 2
+
+    elif commune_id is not None:
+        # Quality = 4 -> The street was not found.
+        status, quality = ('commune', commune_id), 4
+
+    elif postal_id is not None:
+        # Quality = 5 -> The commune was not found.
+        status, quality = ('postal', postal_id), 5
+
+    else:
+        # Quality = 6 -> Nothing was found.
+        status, quality = None, 6
+
+    return status, quality
+
+
+def position(code_postal=None, commune=None, adresse=None, explain=False,
+             lazy=False):
     """Find the position over the surface of the Earth of the given address.
 
     Args:
         code_postal (str): The postal code.
         commune (str): The city name.
         adresse(str): Address with number and street name.
+        explain (bool, optional): True to add the trace of the search to the
+            output, under the key 'explain' (see the module trace).
+        lazy (bool, optional): True to return a Result object, which reads
+            the fields of the output on their access (see the module result).
 
     Returns:
         :obj:`dict`
@@ -81,68 +136,310 @@ def position(code_postal=None, commune=None, adresse=None):
             'longitude' (float): Longitude coordinate,
             'latitude' (float): Latitude coordinate,
             'quality' (int): The quality of the result
-        }
+        },
+        or a Result object for the same output if lazy is True.
 
     Example:
         >>> from geocoding import search
         >>> search.position('91120', 'Palaiseau', '12, Bd des Maréchaux')
 
     """
-    query.setup()
+    if explain:
+        return trace.explain(position, 'position', code_postal, commune,
+                             adresse)
+    tracer = trace.current()
+    timer = tracer or metrics.timer('position')
 
     # Input preprocessing.
     code_postal, commune, numero, voie, voie_type = \
         preprocessing(code_postal, commune, adresse)
+    if timer:
+        timer.stage('preprocessing')
+    if tracer:
+        tracer.set_input(code_postal=code_postal, commune=commune,
+                         numero=numero, voie=voie, voie_type=voie_type)
+
+    # Result of the same preprocessed input, if cached.
+    key = (code_postal, commune, numero, voie, voie_type, lazy)
+    if cache.enabled and not tracer:
+        output = cache.get_position(key)
+        if timer:
+            timer.stage('cache')
+        if output is not None:
+            if timer:
+                timer.finish(output['quality'], cached=True)
+            return output
 
     # Try to find postal code.
     postal_id = query.select_code_postal(code_postal)
+    if timer:
+        timer.stage('select_code_postal')
 
     # Try to find city.
     commune_id = query.select_commune(postal_id, commune)
+    if timer:
+        timer.stage('select_commune')
     if commune_id is None:
         commune_id = query.complete_commune_selection(commune)
+        if timer:
+            timer.stage('complete_commune_selection')
 
     # Try to find street.
     voie_id = query.select_voie(commune_id, voie, voie_type)
+    if timer:
+        timer.stage('select_voie')
     if voie_id is None:
         voie_id = query.complete_voie_selection(code_postal, commune, voie)
+        if timer:
+            timer.stage('complete_voie_selection')
 
     # Try to find number.
     localisation_id = query.select_localisation(voie_id, numero)
+    if timer:
+        timer.stage('select_localisation')
 
     # Prepare the output.
-    if localisation_id is not None:
-        # Quality = 1 -> The search was successful.
-        status, quality = ('localisation', localisation_id), 1
+    status, quality = get_status(postal_id, commune_id, voie_id,
+                                 localisation_id, numero)
+    output = result.get_output(status, quality, lazy)
+    if timer:
+        timer.stage('get_output')
 
-    elif voie_id is not None:
-        status = ('voie', voie_id)
-        # Quality = 2 -> The precise number was not found.
-        # Quality = 3 -> The precise number was not found and there was no
-        #                number in the input.
-        quality = 3 if numero is None else 2
+    if cache.enabled and not tracer:
+        cache.put_position(key, output)
 
-    elif commune_id is not None:
-        # Quality = 4 -> The street was not found.
-        status, quality = ('commune', commune_id), 4
+    if timer:
+        timer.finish(quality)
+    return output
 
-    elif postal_id is not None:
-        # Quality = 5 -> The commune was not found.
-        status, quality = ('postal', postal_id), 5
 
+def position_insee(code_insee=None, adresse=None, explain=False, lazy=False):
+    """Find the position of an address in the city with a given INSEE code.
+
+    The city is found directly from its INSEE code, so there is no search of
+    the postal code and of the name of the city, and the street is searched
+    in the city for each of its postal codes.
+
+    Args:
+        code_insee (str): The INSEE code of the city.
+        adresse(str): Address with number and street name.
+        explain (bool, optional): True to add the trace of the search to the
+            output, under the key 'explain' (see the module trace).
+        lazy (bool, optional): True to return a Result object, which reads
+            the fields of the output on their access (see the module result).
+
+    Returns:
+        :obj:`dict`: The same as the position method, or a Result object if
+        lazy is True.
+
+    Example:
+        >>> from geocoding import search
+        >>> search.position_insee('91477', '12, Bd des Maréchaux')
+
+    """
+    if explain:
+        return trace.explain(position_insee, 'position_insee', code_insee,
+                             adresse)
+    tracer = trace.current()
+    timer = tracer or metrics.timer('position_insee')
+
+    # Input preprocessing.
+    if isinstance(code_insee, int):
+        code_insee = '{:05d}'.format(code_insee)
+    elif isinstance(code_insee, str):
+        code_insee = code_insee.strip().upper()
     else:
-        # Quality = 6 -> Nothing was found.
-        status, quality = None, 6
+        code_insee = None
 
-    return result.get_output(status, quality)
+    numero, voie, voie_type = None, None, None
+    if isinstance(adresse, str):
+        numero, voie, voie_type = normalize.mine(adresse)
+    if timer:
+        timer.stage('preprocessing')
+    if tracer:
+        tracer.set_input(code_insee=code_insee, numero=numero, voie=voie,
+                         voie_type=voie_type)
+
+    # Result of the same preprocessed input, if cached.
+    key = ('code_insee', code_insee, numero, voie, voie_type, lazy)
+    if cache.enabled and not tracer:
+        output = cache.get_position(key)
+        if timer:
+            timer.stage('cache')
+        if output is not None:
+            if timer:
+                timer.finish(output['quality'], cached=True)
+            return output
+
+    # Find the city and the street.
+    commune_ids = query.select_code_insee(code_insee)
+    if timer:
+        timer.stage('select_code_insee')
+    commune_id, voie_id = query.select_voie_in_communes(commune_ids, voie,
+                                                        voie_type, numero)
+    if timer:
+        timer.stage('select_voie_in_communes')
 
+    # Try to find number.
+    localisation_id = query.select_localisation(voie_id, numero)
+    if timer:
+        timer.stage('select_localisation')
+
+    # Prepare the output.
+    status, quality = get_status(None, commune_id, voie_id, localisation_id,
+                                 numero)
+    output = result.get_output(status, quality, lazy)
+    if timer:
+        timer.stage('get_output')
+
+    if cache.enabled and not tracer:
+        cache.put_position(key, output)
+
+    if timer:
+        timer.finish(quality)
+    return output
+
+
+def position_many(code_postal=None, commune=None, adresse=None):
+    """Find the position over the surface of the Earth of many addresses.
+
+    Batch version of the position method. Identical inputs (after
+    normalization) are searched only once, and the searches of the postal
+    codes, cities, streets and numbers are grouped so that each range of the
+    database is searched once per group of queries.
+
+    Args:
+        code_postal (:obj:`list` of str, optional): The postal codes.
+        commune (:obj:`list` of str, optional): The city names.
+        adresse (:obj:`list` of str, optional): Addresses with number and
+            street name.
+
+        All the arguments given must have the same length; missing arguments
+        are considered to be None for all the addresses.
+
+    Returns:
+        (:obj:`numpy.ndarray`): Array with dtype result.output_dtype, where
+            the i-th element is the result of position(code_postal[i],
+            commune[i], adresse[i]).
 
-def reverse(position):
+    Example:
+        >>> from geocoding import search
+        >>> output = search.position_many(['91120', '75015'],
+        ...                               ['Palaiseau', 'Paris'],
+        ...                               ['12, Bd des Maréchaux',
+        ...                                '1 rue Saint Charles'])
+        >>> output['longitude'], output['latitude'], output['quality']
+
+    """
+    columns = [None if column is None else list(column)
+               for column in (code_postal, commune, adresse)]
+    sizes = set(len(column) for column in columns if column is not None)
+    if len(sizes) > 1:
+        raise ValueError('All the arguments must have the same length')
+    size = sizes.pop() if sizes else 0
+    columns = [[None] * size if column is None else column
+               for column in columns]
+
+    # Input preprocessing, once for each distinct input.
+    inputs, inverse = {}, np.zeros(size, dtype='int64')
+    for i, row in enumerate(zip(*columns)):
+        row = tuple(value if isinstance(value, str) else None
+                    for value in row)
+        if row not in inputs:
+            inputs[row] = len(inputs)
+        inverse[i] = inputs[row]
+
+    # Remove the duplicates that only appear after normalization.
+    keys, key_ids = {}, []
+    for row in inputs:
+        key = preprocessing(*row)
+        if key not in keys:
+            keys[key] = len(keys)
+        key_ids.append(keys[key])
+    inverse = np.array(key_ids, dtype='int64')[inverse]
+
+    # Try to find postal codes.
+    postal_ids = {}
+    for key in keys:
+        code = key[0]
+        if code not in postal_ids:
+            postal_ids[code] = query.select_code_postal(code)
+
+    # Try to find cities, once for each pair of postal code and city.
+    commune_ids = {}
+    for key in keys:
+        group = (postal_ids[key[0]], key[1])
+        if group not in commune_ids:
+            commune_id = query.select_commune(*group)
+            if commune_id is None:
+                commune_id = query.complete_commune_selection(key[1])
+            commune_ids[group] = commune_id
+
+    # Try to find streets, once for each city and street.
+    voie_ids, complete_voie_ids = {}, {}
+    for key in keys:
+        code, commune_name, numero, voie, voie_type = key
+        group = (commune_ids[(postal_ids[code], commune_name)], voie,
+                 voie_type)
+        if group not in voie_ids:
+            voie_ids[group] = query.select_voie(*group)
+        if voie_ids[group] is None:
+            complete_group = (code, commune_name, voie)
+            if complete_group not in complete_voie_ids:
+                complete_voie_ids[complete_group] = \
+                    query.complete_voie_selection(*complete_group)
+
+    # Gather the numbers to search in each street.
+    numeros = {}
+    found_ids = []
+    for key in keys:
+        code, commune_name, numero, voie, voie_type = key
+        postal_id = postal_ids[code]
+        commune_id = commune_ids[(postal_id, commune_name)]
+        voie_id = voie_ids[(commune_id, voie, voie_type)]
+        if voie_id is None:
+            voie_id = complete_voie_ids[(code, commune_name, voie)]
+        found_ids.append((postal_id, commune_id, voie_id, numero))
+        if voie_id is not None and numero is not None:
+            numeros.setdefault(voie_id, set()).add(numero)
+
+    # Try to find numbers, with one vectorized search for each street.
+    localisation_ids = {}
+    column = query.columns['localisation', 'numero']
+    for voie_id, numero_set in numeros.items():
+        numero_list = sorted(numero_set)
+        ref_element = query.data['voie'][voie_id]
+        start, end = int(ref_element['start']), int(ref_element['end'])
+        values = np.array(numero_list, dtype='int64')
+        positions = start + np.searchsorted(column[start:end], values)
+        found = (positions < end)
+        found[found] = (column[positions[found]] == values[found])
+        for numero, position, success in zip(numero_list, positions, found):
+            if success:
+                localisation_ids[(voie_id, numero)] = int(position)
+
+    # Prepare the output.
+    statuses, qualities = [], []
+    for postal_id, commune_id, voie_id, numero in found_ids:
+        localisation_id = localisation_ids.get((voie_id, numero))
+        status, quality = get_status(postal_id, commune_id, voie_id,
+                                     localisation_id, numero)
+        statuses.append(status)
+        qualities.append(quality)
+
+    return result.get_outputs(statuses, qualities)[inverse]
+
+
+def reverse(position, explain=False, lazy=False):
     """Finds the nearest address in France to a given position over the Earth.
 
     Args:
         position (:obj:`tuple` of float): Longitude and latitude of the in this
             order.
+        explain (bool, optional): True to add the trace of the search to the
+            output, under the key 'explain' (see the module trace).
+        lazy (bool, optional): True to return a Result object, which reads
+            the fields of the output on their access (see the module result).
 
     Returns:
         :obj:`dict`
@@ -166,19 +463,101 @@ def reverse(position):
             'longitude' (float): Longitude coordinate,
             'latitude' (float): Latitude coordinate,
             'quality' (int): The quality of the result
-        }
+        },
+        or a Result object for the same output if lazy is True.
 
     Example:
         >>> from geocoding import search
         >>> search.reverse((2.21, 48))
 
     """
-    query.setup()
+    if explain:
+        return trace.explain(reverse, 'reverse', position)
+    if position is None or not (math.isfinite(position[0]) and
+                                math.isfinite(position[1])):
+        return result.get_output(None, 6, lazy)
+
+    tracer = trace.current()
+    timer = tracer or metrics.timer('reverse')
+    if tracer:
+        tracer.set_input(position=position)
+
+    if cache.enabled and not tracer:
+        output = cache.get_reverse(position, lazy)
+        if timer:
+            timer.stage('cache')
+        if output is not None:
+            if timer:
+                timer.finish(output['quality'], cached=True)
+            return output
+
+    # Only needed by the reverse search
+    from . import nearest
+
+    stats = {} if tracer else None
+    node_id, dist = nearest.nearest(position, stats)
+    if timer:
+        timer.stage('nearest')
+    if tracer:
+        tracer.add('kdtree', id=node_id, distance=dist,
+                   visited=stats['visited'], pruned=stats['pruned'])
+    if node_id is None:
+        output = result.get_output(None, 6, lazy)
+    else:
+        # Get the reference id for the address.
+        localisation_id = query.data['kdtree']['ref_id'][node_id]
+        output = result.get_output(('localisation', localisation_id), 1,
+                                   lazy)
+    if timer:
+        timer.stage('get_output')
+
+    if cache.enabled and not tracer:
+        cache.put_reverse(position, output, lazy)
+
+    if timer:
+        timer.finish(output['quality'])
+    return output
+
+
+def reverse_many(lons, lats):
+    """Find the nearest address in France to many positions over the Earth.
+
+    Batch version of the reverse method. The positions are sorted along a
+    Morton curve and the kd-tree is walked for whole blocks of positions at
+    once.
+
+    Args:
+        lons (:obj:`list` of float): The longitude of each position.
+        lats (:obj:`list` of float): The latitude of each position.
+
+    Returns:
+        (:obj:`numpy.ndarray`): Array with dtype result.reverse_output_dtype,
+            where the i-th element is the address nearest to the position
+            (lons[i], lats[i]). Positions with a nan coordinate have quality
+            6.
+
+    Example:
+        >>> from geocoding import search
+        >>> output = search.reverse_many([2.21, 2.35], [48, 48.85])
+        >>> output['voie'], output['distance']
+
+    """
+    lons = np.asarray(lons, dtype='float64')
+    lats = np.asarray(lats, dtype='float64')
+    if lons.shape != lats.shape or lons.ndim != 1:
+        raise ValueError('lons and lats must be 1d arrays of the same length')
+
+    from . import nearest
+
+    node_ids, dists = nearest.nearest_many(lons, lats)
+    found = (node_ids != -1)
 
-    if position is None:
-        return result.get_output(None, 6)
-    node_id, dist = query.nearest_point_from(position)
+    levels = np.where(found, result.tables.index('localisation'), -1)
+    element_ids = np.zeros(len(node_ids), dtype='int64')
+    element_ids[found] = query.data['kdtree']['ref_id'][node_ids[found]]
+    qualities = np.where(found, 1, 6)
 
-    # Get the reference id for the address.
-    localisation_id = query.data['kdtree']['ref_id'][node_id]
-    return result.get_output(('localisation', localisation_id), 1)
+    output = result.get_outputs_from_ids(levels, element_ids, qualities,
+                                         result.reverse_output_dtype)
+    output['distance'] = dists
+    return output
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""Local HTTP geocoding service.
+
+The service is formed by a pool of worker processes forked from a parent
+process, which maps the tables of the database, imports the search modules
+and opens the listening socket before the fork: the workers share the pages
+of the read-only tables and accept the connections on the same socket. Each
+worker serves its connections in threads, so the connections kept alive by
+idle clients do not block it, and the searches of the workers run in
+parallel. A worker that exits is replaced by a new one.
+
+The responses are JSON documents, with the outputs of the search methods.
+The batch endpoints return a JSON array, streamed with the chunked transfer
+encoding batch_size results at a time, so the first results are sent before
+the last ones are searched. If a search fails once the response started, the
+connection is closed before the end of the chunks.
+
+Endpoints:
+    GET /find?code_postal=...&commune=...&adresse=...
+    GET /find_insee?code_insee=...&adresse=...
+    GET /near?lon=...&lat=...
+    POST /find_many with a JSON array of objects with the keys code_postal,
+        commune and adresse (each one optional).
+    POST /near_many with a JSON array of [lon, lat] pairs.
+    GET /health
+    GET /metrics with the metrics of the worker answering, in the text format
+        of Prometheus (see metrics), labelled with its process id. The
+        metrics are recorded when the service is run with serve --metrics.
+
+The GET endpoints of the searches add the trace of the search to the output
+with the parameter explain=1 (see the module trace).
+
+The method load_test is a load generator, which sends requests built from
+random addresses of the database to a running service, with load_concurrency
+client processes keeping their connection alive, and reports the throughput
+and the percentiles of the latency.
+
+Example:
+    $ geocoding serve --port=8000 --workers=4
+    $ geocoding serve --metrics --port=8000
+    $ curl 'localhost:8000/find?code_postal=91120&commune=Palaiseau'
+    $ geocoding load --port=8000 --requests=20000 --concurrency=8
+
+Attributes:
+    host (str): The address the service listens on.
+    port (int): The port the service listens on.
+    workers (int): The number of worker processes, the number of CPUs if
+        None.
+    preload_mode (str): The mode of query.preload used to load the tables
+        before the fork, or None to only map them.
+    batch_size (int): The number of results searched and sent at a time by
+        the batch endpoints.
+    max_body_size (int): The maximum size in bytes of the body of a request.
+    verbose (bool): True to log each request on the standard error.
+    load_requests (int): The number of requests sent by load_test.
+    load_concurrency (int): The number of clients of load_test.
+    load_endpoint (str): The endpoint requested by load_test: find, near,
+        find_many or near_many.
+    load_batch (int): The number of addresses of each request of load_test to
+        a batch endpoint.
+
+"""
+import http.client
+import json
+import os
+import signal
+import socketserver
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import Pool
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import numpy as np
+
+from . import metrics, query, result, search
+from .bench import sample_addresses
+from .datapaths import paths, columns
+
+host = '127.0.0.1'
+port = 8000
+workers = None
+preload_mode = 'willneed'
+batch_size = 1000
+max_body_size = 2 ** 26
+verbose = False
+load_requests = 10000
+load_concurrency = 8
+load_endpoint = 'find'
+load_batch = 100
+
+
+class RequestError(Exception):
+    """Error of a request, sent to the client with an HTTP status code.
+    """
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class Server(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server handling each connection in a thread.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Handler of the requests to the endpoints of the service.
+
+    The connections are kept alive (HTTP/1.1): the responses have either a
+    Content-Length header or the chunked transfer encoding. The headers and
+    the body are written separately, so the Nagle algorithm is disabled not
+    to delay the body until the client acknowledges the headers.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            params = {key: values[-1] for key, values in
+                      parse_qs(url.query, keep_blank_values=True).items()}
+            explain = params.get('explain', '').lower() in ('1', 'true')
+            if url.path == '/find':
+                output = search.position(params.get('code_postal'),
+                                         params.get('commune'),
+                                         params.get('adresse'), explain)
+            elif url.path == '/find_insee':
+                output = search.position_insee(params.get('code_insee'),
+                                               params.get('adresse'), explain)
+            elif url.path == '/near':
+                output = search.reverse(get_position(params), explain)
+            elif url.path == '/health':
+                output = {'status': 'ok', 'pid': os.getpid()}
+            elif url.path == '/metrics':
+                self.send_text(200, metrics.prometheus({'pid': os.getpid()}))
+                return
+            else:
+                raise RequestError(404, 'Unknown endpoint %s' % url.path)
+        except RequestError as error:
+            self.send_error_json(error.status, str(error))
+            return
+        except Exception as error:
+            self.log_error('%s: %s', type(error).__name__, error)
+            self.send_error_json(500, 'Internal error')
+            return
+        self.send_json(200, output)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        try:
+            body = self.read_body()
+            if url.path == '/find_many':
+                batches = find_batches(parse_addresses(body))
+            elif url.path == '/near_many':
+                batches = near_batches(parse_positions(body))
+            else:
+                raise RequestError(404, 'Unknown endpoint %s' % url.path)
+        except RequestError as error:
+            self.send_error_json(error.status, str(error))
+            return
+        except Exception as error:
+            self.log_error('%s: %s', type(error).__name__, error)
+            self.send_error_json(500, 'Internal error')
+            return
+        self.send_stream(batches)
+
+    def read_body(self):
+        """The body of the request, decoded from JSON.
+        """
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            raise RequestError(411, 'Content-Length required')
+        if int(length) > max_body_size:
+            self.close_connection = True
+            raise RequestError(413, 'The body is larger than %d bytes'
+                               % max_body_size)
+        try:
+            return json.loads(self.rfile.read(int(length)).decode('utf-8'))
+        except ValueError as error:
+            raise RequestError(400, 'Invalid JSON body: %s' % error)
+
+    def send_json(self, status, output):
+        body = json.dumps(output, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {'error': message})
+
+    def send_stream(self, batches):
+        """Send a JSON array of the outputs of each batch, one chunk a batch.
+
+        The headers are sent once the first batch is searched, so an error in
+        its search is answered with the status 500. An error in a later batch
+        stops the chunks before their end and closes the connection, so the
+        client sees an incomplete response rather than a truncated array.
+
+        """
+        batches = iter(batches)
+        try:
+            outputs = next(batches, [])
+        except Exception as error:
+            self.log_error('%s: %s', type(error).__name__, error)
+            self.send_error_json(500, 'Internal error')
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        separator = '['
+        try:
+            while outputs is not None:
+                if outputs:
+                    text = separator + ','.join(
+                        json.dumps(output, ensure_ascii=False)
+                        for output in outputs)
+                    self.write_chunk(text.encode('utf-8'))
+                    separator = ','
+                outputs = next(batches, None)
+        except Exception as error:
+            self.log_error('%s: %s', type(error).__name__, error)
+            self.close_connection = True
+            return
+        self.write_chunk(b'[]' if separator == '[' else b']')
+        self.write_chunk(b'')
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+
+    def log_message(self, format, *args):
+        if verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def get_position(params):
+    """The position (lon, lat) of the parameters of a request to /near.
+    """
+    try:
+        return (float(params['lon']), float(params['lat']))
+    except KeyError as error:
+        raise RequestError(400, 'Missing parameter %s' % error)
+    except ValueError as error:
+        raise RequestError(400, 'Invalid parameter: %s' % error)
+
+
+def parse_addresses(body):
+    """The columns code_postal, commune and adresse of a request to
+    /find_many.
+    """
+    if not isinstance(body, list) or \
+            not all(isinstance(item, dict) for item in body):
+        raise RequestError(400, 'The body must be an array of objects')
+    return [[item.get(key) for item in body]
+            for key in ('code_postal', 'commune', 'adresse')]
+
+
+def parse_positions(body):
+    """The longitudes and latitudes of a request to /near_many.
+    """
+    try:
+        positions = np.array(body, dtype='float64').reshape(-1, 2)
+    except (TypeError, ValueError):
+        positions = None
+    if positions is None or not isinstance(body, list) or \
+            len(positions) != len(body):
+        raise RequestError(400, 'The body must be an array of [lon, lat]')
+    return positions[:, 0], positions[:, 1]
+
+
+def find_batches(addresses):
+    """The outputs of the addresses of a request, batch_size at a time.
+    """
+    for start in range(0, len(addresses[0]), batch_size):
+        rows = search.position_many(
+            *[column[start: start + batch_size] for column in addresses])
+        yield [result.get_output_from_row(row) for row in rows]
+
+
+def near_batches(positions):
+    """The outputs of the positions of a request, batch_size at a time.
+    """
+    lons, lats = positions
+    for start in range(0, len(lons), batch_size):
+        rows = search.reverse_many(lons[start: start + batch_size],
+                                   lats[start: start + batch_size])
+        yield [result.get_output_from_row(row) for row in rows]
+
+
+def prepare():
+    """Map the tables and import the modules used by the searches, so the
+    workers forked afterwards share them.
+    """
+    tables = [table for table in paths if table in query.data]
+    if preload_mode is not None:
+        query.preload(tables, mode=preload_mode)
+    for table in tables:
+        query.limits[table]
+
+    for table, fields in columns.items():
+        for field in fields:
+            if table in query.data:
+                query.columns[table, field]
+    for table in ('postal_index', 'commune_index', 'voie_index',
+                  'code_insee_index'):
+        if table in query.data:
+            query.columns[table]
+
+    if 'kdtree' in query.data:
+        from . import nearest  # noqa: F401
+
+
+def serve():
+    """Run the service until it is interrupted.
+
+    Returns:
+        (bool): True when the service is stopped.
+
+    """
+    prepare()
+    try:
+        server = Server((host, port), Handler)
+    except OSError as error:
+        print('Can not listen on %s:%d: %s' % (host, port, error))
+        return False
+    count = workers or os.cpu_count() or 1
+
+    if count == 1 or not hasattr(os, 'fork'):
+        print('Serving on http://%s:%d with 1 worker' % (host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return True
+
+    children = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    for _ in range(count):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print('Serving on http://%s:%d with %d workers' % (host, port, count))
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print('Worker %d exited, starting a new one' % pid)
+            spawn()
+
+    server.server_close()
+    return True
+
+
+def serve_with_metrics():
+    """Run the service with the metrics recorded by each worker.
+    """
+    metrics.enable()
+    return serve()
+
+
+def get_requests(count, endpoint):
+    """Requests (method, path, body) to an endpoint, built from random
+    addresses of the database.
+    """
+    if endpoint not in ('find', 'near', 'find_many', 'near_many'):
+        raise ValueError('Unknown endpoint %s' % endpoint)
+    size = load_batch if endpoint.endswith('_many') else 1
+    addresses = sample_addresses(count * size, np.random.default_rng(0))
+
+    if endpoint.startswith('near'):
+        items = [[address['longitude'], address['latitude']]
+                 for address in addresses]
+    else:
+        items = [{key: address[key]
+                  for key in ('code_postal', 'commune', 'adresse')}
+                 for address in addresses]
+
+    if size == 1:
+        if endpoint == 'near':
+            return [('GET', '/near?' + urlencode({'lon': lon, 'lat': lat}),
+                     None) for lon, lat in items]
+        return [('GET', '/find?' + urlencode(item), None) for item in items]
+    return [('POST', '/' + endpoint,
+             json.dumps(items[start: start + size]).encode('utf-8'))
+            for start in range(0, len(items), size)]
+
+
+def run_client(requests):
+    """Send requests on one connection kept alive.
+
+    Returns:
+        (:obj:`tuple`): The latency of each request in seconds, and the
+            number of requests which failed.
+
+    """
+    connection = http.client.HTTPConnection(host, port)
+    latencies, errors = [], 0
+    for method, path, body in requests:
+        start = time.perf_counter()
+        try:
+            headers = {'Content-Type': 'application/json'} if body else {}
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    return latencies, errors
+
+
+def load_test():
+    """Measure the throughput and the latency of a running service.
+
+    Returns:
+        (bool): True if all the requests succeeded.
+
+    """
+    try:
+        requests = get_requests(load_requests, load_endpoint)
+    except (KeyError, ValueError) as error:
+        print('Can not build the requests: %s' % error)
+        return False
+    clients = min(load_concurrency, len(requests))
+    if not clients:
+        return True
+
+    with Pool(clients) as pool:
+        start = time.perf_counter()
+        outputs = pool.map(run_client,
+                           [requests[i::clients] for i in range(clients)])
+        duration = time.perf_counter() - start
+
+    latencies = np.concatenate([latency for latency, _ in outputs]) * 1000
+    errors = sum(error for _, error in outputs)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    addresses = len(requests) * (load_batch if '_many' in load_endpoint
+                                 else 1)
+    print('%d requests to /%s by %d clients in %.2f s, %d errors'
+          % (len(requests), load_endpoint, clients, duration, errors))
+    print('%.0f requests/s, %.0f addresses/s'
+          % (len(requests) / duration, addresses / duration))
+    print('latency p50 %.2f ms, p95 %.2f ms, p99 %.2f ms, max %.2f ms'
+          % (p50, p95, p99, latencies.max()))
+    sys.stdout.flush()
+    return not errors
@@ -5,7 +5,24 @@ This module defines the class used for computing the score of similarity
 between two strings. Even with the ideas for computing this score are well know
 (ngrams), the exactly method is not and that`s why an own implementation was
 needed.
+
+The sets of uni and bigrams of the strings of the database are also stored as
+signatures: the sorted codes (keys) of the uni and bigrams of each string, as
+in the module ngram, and the score of its set, so the scores of a whole range
+of strings are computed at once with numpy. The signature of a string with a
+character out of ngram.alphabet has no keys and a score of -1.
+
+Attributes:
+    key_size (int): The number of keys of the uni and bigrams. The key of a
+        unigram is the code of its character, lower than ngram.base, and the
+        key of a bigram is greater.
+
 """
+import numpy as np
+
+from . import ngram
+
+key_size = ngram.base * (ngram.base + 1)
 
 
 class Similarity():
@@ -31,6 +48,7 @@ class Similarity():
         """
         self.slice_set = set(list(s) + self.k_letters_list(s, 2))
         self.slice_set_score = self.set_score(self.slice_set)
+        self.members = None
 
     def k_letters_list(self, s, k):
         """List of all the strings formed by k consecutive letters of s.
@@ -62,13 +80,16 @@ class Similarity():
         set of unigrams and bigrams of s and t.
 
         Args:
-            t (str): The string to compare.
+            t (str or bytes): The string to compare (ASCII if bytes).
 
         Returns:
             (float): The score of similarity between t and the string s passed
                 as argument in the initialization of the class.
 
         """
+        if isinstance(t, bytes):
+            t = t.decode('ascii')
+
         # Union of the unigram and bigram of t
         slice_set = set(list(t) + self.k_letters_list(t, 2))
         slice_set_score = self.set_score(slice_set)
@@ -85,3 +106,90 @@ class Similarity():
             return 0
 
         return intersection_score / union_score
+
+    def score_many(self, signatures, keys):
+        """String similarity scores of strings from their signatures.
+
+        Args:
+            signatures (:obj:`numpy.ndarray`): The signatures of the strings,
+                with the fields start, end and score.
+            keys (:obj:`numpy.ndarray`): The keys of all the signatures.
+
+        Returns:
+            (:obj:`numpy.ndarray`): The score of similarity between each string
+                and the string s passed as argument in the initialization of
+                the class, the same as the method score, or nan for the
+                strings without keys in their signature.
+
+        """
+        if not len(signatures):
+            return np.zeros(0)
+
+        # Keys of the uni and bigrams of s
+        if self.members is None:
+            self.members = np.zeros(key_size, dtype='bool')
+            for word in self.slice_set:
+                codes = [ngram.codes.get(char) for char in word]
+                if None not in codes:
+                    self.members[codes[0] if len(codes) == 1 else
+                                 ngram.base * (codes[0] + 1) + codes[1]] = True
+
+        first = signatures['start'][0]
+        string_keys = keys[first: signatures['end'][-1]]
+        weights = np.where(string_keys < ngram.base, 1, 2) * \
+            self.members[string_keys]
+        cumulative = np.concatenate(([0], np.cumsum(weights)))
+
+        intersection_score = cumulative[signatures['end'] - first] - \
+            cumulative[signatures['start'] - first]
+        union_score = signatures['score'] + self.slice_set_score - \
+            intersection_score
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(union_score == 0, 0, intersection_score /
+                              union_score)
+        scores[signatures['score'] < 0] = np.nan
+        return scores
+
+
+def signatures_many(strings):
+    """Signatures of an array of strings.
+
+    Args:
+        strings (:obj:`numpy.ndarray`): The strings, of a numpy unicode or
+            byte string type.
+
+    Returns:
+        (:obj:`tuple`)
+        (scores (:obj:`numpy.ndarray`): The score of the set of uni and bigrams
+             of each string or -1 if it has a character out of the alphabet,
+         counts (:obj:`numpy.ndarray`): The number of keys of each string,
+         keys (:obj:`numpy.ndarray`): The keys of the strings, sorted by
+             string and then by key.)
+
+    """
+    strings = np.ascontiguousarray(strings)
+    chars = ngram.get_chars(strings)
+    width = chars.shape[1]
+    codes = ngram.lookup[np.minimum(chars, 128)]
+    lengths = np.char.str_len(strings)
+    positions = np.arange(width)
+
+    unigrams = np.where(positions < lengths[:, np.newaxis], codes, -1)
+    bigrams = np.where(positions[:-1] < lengths[:, np.newaxis] - 1,
+                       ngram.base * (codes[:, :-1] + 1) + codes[:, 1:], -1)
+    grams = np.concatenate((unigrams, bigrams), axis=1)
+    exact = ~(unigrams == len(ngram.alphabet)).any(axis=1)
+
+    rows = np.broadcast_to(np.arange(len(strings))[:, np.newaxis],
+                           grams.shape)
+    valid = (grams >= 0) & exact[:, np.newaxis]
+    pairs = np.sort(rows[valid] * key_size + grams[valid])
+    pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+    rows, keys = pairs // key_size, pairs % key_size
+
+    counts = np.bincount(rows, minlength=len(strings))
+    scores = np.bincount(rows, weights=np.where(keys < ngram.base, 1, 2),
+                         minlength=len(strings)).astype('int32')
+    scores[~exact] = -1
+    return scores, counts, keys.astype('uint16')
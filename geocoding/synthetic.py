@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""Generation of synthetic BAN files.
+
+The files are written as the BAN files downloaded (ban-XX.csv.gz, with the
+columns read by the module ban_processing), so the database can be built and
+searched without access to the BAN, and at a larger scale than France:
+
+* the communes of each departement have a log-normal number of addresses,
+  and their names are built from French-like words, distinct in the
+  departement once normalized;
+* the postal codes group one or a few communes, and the largest communes
+  are split between several postal codes, street by street;
+* the streets of a commune have a log-normal number of numbers, with some
+  repetitions (bis, ter...), and some of them are in a lieu-dit (the field
+  nom_complementaire);
+* the addresses of a street are lined up along a segment, the odd and the
+  even numbers on each side, around the center of their commune, itself
+  around the center of its departement.
+
+The output only depends on the seed, the scale and the departement, so the
+same departement is the same in every run.
+
+Example:
+    $ geocoding generate --scale=0.01 --seed=0
+    $ geocoding index
+    $ geocoding reverse
+
+Attributes:
+    scale (float): The size of the files, relative to France: with 1, about
+        communes_per_departement communes per departement and
+        addresses_per_commune addresses per commune on average.
+    seed (int): The seed of the random generators.
+    departements (:obj:`list` of str): The departements generated, all the
+        departements of the BAN if None.
+    communes_per_departement (int): The average number of communes of a
+        departement at scale 1.
+    addresses_per_commune (int): The median number of addresses of a
+        commune.
+    numbers_per_voie (int): The median number of numbers of a street.
+    compress_level (int): The compression level of the files written.
+    header (:obj:`list` of str): The columns of the BAN files.
+
+"""
+import gzip
+import math
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from . import normalize as norm
+from .download import (raw_data_folder_path, ban_dpt_gz_file_name, dpt_list,
+                       completion_bar)
+
+scale = 0.01
+seed = 0
+departements = None
+communes_per_departement = 350
+addresses_per_commune = 250
+numbers_per_voie = 10
+compress_level = 1
+
+header = ['id_ban_position', 'id_ban_adresse', 'cle_interop', 'id_ban_group',
+          'id_fantoir', 'numero', 'suffixe', 'nom_voie', 'code_postal',
+          'nom_commune', 'code_insee', 'nom_complementaire', 'x', 'y', 'lon',
+          'lat', 'typ_loc', 'source', 'date_der_maj']
+
+syllables = ['ber', 'mon', 'ville', 'court', 'val', 'bois', 'champ', 'fon',
+             'tai', 'ne', 'ray', 'lan', 'gnac', 'ac', 'euil', 'ières', 'ange',
+             'roche', 'mar', 'pé', 'lé', 'cha', 'teau', 'ré', 'sau', 'vi',
+             'gny', 'mes', 'nil', 'lieu', 'ri', 'bour', 'gues', 'sel', 'lon',
+             'dé', 'cour', 'nay', 'ché', 'vaux', 'tin', 'pont', 'ar', 'gen']
+saints = ['Saint-Martin', 'Saint-Pierre', 'Saint-Jean', 'Saint-Germain',
+          'Saint-Laurent', 'Saint-Denis', 'Saint-Étienne', 'Saint-Hilaire',
+          'Saint-Aubin', 'Saint-Julien', 'Sainte-Marie', 'Sainte-Anne',
+          'Sainte-Foy', 'Sainte-Croix']
+rivers = ['Seine', 'Loire', 'Marne', 'Oise', 'Mer', 'Yonne', 'Rhône',
+          'Garonne', 'Orne', 'Saône', 'Meuse', 'Dordogne']
+articles = ['Le ', 'La ', 'Les ']
+voie_types = ['Rue', 'Chemin', 'Impasse', 'Allée', 'Avenue', 'Route',
+              'Place', 'Boulevard', 'Lotissement', 'Square', 'Quai',
+              'Hameau']
+voie_type_weights = [45, 15, 10, 7, 6, 6, 3, 2, 2, 2, 1, 1]
+voie_names = [
+    'Victor Hugo', 'Jean Jaurès', 'Pasteur', 'Émile Zola',
+    'du Général de Gaulle', 'Jean Moulin', 'Gambetta', 'Voltaire',
+    'Anatole France', 'Jules Ferry', 'Aristide Briand', 'Georges Clemenceau',
+    'Paul Bert', 'de la Libération', 'de la République', 'de la Paix',
+    'du 8 Mai 1945', 'du 11 Novembre', 'Marcel Pagnol', 'Albert Camus',
+    'Jean Monnet', 'Pierre Curie', 'Marie Curie', 'Frédéric Mistral',
+    'Lamartine', 'Alphonse Daudet', 'Molière', 'Racine', 'de la Gare',
+    'des Écoles', "de l'Église", 'du Moulin', 'du Château', 'des Lilas',
+    'des Peupliers', 'des Prés', 'des Vignes', 'du Stade', 'de la Mairie',
+    'du Lavoir', 'de la Fontaine', 'des Chênes', 'des Tilleuls', 'du Bois',
+    'des Jardins', 'du Port', 'de la Forêt', 'des Acacias', 'des Rosiers',
+    'du Marché', 'de la Poste', 'des Champs', 'du Calvaire', 'de la Croix',
+    'du Pont', 'des Sources', 'de la Vallée', 'des Vergers', 'des Maréchaux',
+    'Saint-Charles']
+lieux_dits = ['Le Bourg', 'La Croix Blanche', 'Les Granges', 'Le Moulin Neuf',
+              'La Haute Ville', 'Les Essarts', 'Le Petit Bois', 'La Grange',
+              'Les Hauts', 'Le Plessis']
+repetitions = ['bis', 'ter', 'a', 'b']
+repetition_weights = [70, 15, 10, 5]
+
+# The centers of the departements out of the grid of the metropolitan ones
+centers = {
+    '2A': (8.95, 41.85), '2B': (9.25, 42.4), '971': (-61.55, 16.2),
+    '972': (-61.0, 14.65), '973': (-53.0, 4.0), '974': (55.5, -21.1),
+    '975': (-56.3, 46.9), '976': (45.1, -12.8),
+}
+
+
+def get_center(departement):
+    """The longitude and the latitude of the center of a departement.
+
+    The metropolitan departements are laid on a grid over France.
+    """
+    if departement in centers:
+        return centers[departement]
+    i = int(departement) - 1
+    return (-4.5 + (i % 10 + 0.5) * 1.25, 42.5 + (i // 10 + 0.5) * 0.85)
+
+
+def get_codes(departement):
+    """The prefix of the INSEE codes of a departement, the number of INSEE
+    codes and the range (start, size) of its postal codes.
+    """
+    if departement == '2A':
+        return '2A', 999, (20000, 200)
+    if departement == '2B':
+        return '2B', 999, (20200, 800)
+    if len(departement) == 3:
+        return departement, 99, (int(departement) * 100, 100)
+    return departement, 999, (int(departement) * 1000, 1000)
+
+
+def choice(rng, values, weights=None):
+    if weights is None:
+        return values[int(rng.integers(len(values)))]
+    weights = np.asarray(weights, dtype='float64')
+    return values[int(rng.choice(len(values), p=weights / weights.sum()))]
+
+
+def make_word(rng):
+    word = ''.join(choice(rng, syllables)
+                   for _ in range(int(rng.integers(2, 4))))
+    return word.capitalize()
+
+
+def make_commune_name(rng):
+    draw = rng.random()
+    if draw < 0.12:
+        return choice(rng, saints)
+    name = make_word(rng)
+    if draw < 0.25:
+        name = choice(rng, articles) + name
+    if rng.random() < 0.1:
+        name += '-sur-' + choice(rng, rivers)
+    return name
+
+
+def make_names(count, make, rng, normalization):
+    """Names distinct once normalized.
+    """
+    names, keys = [], set()
+    while len(names) < count:
+        name = make(rng)
+        key = normalization(name)
+        for _ in range(3):
+            if key not in keys:
+                break
+            name = name + '-' + make_word(rng)
+            key = normalization(name)
+        if key and key not in keys:
+            keys.add(key)
+            names.append(name)
+    return names
+
+
+def make_voie_name(rng):
+    voie_type = choice(rng, voie_types, voie_type_weights)
+    if rng.random() < 0.7:
+        return voie_type + ' ' + choice(rng, voie_names)
+    return voie_type + ' de ' + make_word(rng)
+
+
+def get_numbers(rng):
+    """The numbers and the repetitions of the addresses of a street.
+    """
+    count = max(int(rng.lognormal(math.log(numbers_per_voie), 1.)), 1)
+    steps = rng.choice([1, 2, 3], size=count, p=[0.7, 0.2, 0.1])
+    numbers = np.minimum(np.cumsum(steps), 9999)
+    numbers = np.unique(numbers)
+
+    repeated = numbers[rng.random(len(numbers)) < 0.04]
+    suffixes = [''] * len(numbers) + [
+        choice(rng, repetitions, repetition_weights) for _ in repeated]
+    numbers = np.concatenate((numbers, repeated))
+    order = np.argsort(numbers, kind='stable')
+    return numbers[order], [suffixes[i] for i in order]
+
+
+def generate_departement(task):
+    """Write the synthetic BAN file of a departement.
+
+    Args:
+        task (:obj:`tuple`): The departement, the path of the file, the seed
+            and the scale.
+
+    Returns:
+        (int): The number of addresses written.
+
+    """
+    departement, file_path, task_seed, task_scale = task
+    rng = np.random.default_rng(
+        [task_seed] + [ord(char) for char in departement])
+
+    prefix, insee_count, (postal_start, postal_size) = get_codes(departement)
+    expected = communes_per_departement * task_scale * rng.lognormal(0, 0.5)
+    count = int(min(max(rng.poisson(expected), 1), insee_count))
+    # Larger communes when the INSEE codes are not enough for the scale
+    size_factor = max(expected / count, 1.)
+
+    names = make_names(count, make_commune_name, rng, norm.uniform_commune)
+    insee_numbers = np.sort(rng.choice(insee_count, count, replace=False)) + 1
+    sizes = rng.lognormal(math.log(addresses_per_commune), 1.45, count) * \
+        size_factor
+    insee_codes = ['%s%0*d' % (prefix, 5 - len(prefix), number)
+                   for number in insee_numbers]
+
+    # Groups of communes sharing a postal code, and postal codes of the
+    # largest communes
+    large = sizes > np.quantile(sizes, 0.98)
+    postal_counts = [int(rng.integers(2, 7)) if large[i] else 1
+                     for i in range(count)]
+    groups, order, i = [], rng.permutation(count), 0
+    while i < count:
+        size = int(rng.geometric(0.5))
+        groups.append(order[i: i + size])
+        i += size
+    total = sum(postal_counts) - count + len(groups)
+    codes = postal_start + np.sort(rng.choice(
+        postal_size, min(total, postal_size), replace=False))
+    codes = codes[rng.permutation(len(codes))]
+    commune_codes = [[] for _ in range(count)]
+    code_index = 0
+    for group in groups:
+        for commune in group:
+            commune_codes[commune].append(codes[code_index % len(codes)])
+        code_index += 1
+    for commune in range(count):
+        for _ in range(postal_counts[commune] - 1):
+            commune_codes[commune].append(codes[code_index % len(codes)])
+            code_index += 1
+
+    center = get_center(departement)
+    lines = [';'.join(header) + '\n']
+    for commune in range(count):
+        commune_center = center + rng.normal(0, 0.3, 2)
+        voie_count = max(int(sizes[commune] / (numbers_per_voie * 1.65)), 1)
+        radius = 0.003 + 0.0015 * math.sqrt(voie_count)
+        voies = make_names(voie_count, make_voie_name, rng,
+                           norm.uniform_adresse)
+        insee = insee_codes[commune]
+
+        for voie_id, voie in enumerate(voies):
+            postal_code = choice(rng, commune_codes[commune])
+            complement = choice(rng, lieux_dits) \
+                if rng.random() < 0.02 else ''
+            numbers, suffixes = get_numbers(rng)
+
+            start = commune_center + rng.normal(0, radius, 2)
+            angle = rng.uniform(0, 2 * math.pi)
+            direction = np.array([math.cos(angle), math.sin(angle)])
+            normal = np.array([-direction[1], direction[0]])
+            sides = np.where(numbers % 2, 1.5e-4, -1.5e-4)
+            positions = start + numbers[:, np.newaxis] * 1e-4 * direction + \
+                sides[:, np.newaxis] * normal + \
+                rng.normal(0, 2e-5, (len(numbers), 2))
+
+            fantoir = '%s_%04x' % (insee, voie_id)
+            template = ';;%s_%%05d%%s;;%s;%%d;%%s;%s;%05d;%s;%s;%s;;;' \
+                '%%.7f;%%.7f;entrée;commune;2024-01-01\n' % (
+                    fantoir, fantoir, voie, postal_code, names[commune],
+                    insee, complement)
+            for numero, suffix, (lon, lat) in zip(numbers, suffixes,
+                                                  positions):
+                lines.append(template % (
+                    numero, '_' + suffix if suffix else '', numero, suffix,
+                    lon, lat))
+
+    with gzip.open(file_path, 'wt', encoding='utf-8',
+                   compresslevel=compress_level) as ban_file:
+        ban_file.writelines(lines)
+    return len(lines) - 1
+
+
+def generate(folder=None, processes=None):
+    """Write the synthetic BAN files of the departements.
+
+    Args:
+        folder (str, optional): The folder of the files, the folder of the
+            files downloaded by default.
+        processes (int, optional): The number of processes (the number of CPUs
+            by default).
+
+    Returns:
+        (int): The number of addresses written.
+
+    """
+    folder = raw_data_folder_path if folder is None else folder
+    os.makedirs(folder, exist_ok=True)
+    names = dpt_list if departements is None else departements
+    tasks = [(departement,
+              os.path.join(folder, ban_dpt_gz_file_name.format(departement)),
+              seed, scale)
+             for departement in names]
+
+    processes = max(min(processes or os.cpu_count() or 1, len(tasks)), 1)
+    if processes > 1:
+        pool = Pool(processes)
+        mapping = pool.imap(generate_departement, tasks)
+    else:
+        pool, mapping = None, map(generate_departement, tasks)
+
+    total = 0
+    for i, addresses in enumerate(mapping):
+        total += addresses
+        completion_bar('Generating BAN', (i + 1) / len(tasks))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return total
+
+
+def generate_files(force=False):
+    """Write the synthetic BAN files from the command line.
+
+    Args:
+        force (bool, optional): If True, the BAN files already in the folder
+            of the files downloaded are replaced.
+
+    Returns:
+        (bool): True if the files were written.
+
+    """
+    begin = time.perf_counter()
+    names = dpt_list if departements is None else departements
+    unknown = [departement for departement in names
+               if departement not in dpt_list]
+    if unknown:
+        print('Unknown departements: %s' % ', '.join(unknown))
+        return False
+
+    existing = [departement for departement in names if os.path.isfile(
+        os.path.join(raw_data_folder_path,
+                     ban_dpt_gz_file_name.format(departement)))]
+    if existing and not force:
+        print('{} BAN file(s) already in {}, execute : '
+              'geocoding generate --force to replace them'.format(
+                  len(existing), raw_data_folder_path))
+        return False
+
+    total = generate()
+    print('%d addresses written in %.1f s' % (total,
+                                              time.perf_counter() - begin))
+    return True
+
+
+def regenerate_files():
+    return generate_files(force=True)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Execution traces of the search methods.
+
+With the argument explain, the methods position, position_insee and reverse
+add to their output a trace of their search under the key 'explain', to see
+why a search is slow or wrong:
+
+* method: The search method.
+* input: The input once normalized, as searched.
+* stages: The stages of the search (see metrics.stages) and their duration in
+  milliseconds, in order.
+* milliseconds: The duration of the whole search.
+* searches: The searches of the query methods, in order, each one with its
+  kind under the key search and its parameters and results. The kinds are:
+
+  * binary: Binary search of element in the rows start to end of a column of
+    a table, with the row id found (the position of element if not found).
+  * postal_code, code_insee: Search of a postal code or of an INSEE code,
+    with the ids of the records found.
+  * index: Binary search of element in a whole column of a table, through
+    its sorted index.
+  * narrow, wide: Similarity searches of element in the rows start to end of
+    a column of a table, first around the position of element and then in
+    all the rows of the parent record, with the threshold of the score, the
+    best score and the candidates with the best scores.
+  * similarity: Similarity search of element in some rows of a table, with
+    the same keys.
+  * ngram: Candidates of the trigram index, with their scores.
+  * place: Street chosen among candidates by the name of its city or by its
+    postal code.
+  * kdtree: Nearest node of the kd-tree, with its distance in degrees and the
+    number of nodes visited and pruned.
+
+The searches with explain do not read nor write the cache of the results.
+The trace is kept by the thread running the search, so the searches of other
+threads are not mixed in. Without explain, the query methods only check that
+their thread has no trace.
+
+Example:
+    >>> import geocoding
+    >>> output = geocoding.find('91120', 'Palaiseau', '12, Bd des Maréchaux',
+    ...                         explain=True)
+    >>> output['explain']['searches']
+
+Attributes:
+    candidate_limit (int): The number of candidates of a similarity search
+        kept in the trace, by decreasing score.
+
+"""
+import threading
+import time
+
+import numpy as np
+
+from . import metrics
+
+candidate_limit = 10
+
+local = threading.local()
+
+
+def to_python(value):
+    """Convert a value to a python object which can be encoded in JSON.
+    """
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bytes):
+        return value.decode('ascii')
+    elif isinstance(value, (list, tuple)):
+        return [to_python(element) for element in value]
+    elif isinstance(value, dict):
+        return {key: to_python(element) for key, element in value.items()}
+    return value
+
+
+class Trace(metrics.Timer):
+    """Trace of one search, timing its stages like metrics.Timer.
+
+    Attributes:
+        input (:obj:`dict`): The input once normalized.
+        searches (:obj:`list` of :obj:`dict`): The searches of the query
+            methods.
+
+    """
+
+    def __init__(self, method):
+        metrics.Timer.__init__(self, method)
+        self.input = {}
+        self.searches = []
+        self.total = None
+
+    def set_input(self, **values):
+        self.input = to_python(values)
+
+    def add(self, search, **values):
+        """Record a search of a query method.
+
+        Args:
+            search (str): The kind of the search.
+            **values: Its parameters and results.
+
+        """
+        record = {'search': search}
+        record.update(to_python(values))
+        self.searches.append(record)
+
+    def finish(self, quality, cached=False):
+        """Record the search in the metrics too, if they are enabled.
+        """
+        self.total = time.perf_counter() - self.begin
+        if metrics.enabled:
+            metrics.Timer.finish(self, quality, cached)
+
+    def to_dict(self):
+        if self.total is None:
+            self.total = time.perf_counter() - self.begin
+        return {
+            'method': self.method,
+            'input': self.input,
+            'stages': [{'stage': name, 'milliseconds': 1000 * seconds}
+                       for name, seconds in self.durations],
+            'milliseconds': 1000 * self.total,
+            'searches': self.searches,
+        }
+
+
+def current():
+    """The trace of the search running in this thread, or None.
+    """
+    return getattr(local, 'trace', None)
+
+
+def explain(method, name, *args):
+    """Run a search method with a trace, added to its output.
+
+    Args:
+        method (function): The search method.
+        name (str): The name of the search method.
+        *args: The arguments of the search method.
+
+    Returns:
+        (:obj:`dict`): The output of the search, with its trace under the
+            key 'explain'.
+
+    """
+    trace = Trace(name)
+    local.trace = trace
+    try:
+        output = method(*args)
+    finally:
+        local.trace = None
+    output = dict(output)
+    output['explain'] = trace.to_dict()
+    return output
+
+
+def get_candidates(names, indices, similarity):
+    """The records the most similar to the element searched, for a trace.
+
+    Args:
+        names (:obj:`numpy.ndarray`): The column of the names compared.
+        indices (:obj:`list` of int): The indices of the records compared.
+        similarity (function): The score of similarity to the element.
+
+    Returns:
+        (:obj:`list` of :obj:`dict`): The id, the name and the score of the
+            candidate_limit records with the best scores.
+
+    """
+    scores = sorted(((similarity(names[i]), int(i)) for i in indices),
+                    key=lambda score: -score[0])
+    return [{'id': i, 'name': names[i], 'score': score}
+            for score, i in scores[:candidate_limit]]
@@ -7,6 +7,8 @@ Attributes:
     SCALE (int): The scale conversion of float to int.
 
 """
+import numpy as np
+
 SCALE = 7
 
 
@@ -95,6 +97,43 @@ def binary_search(element, values, start, end, get_index):
     return (i, get_index(i))
 
 
+def search_sorted(values, element, sorter=None):
+    """Search element in a sorted array with numpy.searchsorted.
+
+    The same as binary_search over the whole array, without converting the
+    array to the type of element: the strings longer than the strings of the
+    array are searched by their prefix and the integers out of the range of
+    its type by its bounds.
+
+    Args:
+        values (:obj:`numpy.ndarray`): The values, sorted or sorted by sorter.
+        element (int, str or bytes): The element to search, of the same kind as
+            values.
+        sorter (:obj:`numpy.ndarray`, optional): The indices that sort values,
+            of type intp to be used without conversion.
+
+    Returns:
+        (int): The index in values (in sorter, if given) of the first value not
+            lower than element, or len(values) if there is none.
+
+    """
+    kind = values.dtype.kind
+    if kind in 'SU':
+        width = values.dtype.itemsize // (4 if kind == 'U' else 1)
+        if len(element) > width:
+            # The values lower than element are those not greater than its
+            # prefix
+            return int(np.searchsorted(values, element[:width], side='right',
+                                       sorter=sorter))
+    elif kind in 'iu':
+        info = np.iinfo(values.dtype)
+        if element > info.max:
+            return len(values)
+        element = max(element, info.min)
+
+    return int(np.searchsorted(values, element, sorter=sorter))
+
+
 def most_similar(indices, values, similarity):
     """Find the value with greatest score of similarity.
     """
@@ -18,15 +18,12 @@ setup(
         'Topic :: Utilities',
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ],
     keywords='Geocoder France',
     packages=['geocoding'],
-    install_requires=['numpy', 'Unidecode', 'KdQuery', 'sortedcontainers', 'requests'],
+    python_requires='>=3.7',
+    install_requires=['numpy', 'Unidecode', 'sortedcontainers', 'requests'],
     entry_points={
         'console_scripts': [
             'geocoding = geocoding.__main__:main'
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Tests of the download of the BAN files against a local HTTP server.
+
+The server serves the files of its attribute files, with the headers ETag
+and Last-Modified, and answers the requests with a Range header with a
+partial content (206) when their If-Range header is the current ETag, as
+the BAN server does. With ignore_range, it always sends the whole file (200),
+and with truncate, it stops sending the content of a file after truncate
+bytes, to interrupt a download. Every request is recorded, so the tests can
+check which files were downloaded.
+
+Run with:
+    $ python -m unittest discover tests
+
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+from geocoding import download
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self.send_file(head=True)
+
+    def do_GET(self):
+        self.send_file(head=False)
+
+    def send_file(self, head):
+        server = self.server
+        name = self.path.lstrip('/')
+        server.requests.append((self.command, name,
+                                self.headers.get('Range'),
+                                self.headers.get('If-Range')))
+        if name not in server.files:
+            self.send_error(404)
+            return
+
+        content = server.files[name]
+        etag = server.etags.get(name, '"v1"')
+        start = 0
+        ranges = self.headers.get('Range')
+        if ranges is not None and not server.ignore_range and \
+                self.headers.get('If-Range') == etag:
+            start = int(ranges[len('bytes='):].rstrip('-'))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(content))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d'
+                             % (start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.end_headers()
+        if not head:
+            end = len(content)
+            if server.truncate is not None:
+                end = min(end, start + server.truncate)
+            self.wfile.write(content[start:end])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        raw = os.path.join(self.folder, 'raw')
+        content = os.path.join(self.folder, 'content')
+        os.mkdir(raw)
+        os.mkdir(content)
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.files = {
+            '': b'ban-01.csv.gz\nban-02.csv.gz\n',
+            'ban-01.csv.gz': os.urandom(100000),
+            'ban-02.csv.gz': os.urandom(50000),
+        }
+        self.server.etags = {}
+        self.server.requests = []
+        self.server.ignore_range = False
+        self.server.truncate = None
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        url = 'http://127.0.0.1:%d/{}' % self.server.server_port
+        patches = {
+            'ban_url': url,
+            'dpt_list': ['01', '02'],
+            'raw_data_folder_path': raw,
+            'content_folder_path': content,
+            'server_content_file_name': os.path.join(content, 'server.txt'),
+            'local_content_file_name': os.path.join(content, 'local.txt'),
+            'manifest_file_name': os.path.join(content, 'manifest.json'),
+            'download_chunk_size': 4096,
+        }
+        for name, value in patches.items():
+            patch = mock.patch.object(download, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.session = download.get_session()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def get_path(self, name):
+        return os.path.join(download.raw_data_folder_path, name)
+
+    def interrupt(self, name, size):
+        # Download the first size bytes of a file and then fail
+        self.server.truncate = size
+        with self.assertRaises(download.requests.RequestException):
+            download.download_ban_dpt_file(self.session, name, None)
+        self.server.truncate = None
+        partial_path = self.get_path(name) + download.partial_suffix
+        self.assertEqual(os.path.getsize(partial_path), size)
+        self.assertFalse(os.path.exists(self.get_path(name)))
+        self.server.requests = []
+
+    def check_file(self, name, entry):
+        content = self.server.files[name]
+        with open(self.get_path(name), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(entry['size'], len(content))
+        self.assertEqual(entry['md5'], hashlib.md5(content).hexdigest())
+        self.assertEqual(entry['etag'], self.server.etags.get(name, '"v1"'))
+        for suffix in (download.partial_suffix,
+                       download.partial_suffix + download.version_suffix):
+            self.assertFalse(os.path.exists(self.get_path(name) + suffix))
+
+    def get_requests(self, command):
+        return [request for request in self.server.requests
+                if request[0] == command]
+
+    def test_download(self):
+        name = 'ban-01.csv.gz'
+        entry = download.download_ban_dpt_file(self.session, name, None)
+        self.check_file(name, entry)
+        self.assertEqual(self.get_requests('GET'),
+                         [('GET', name, None, None)])
+
+    def test_resume(self):
+        name = 'ban-01.csv.gz'
+        self.interrupt(name, 32768)
+        entry = download.download_ban_dpt_file(self.session, name, None)
+        self.check_file(name, entry)
+        self.assertEqual(self.get_requests('GET'),
+                         [('GET', name, 'bytes=32768-', '"v1"')])
+
+    def test_resume_changed_file(self):
+        # The file changed on the server since the partial download: the
+        # server does not send the end of the new version after the start of
+        # the old one, but the whole new version
+        name = 'ban-01.csv.gz'
+        self.interrupt(name, 32768)
+        self.server.files[name] = os.urandom(80000)
+        self.server.etags[name] = '"v2"'
+        entry = download.download_ban_dpt_file(self.session, name, None)
+        self.check_file(name, entry)
+        self.assertEqual(self.get_requests('GET'),
+                         [('GET', name, 'bytes=32768-', '"v1"')])
+
+    def test_server_ignoring_range(self):
+        name = 'ban-01.csv.gz'
+        self.interrupt(name, 32768)
+        self.server.ignore_range = True
+        entry = download.download_ban_dpt_file(self.session, name, None)
+        self.check_file(name, entry)
+        self.assertEqual(self.get_requests('GET'),
+                         [('GET', name, 'bytes=32768-', '"v1"')])
+
+    def test_skip_files_in_manifest(self):
+        self.assertTrue(download.get_ban_file())
+        manifest = download.load_manifest()
+        self.assertEqual(sorted(manifest), ['ban-01.csv.gz', 'ban-02.csv.gz'])
+        for name, entry in manifest.items():
+            self.check_file(name, entry)
+
+        # Nothing is downloaded while the content of the server is the same
+        self.server.requests = []
+        self.assertFalse(download.get_ban_file())
+        self.assertEqual(self.get_requests('HEAD'), [])
+
+        # A new content: only the files of a new version are downloaded
+        self.server.files[''] += b'new\n'
+        self.server.etags['ban-02.csv.gz'] = '"v2"'
+        self.server.requests = []
+        self.assertTrue(download.get_ban_file())
+        self.assertEqual([request[1] for request in self.get_requests('GET')],
+                         ['', 'ban-02.csv.gz'])
+        self.assertEqual(len(self.get_requests('HEAD')), 2)
+        self.assertEqual(download.load_manifest()['ban-01.csv.gz'],
+                         manifest['ban-01.csv.gz'])
+
+
+if __name__ == '__main__':
+    unittest.main()